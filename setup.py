@@ -15,6 +15,7 @@ setup(
             "copy-subscriptions-to-account = lae_automation.opstools:copy_subscriptions_to_account",
             "move-stripe-subscriptions-to-chargebee = lae_automation.opstools:move_stripe_subscriptions_to_chargebee",
             "reinvite-customer = lae_automation.opstools:reinvite_customer",
+            "migrate-subscription-database = lae_automation.opstools:migrate_subscription_database",
         ],
     },
     dependency_links=[
@@ -12,11 +12,17 @@ This module is used with ``twisted.application.service.ServiceMaker`` in
 expose this code via ``twist`` and ``twistd``.
 """
 
-from twisted.python.log import msg
 # Rename this so we can have a module attribute named Options.  Stick with the
 # attribute-import style (as opposed to just importing ``usage``) to get early
 # warning of mistakes.
-from twisted.python.usage import Options as _Options
+from os import environ
+from json import dumps, loads
+from sys import executable
+from tempfile import mkdtemp
+
+from twisted.python.usage import Options as _Options, UsageError
+from twisted.python.filepath import FilePath
+from twisted.internet.interfaces import IStreamClientEndpoint
 from twisted.internet.defer import Deferred
 from twisted.internet.protocol import Factory, Protocol
 from twisted.internet.endpoints import TCP4ClientEndpoint, serverFromString
@@ -26,7 +32,11 @@ from twisted.application.internet import StreamServerEndpointService, TimerServi
 from foolscap.tokens import BananaError, NegotiationError
 from foolscap.util import isSubstring
 
-from pyrsistent import freeze, pmap, pset
+from zope.interface import implementer
+
+import attr
+
+from pyrsistent import freeze, pmap
 
 from eliot import (
     Message,
@@ -34,20 +44,27 @@ from eliot import (
 )
 from eliot.twisted import DeferredContext
 
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 from lae_util import (
     opt_metrics_port,
 )
+from lae_util._prometheus import multiprocess_registry, error_metrics_service
 
 from lae_util.service import AsynchronousService
 from lae_util.eliot_destination import (
     eliot_logging_service,
-    opt_eliot_destination,
+    opt_eliot_destination as _opt_eliot_destination,
 )
-from lae_automation.kubeclient import KubeClient
+from lae_automation.kubeclient import KubeClient, ListWatchService
 from lae_automation.subscription_converger import (
     KubernetesClientOptionsMixin, get_customer_grid_pods, divert_errors_to_log,
+    customer_grid_selector,
+)
+
+from ._workers import (
+    _ReusePortEndpoint, _RouteFeedService, _WorkerPool,
+    worker_environment, worker_destination,
 )
 
 
@@ -58,14 +75,84 @@ class Options(_Options, KubernetesClientOptionsMixin):
     """
     optParameters = [
         ("interval", None, 10.0,
-         "The interval (in seconds) at which to iterate on reconfiguration.", float,
+         "The interval (in seconds) at which to iterate on reconfiguration.  "
+         "With --watch, the delay before listing again after an error.",
+         float,
+        ),
+        ("high-water-mark", None, 2 ** 16,
+         "The number of bytes which may be buffered for delivery to one side "
+         "of a proxied connection before reading from the other side is "
+         "paused.",
+         int,
+        ),
+        ("max-header-size", None, 4096,
+         "The maximum size in bytes of a Foolscap negotiation header.",
+         int,
+        ),
+        ("negotiation-timeout", None, 120.0,
+         "The number of seconds a client has to send a complete Foolscap "
+         "negotiation header.",
+         float,
+        ),
+        ("connect-timeout", None, 30.0,
+         "The number of seconds to wait for a connection to a Tahoe-LAFS "
+         "node before giving up on it.",
+         float,
+        ),
+        ("park-limit", None, 0,
+         "The number of connections for tubs which are not yet routable to "
+         "hold open in the hope that they soon will be.  With 0, such "
+         "connections are rejected right away.",
+         int,
+        ),
+        ("park-timeout", None, 30.0,
+         "The number of seconds to hold a connection for a tub which is not "
+         "yet routable.",
+         float,
+        ),
+        ("workers", None, 0,
+         "The number of worker processes to proxy connections.  With 0, "
+         "connections are proxied by this process.  Otherwise, this process "
+         "only tracks the routes and shares them with the workers.",
+         int,
+        ),
+        ("route-snapshot", None, None,
+         "A file in which to save the routes from time to time.  The routes "
+         "in it are used at startup until Kubernetes has been consulted so "
+         "that clients are not rejected while the router restarts.",
+        ),
+        ("route-snapshot-interval", None, 10.0,
+         "The interval (in seconds) at which to save changed routes to the "
+         "--route-snapshot file.",
+         float,
+        ),
+        # Used by the coordinator to start workers.  Not for general use.
+        ("worker-index", None, None,
+         "Run as the given worker of a coordinating grid router.",
+         int,
+        ),
+    ]
+
+    optFlags = [
+        ("watch", None,
+         "Keep a Kubernetes watch open on the customer grid pods and apply "
+         "changes as they happen instead of listing all pods every interval.",
         ),
     ]
 
-    opt_eliot_destination = opt_eliot_destination
+    def opt_eliot_destination(self, description):
+        # Keep the description around so it can be given to workers.
+        self.setdefault("destination-descriptions", []).append(description)
+        _opt_eliot_destination(self, description)
+
+    opt_eliot_destination.__doc__ = _opt_eliot_destination.__doc__
 
     def postOptions(self):
-        KubernetesClientOptionsMixin.postOptions(self)
+        if self["workers"] < 0:
+            raise UsageError("--workers must not be negative")
+        if self["worker-index"] is None:
+            # Workers get their routes from the coordinator, not Kubernetes.
+            KubernetesClientOptionsMixin.postOptions(self)
 
 
 
@@ -93,15 +180,51 @@ def makeService(options, reactor=None):
         options.get("destinations", []),
     ).setServiceParent(parent)
 
+    config = _ProxyConfiguration.from_options(options)
+
+    if options["worker-index"] is not None:
+        # Metrics are published by the coordinator.
+        grid_router_worker_service(reactor, config).setServiceParent(parent)
+        return parent
+
+    if options["workers"]:
+        metrics_dir = FilePath(mkdtemp(prefix="grid-router-metrics-"))
+        workers = _WorkerPool(
+            reactor,
+            options["workers"],
+            lambda index: _worker_argv(options, index),
+            worker_environment(environ, metrics_dir),
+            metrics_dir,
+        )
+        registry = multiprocess_registry(metrics_dir.path)
+    else:
+        workers = None
+        registry = None
+
+    # Start routing right away (with snapshot routes, if there are any)
+    # instead of waiting for the Kubernetes client.
+    router = _GridRouterService(reactor, config)
+    router.setServiceParent(parent)
+    if options["route-snapshot"] is not None:
+        _RouteSnapshotService(
+            reactor,
+            options["route-snapshot-interval"],
+            FilePath(options["route-snapshot"]),
+            router,
+        ).setServiceParent(parent)
+    _router_frontend_service(reactor, router, workers).setServiceParent(parent)
+
     def make_service():
         kubernetes = options.get_kubernetes_service(reactor)
         d = kubernetes.versioned_client()
         d.addCallback(
-            lambda client: grid_router_service(
+            lambda client: _router_updater_service(
                 reactor,
                 client,
                 options["kubernetes-namespace"].decode("ascii"),
                 options["interval"],
+                options["watch"],
+                router,
             )
         )
         return d
@@ -109,34 +232,196 @@ def makeService(options, reactor=None):
     service = AsynchronousService(make_service)
     service.setServiceParent(parent)
 
-    options.get_metrics_service(reactor).setServiceParent(parent)
+    options.get_metrics_service(reactor, registry).setServiceParent(parent)
 
     return parent
 
 
 
-def grid_router_service(reactor, k8s, kubernetes_namespace, interval):
+def _worker_argv(options, index):
+    """
+    Compute the command line for one grid router worker process.
+
+    :param Options options: The coordinator's options.
+
+    :param int index: The index of the worker.
+
+    :return list[bytes]: The command line.
+    """
+    def option(value):
+        return u"{}".format(value).encode("ascii")
+
+    argv = [
+        executable, b"-m", b"twisted", b"s4-grid-router",
+        b"--worker-index", option(index),
+        b"--high-water-mark", option(options["high-water-mark"]),
+        b"--max-header-size", option(options["max-header-size"]),
+        b"--negotiation-timeout", option(options["negotiation-timeout"]),
+        b"--connect-timeout", option(options["connect-timeout"]),
+        b"--park-limit", option(options["park-limit"]),
+        b"--park-timeout", option(options["park-timeout"]),
+    ]
+    for description in options.get("destination-descriptions", []):
+        argv.extend([
+            b"--eliot-destination", worker_destination(description, index),
+        ])
+    return argv
+
+
+
+def _router_updater_service(reactor, k8s, kubernetes_namespace, interval, watch, router):
+    """
+    Create an ``IService`` which keeps a router's routes up to date with the
+    customer grid pods in Kubernetes.
+    """
+    if watch:
+        return _router_watch_service(reactor, interval, k8s, kubernetes_namespace, router)
+    return _RouterUpdateService(reactor, interval, k8s, kubernetes_namespace, router)
+
+
+
+def _router_frontend_service(reactor, router, workers):
+    """
+    Create an ``IService`` which accepts client connections for a router,
+    either itself or using worker processes.
+    """
+    if workers is None:
+        return StreamServerEndpointService(
+            serverFromString(reactor, "tcp:10000"),
+            router.factory(),
+        )
+    # A watch can deliver a burst of pod events together.  Only send the
+    # workers the routes they end up with.
+    router.observe(_CoalescingObserver(
+        reactor,
+        lambda route_mapping: workers.routes_changed(
+            _routes_to_json(route_mapping),
+        ),
+    ))
+    return workers
+
+
+
+@attr.s
+class _CoalescingObserver(object):
+    """
+    Pass route mappings on to another observer at most once per reactor
+    iteration.
+
+    :ivar _clock: The ``IReactorTime`` with which to schedule delivery.
+
+    :ivar _observer: A one-argument callable to call with the most recent
+        route mapping.
+
+    :ivar _latest: The most recent route mapping not yet passed on.
+
+    :ivar _pending: The ``IDelayedCall`` which will pass on ``_latest`` or
+        ``None`` if there is nothing to pass on.
+    """
+    _clock = attr.ib()
+    _observer = attr.ib()
+    _latest = attr.ib(default=None)
+    _pending = attr.ib(default=None)
+
+    def __call__(self, route_mapping):
+        self._latest = route_mapping
+        if self._pending is None:
+            self._pending = self._clock.callLater(0, self._deliver)
+
+
+    def _deliver(self):
+        self._pending = None
+        route_mapping, self._latest = self._latest, None
+        self._observer(route_mapping)
+
+
+
+def grid_router_worker_service(reactor, config):
     """
-    Create an ``IService`` which can route connections to the correct grid.
+    Create an ``IService`` which proxies connections using routes supplied by
+    a coordinating grid router on stdin.
+
+    The listening port is shared with the other workers.
     """
     service = _GridRouterParent()
     service.setName(_GridRouterService.name)
 
-    router = _GridRouterService(reactor)
+    router = _GridRouterService(reactor, config)
     router.setServiceParent(service)
 
-    updater = _RouterUpdateService(reactor, interval, k8s, kubernetes_namespace, router)
-    updater.setServiceParent(service)
+    _RouteFeedService(
+        reactor,
+        lambda serialized: router.set_route_mapping(_routes_from_json(serialized)),
+    ).setServiceParent(service)
 
     StreamServerEndpointService(
-        serverFromString(reactor, "tcp:10000"),
+        _ReusePortEndpoint(reactor, 10000),
         router.factory(),
     ).setServiceParent(service)
 
+    # The coordinator reads metrics from files which are only updated when a
+    # value is set.
+    sampler = TimerService(1.0, _sample_buffered_bytes)
+    sampler.clock = reactor
+    sampler.setServiceParent(service)
+
+    error_metrics_service().setServiceParent(service)
+
     return service
 
 
 
+@attr.s(frozen=True)
+class _ProxyConfiguration(object):
+    """
+    Limits which apply to each connection handled by the grid router.
+
+    :ivar int high_water_mark: The number of bytes to buffer for one side of
+        a proxied connection before pausing the other side.
+
+    :ivar int max_header_size: The largest Foolscap negotiation header to
+        accept.
+
+    :ivar float negotiation_timeout: The number of seconds a client has to
+        send a complete negotiation header.
+
+    :ivar float connect_timeout: The number of seconds to wait for a
+        connection to a Tahoe-LAFS node.
+
+    :ivar float probe_initial_delay: The number of seconds to reject clients
+        of a route after its node is first found to be unreachable.
+
+    :ivar float probe_max_delay: The longest the delay between attempts to
+        reach an unreachable node may grow to.
+
+    :ivar int park_limit: The largest number of connections to hold for tubs
+        which are not yet routable.
+
+    :ivar float park_timeout: The number of seconds to hold such a
+        connection.
+    """
+    high_water_mark = attr.ib(default=2 ** 16)
+    max_header_size = attr.ib(default=4096)
+    negotiation_timeout = attr.ib(default=120.0)
+    connect_timeout = attr.ib(default=30.0)
+    probe_initial_delay = attr.ib(default=1.0)
+    probe_max_delay = attr.ib(default=60.0)
+    park_limit = attr.ib(default=0)
+    park_timeout = attr.ib(default=30.0)
+
+    @classmethod
+    def from_options(cls, options):
+        return cls(
+            high_water_mark=options["high-water-mark"],
+            max_header_size=options["max-header-size"],
+            negotiation_timeout=options["negotiation-timeout"],
+            connect_timeout=options["connect-timeout"],
+            park_limit=options["park-limit"],
+            park_timeout=options["park-timeout"],
+        )
+
+
+
 class _GridRouterParent(MultiService):
     """
     A service container for the services that make up the grid router.
@@ -155,28 +440,205 @@ class _GridRouterParent(MultiService):
 
 
 
+_NEGOTIATION_SECONDS = Histogram(
+    u"grid_router_negotiation_seconds",
+    u"Time from accepting a connection to parsing its Foolscap negotiation "
+    u"header.",
+)
+
+_NEGOTIATION_ERRORS = Counter(
+    u"grid_router_negotiation_errors",
+    u"Connections rejected by grid-router before proxying, by reason.",
+    [u"reason"],
+)
+
+_BACKEND_CONNECT_SECONDS = Histogram(
+    u"grid_router_backend_connect_seconds",
+    u"Time taken to connect to a Tahoe-LAFS node.",
+    [u"tub_kind"],
+)
+
+_CONNECTION_SECONDS = Histogram(
+    u"grid_router_connection_seconds",
+    u"Lifetime of connections proxied by grid-router to Tahoe-LAFS.",
+    [u"tub_kind"],
+    buckets=[1, 10, 60, 300, 1800, 3600, 4 * 3600, 12 * 3600, 24 * 3600, float("inf")],
+)
+
+_RELAYED_BYTES = Histogram(
+    u"grid_router_relayed_bytes",
+    u"Bytes relayed in one direction over one proxied connection.",
+    [u"direction", u"tub_kind"],
+    buckets=[2 ** n for n in range(10, 37, 3)] + [float("inf")],
+)
+
+
+
+class _UnknownTubID(NegotiationError):
+    """
+    A client asked for a tub which is not known to the router.
+    """
+
+
+
+class _TubIDNotReady(NegotiationError):
+    """
+    A client asked for a tub the pod of which does not yet have an address.
+    """
+
+
+
+class _TubIDUnhealthy(NegotiationError):
+    """
+    A client asked for a tub the pod of which could not be reached recently.
+    """
+
+
+
 class _FoolscapProxy(Protocol):
     """
     A protocol which speaks just enough of the first part of a Foolscap
     conversation to extract the TubID so that a proxy target can be selected
     based on that value.
 
-    :ivar bytes buffered: Data which has been received and buffered but not
-        yet interpreted or passed on.
+    Each chunk of data is only searched once for the end of the header.  A
+    client which sends too large a header or which takes too long to send it
+    is disconnected.
+
+    :ivar list[bytes] _buffered: Data which has been received and buffered
+        but not yet interpreted or passed on.
+
+    :ivar int _buffered_length: The total length of ``_buffered``.
+
+    :ivar bytes _tail: The last few bytes of ``_buffered`` which could be the
+        start of a header terminator split across chunks.
+
+    :ivar _timeout: The ``IDelayedCall`` which will disconnect the client if
+        it does not finish negotiation in time, or ``None`` once negotiation
+        is over.
+
+    :ivar float _accepted: The time at which the connection was accepted.
+
+    :ivar _parked: While the connection is waiting for its tub to become
+        routable, a two-tuple of the header (and anything received after it)
+        and the tub identifier.  Otherwise, ``None``.  The transport is
+        paused for as long as the connection is parked.
     """
-    buffered = b""
+    _terminator = b"\r\n\r\n"
+    _timeout = None
+    _parked = None
+
+    def connectionMade(self):
+        self._accepted = self.factory.reactor.seconds()
+        self._buffered = []
+        self._buffered_length = 0
+        self._tail = b""
+        self._timeout = self.factory.reactor.callLater(
+            self.factory.config.negotiation_timeout,
+            self._reject,
+            u"negotiation timed out",
+            u"timeout",
+        )
+
+
+    def connectionLost(self, reason):
+        self._cancel_timeout()
+        if self._parked is not None:
+            header, tub_id = self._parked
+            self._parked = None
+            self.factory.parking.abandon(tub_id, self)
+
+
+    def _cancel_timeout(self):
+        if self._timeout is not None:
+            if self._timeout.active():
+                self._timeout.cancel()
+            self._timeout = None
+
+
+    def _reject(self, description, reason):
+        """
+        Give up on the client without doing any more work on its behalf.
+
+        :param unicode description: A human-readable explanation.
+
+        :param unicode reason: The category of the problem, for metrics.
+        """
+        self._cancel_timeout()
+        self._buffered = []
+        _NEGOTIATION_ERRORS.labels(reason).inc()
+        Message.log(event_type=u"grid-router:reject", reason=description)
+        self.transport.abortConnection()
+
 
     def dataReceived(self, data):
         """
         Buffer the received data until enough is received that we can determine a
         proxy destination.
         """
-        msg("_FoolscapProxy.dataReceived {!r}".format(data))
-        self.buffered += data
-        if b"\r\n\r\n" in self.buffered:
-            header = self.buffered
-            self.buffered = b""
+        if self._parked is not None:
+            # Reading is paused but some data may already have been on its
+            # way.  It belongs to the conversation so pass it on later.
+            header, tub_id = self._parked
+            self._parked = (header + data, tub_id)
+            return
+
+        if self._timeout is None:
+            # Negotiation is over (one way or another).  Anything else the
+            # client sends is of no interest to us.
+            return
+
+        # Only the new data and the few bytes before it need to be searched.
+        found = (self._tail + data).find(self._terminator) != -1
+
+        self._buffered.append(data)
+        self._buffered_length += len(data)
+        self._tail = (self._tail + data)[-(len(self._terminator) - 1):]
+
+        if not found:
+            if self._buffered_length > self.factory.config.max_header_size:
+                self._reject(u"header too long", u"header_too_long")
+            return
+
+        self._cancel_timeout()
+        _NEGOTIATION_SECONDS.observe(
+            self.factory.reactor.seconds() - self._accepted,
+        )
+        header = b"".join(self._buffered)
+        self._buffered = []
+        try:
             self.handlePLAINTEXTServer(header)
+        except (BananaError, NegotiationError) as e:
+            self._negotiation_failed(e)
+
+
+    def _negotiation_failed(self, e):
+        """
+        Reject the client for the reason given by an exception.
+        """
+        if isinstance(e, _UnknownTubID):
+            reason = u"unknown_tub"
+        elif isinstance(e, _TubIDNotReady):
+            reason = u"tub_not_ready"
+        elif isinstance(e, _TubIDUnhealthy):
+            reason = u"tub_unhealthy"
+        else:
+            reason = u"malformed_header"
+        self._reject(u"{}".format(e), reason)
+
+
+    def unparked(self):
+        """
+        Try again to route a connection which was parked.  This happens when
+        its tub becomes routable or when it has waited as long as it may.
+        """
+        header, tub_id = self._parked
+        self._parked = None
+        self.transport.resumeProducing()
+        try:
+            self._handleTubRequest(header, tub_id, park=False)
+        except NegotiationError as e:
+            self._negotiation_failed(e)
 
     # Basically just copied from foolscap/negotiate.py so we get the tub id
     # extraction logic but we can then do something different with it.
@@ -210,7 +672,7 @@ class _FoolscapProxy(Protocol):
         self._handleTubRequest(header, targetTubID)
 
 
-    def _handleTubRequest(self, header, targetTubID):
+    def _handleTubRequest(self, header, targetTubID, park=True):
         """
         Proxy to the destination which is responsible for the target TubID.
 
@@ -218,21 +680,290 @@ class _FoolscapProxy(Protocol):
             will need to be passed along to the proxy target.
 
         :param bytes targetTubID: The TubID which was requested.
+
+        :param bool park: If the tub is not routable, whether to wait for it
+            to become routable (if there is room) instead of failing.
         """
-        try:
-            _, (ip, port_number) = self.factory.route_mapping()[targetTubID]
-        except KeyError:
-            raise NegotiationError("unknown TubID %s" % (targetTubID,))
+        route = self.factory.route_mapping().get(targetTubID)
+        if route is None or not route.ip:
+            if park and self.factory.parking.park(targetTubID, self):
+                self._parked = (header, targetTubID)
+                # Leave anything else the client sends in the kernel until
+                # there is somewhere to send it.
+                self.transport.pauseProducing()
+                return
+            if route is None:
+                raise _UnknownTubID("unknown TubID %s" % (targetTubID,))
+            raise _TubIDNotReady("TubID not yet available %s" % (targetTubID,))
+
+        health = self.factory.health
+        if not health.check(targetTubID, route):
+            raise _TubIDUnhealthy("TubID temporarily unreachable %s" % (targetTubID,))
+
+        # Now proxy to ip:port
+        endpoint = _ObservedEndpoint(
+            TCP4ClientEndpoint(
+                self.factory.reactor,
+                route.ip,
+                route.port,
+                timeout=self.factory.config.connect_timeout,
+            ),
+            lambda: health.connected(targetTubID),
+            lambda: health.connect_failed(targetTubID, route),
+        )
+        d = proxy(
+            self,
+            endpoint,
+            header,
+            self.factory.config.high_water_mark,
+            self.factory.reactor,
+            route.kind,
+        )
+        # The proxy action has already logged any failure.
+        d.addErrback(lambda reason: None)
+
+
+
+@implementer(IStreamClientEndpoint)
+@attr.s(frozen=True)
+class _ObservedEndpoint(object):
+    """
+    A client endpoint which reports the outcome of each connection attempt.
+
+    :ivar endpoint: The ``IStreamClientEndpoint`` which really connects.
+
+    :ivar connected: A no-argument callable to call when a connection attempt
+        succeeds.
+
+    :ivar failed: A no-argument callable to call when a connection attempt
+        fails.
+    """
+    endpoint = attr.ib()
+    connected = attr.ib()
+    failed = attr.ib()
+
+    def connect(self, factory):
+        d = self.endpoint.connect(factory)
+        def succeeded(protocol):
+            self.connected()
+            return protocol
+        def failed(reason):
+            self.failed()
+            return reason
+        d.addCallbacks(succeeded, failed)
+        return d
+
+
+
+@attr.s
+class _ParkingLot(object):
+    """
+    Hold connections for tubs which are not yet routable until they are, up
+    to a limit on the number of connections and the time each is held.
+
+    Each parked connection is an object with an ``unparked`` method.  This is
+    called when the connection's tub becomes routable or when the connection
+    has been parked for ``timeout`` seconds, whichever comes first.
+
+    :ivar int limit: The largest number of connections to hold.
+
+    :ivar float timeout: The number of seconds to hold each connection.
+
+    :ivar dict _parked: A mapping from tub identifier to a mapping from parked
+        connection to the ``IDelayedCall`` which will give up on it.
+    """
+    _waiting = Gauge(
+        u"grid_router_parked_connections",
+        u"Current count of connections held by grid-router for tubs which "
+        u"are not yet routable.",
+        multiprocess_mode="livesum",
+    )
+
+    _outcomes = Counter(
+        u"grid_router_parking_outcomes",
+        u"Connections which stopped being held by grid-router, by outcome.",
+        [u"outcome"],
+    )
+
+    clock = attr.ib()
+    limit = attr.ib()
+    timeout = attr.ib()
+    _parked = attr.ib(default=attr.Factory(dict))
+    _count = attr.ib(default=0)
+
+    def park(self, tub_id, connection):
+        """
+        Hold a connection until its tub is routable.
+
+        :return bool: ``True`` if the connection is parked, ``False`` if
+            there is no room for it.
+        """
+        if self._count >= self.limit:
+            return False
+        self._parked.setdefault(tub_id, {})[connection] = self.clock.callLater(
+            self.timeout, self._expire, tub_id, connection,
+        )
+        self._count += 1
+        self._waiting.inc()
+        Message.log(event_type=u"grid-router:park", tub_id=tub_id)
+        return True
+
+
+    def abandon(self, tub_id, connection):
+        """
+        Stop holding a connection (because it was closed).
+        """
+        if self._remove(tub_id, connection):
+            self._outcomes.labels(u"abandoned").inc()
+
+
+    def routes_changed(self, route_mapping):
+        """
+        Release the connections for tubs which have become routable.
+
+        :param route_mapping: The current route mapping.
+        """
+        for tub_id in list(self._parked):
+            route = route_mapping.get(tub_id)
+            if route is not None and route.ip:
+                for connection in list(self._parked[tub_id]):
+                    self._remove(tub_id, connection)
+                    self._outcomes.labels(u"routed").inc()
+                    connection.unparked()
+
+
+    def _expire(self, tub_id, connection):
+        if self._remove(tub_id, connection):
+            self._outcomes.labels(u"expired").inc()
+            connection.unparked()
+
+
+    def _remove(self, tub_id, connection):
+        """
+        :return bool: ``True`` if the connection was parked, ``False``
+            otherwise.
+        """
+        connections = self._parked.get(tub_id, {})
+        delayed = connections.pop(connection, None)
+        if delayed is None:
+            return False
+        if not connections:
+            del self._parked[tub_id]
+        if delayed.active():
+            delayed.cancel()
+        self._count -= 1
+        self._waiting.dec()
+        return True
+
+
+
+@attr.s
+class _Unreachable(object):
+    """
+    The health state of a route the node of which could not be reached.
+
+    :ivar _Route route: The route which could not be reached.
+
+    :ivar int failures: The number of consecutive failed attempts.
+
+    :ivar float retry_at: The time before which clients are rejected.
+
+    :ivar bool probing: Whether a client has been allowed through to see if
+        the node is reachable again and the outcome is not yet known.
+    """
+    route = attr.ib()
+    failures = attr.ib(default=0)
+    retry_at = attr.ib(default=0)
+    probing = attr.ib(default=False)
+
 
-        if not ip:
-            raise NegotiationError("TubID not yet available %s" % (targetTubID,))
 
-        # Now proxy to ip:port_number
-        proxy(self, TCP4ClientEndpoint(self.factory.reactor, ip, port_number), header)
+@attr.s
+class _RouteHealth(object):
+    """
+    Track routes the nodes of which cannot be reached so clients of those
+    routes can be rejected right away instead of each waiting on a connection
+    attempt of their own.
 
+    After a failure, clients are rejected for ``initial_delay`` seconds.  Then
+    one client is let through as a probe.  If the probe fails too, the delay
+    doubles (up to ``max_delay``).  As soon as a connection succeeds, the
+    route is healthy again.
 
+    Only unhealthy routes are tracked.
 
-def proxy(upstream, endpoint, header):
+    :ivar dict _unreachable: Unhealthy routes as a mapping from tub
+        identifier to ``_Unreachable``.
+    """
+    clock = attr.ib()
+    initial_delay = attr.ib(default=1.0)
+    max_delay = attr.ib(default=60.0)
+    _unreachable = attr.ib(default=attr.Factory(dict))
+
+    def check(self, tub_id, route):
+        """
+        Decide whether a client may use a route.
+
+        :return bool: ``True`` if a connection to the node should be
+            attempted, ``False`` if the client should be rejected.
+        """
+        state = self._unreachable.get(tub_id)
+        if state is None:
+            return True
+        if state.route != route:
+            # The tub has moved.  Its new location deserves a chance.
+            del self._unreachable[tub_id]
+            return True
+        if state.probing or self.clock.seconds() < state.retry_at:
+            return False
+        state.probing = True
+        return True
+
+
+    def connected(self, tub_id):
+        """
+        Record a successful connection for a route.
+        """
+        if self._unreachable.pop(tub_id, None) is not None:
+            Message.log(event_type=u"grid-router:route-healthy", tub_id=tub_id)
+
+
+    def connect_failed(self, tub_id, route):
+        """
+        Record a failed connection attempt for a route.
+        """
+        state = self._unreachable.get(tub_id)
+        if state is None or state.route != route:
+            state = self._unreachable[tub_id] = _Unreachable(route)
+        elif not state.probing:
+            # One of several attempts made before the route was known to be
+            # unhealthy.  The first failure is already accounted for.
+            return
+        state.failures += 1
+        state.probing = False
+        delay = min(self.max_delay, self.initial_delay * 2 ** (state.failures - 1))
+        state.retry_at = self.clock.seconds() + delay
+        Message.log(
+            event_type=u"grid-router:route-unhealthy",
+            tub_id=tub_id,
+            failures=state.failures,
+            delay=delay,
+        )
+
+
+    def retain(self, route_mapping):
+        """
+        Forget about routes which are no longer in use.
+
+        :param route_mapping: The current route mapping.
+        """
+        for tub_id, state in self._unreachable.items():
+            if route_mapping.get(tub_id) != state.route:
+                del self._unreachable[tub_id]
+
+
+
+def proxy(upstream, endpoint, header, high_water_mark=2 ** 16, clock=None, tub_kind=u"unknown"):
     """
     Establish a new connection to ``endpoint`` and begin proxying between that
     connection and ``upstream``.
@@ -247,7 +978,29 @@ def proxy(upstream, endpoint, header):
 
     :param bytes header: Some extra data to write to the new downstream
         connection before proxying begins.
+
+    :param int high_water_mark: The number of bytes which may be buffered for
+        delivery to either connection before reading from the other one is
+        paused.
+
+    :param IReactorTime clock: The clock to use to time the connection.
+
+    :param unicode tub_kind: ``u"introducer"`` or ``u"storage"`` to label
+        the metrics for this connection.
     """
+    if clock is None:
+        # Boo global reactor
+        # https://twistedmatrix.com/trac/ticket/9063
+        from twisted.internet import reactor as clock
+
+    def connected(downstream):
+        _BACKEND_CONNECT_SECONDS.labels(tub_kind).observe(
+            clock.seconds() - started,
+        )
+        return DeferredContext(
+            downstream.take_over(upstream, header, high_water_mark, clock, tub_kind),
+        )
+
     def failed(reason):
         upstream.transport.resumeProducing()
         upstream.transport.abortConnection()
@@ -261,25 +1014,95 @@ def proxy(upstream, endpoint, header):
         **{u"from": (peer.host, peer.port)}
     )
     with action.context():
+        started = clock.seconds()
         d = DeferredContext(endpoint.connect(Factory.forProtocol(_Proxy)))
-        d.addCallbacks(
-            lambda downstream: DeferredContext(downstream.take_over(upstream, header)),
-            failed,
-        )
+        d.addCallbacks(connected, failed)
         return d.addActionFinish()
 
 
 
+def _buffered_bytes(transport):
+    """
+    :return int: The number of bytes written to ``transport`` which it has
+        not yet managed to send.
+    """
+    return (
+        len(getattr(transport, "dataBuffer", b"")) -
+        getattr(transport, "offset", 0) +
+        getattr(transport, "_tempDataLen", 0)
+    )
+
+
+
+def _client_buffered_bytes():
+    """
+    :return int: The number of bytes buffered for delivery to clients.
+    """
+    return sum(
+        _buffered_bytes(p.upstream.transport)
+        for p in _Proxy._active
+    )
+
+
+
+def _backend_buffered_bytes():
+    """
+    :return int: The number of bytes buffered for delivery to Tahoe-LAFS
+        nodes.
+    """
+    return sum(
+        _buffered_bytes(p.transport)
+        for p in _Proxy._active
+    )
+
+
+
+def _sample_buffered_bytes():
+    """
+    Record the current buffered byte counts in their gauges.
+    """
+    _Proxy._client_buffered.set(_client_buffered_bytes())
+    _Proxy._backend_buffered.set(_backend_buffered_bytes())
+
+
+
 class _Proxy(Protocol):
     """
     Handle the downstream connection for a proxy between two connections.
+
+    Each connection's transport is registered as the producer for the other
+    connection's transport.  When either transport has more than its
+    ``bufferSize`` bytes waiting to be sent, Twisted pauses reading from the
+    other connection until the backlog drains.  This bounds the memory used
+    for each proxied connection no matter how mismatched the speeds of the
+    two peers are.
+
+    :cvar set _active: All of the ``_Proxy`` instances currently relaying
+        data.
     """
+    _active = set()
+
     _proxied_connections = Gauge(
         u"grid_router_connections",
         u"Current count of connections proxied by grid-router to Tahoe-LAFS.",
+        multiprocess_mode="livesum",
     )
 
-    def take_over(self, upstream, header):
+    _client_buffered = Gauge(
+        u"grid_router_client_buffered_bytes",
+        u"Bytes buffered by grid-router for delivery to clients.",
+        multiprocess_mode="livesum",
+    )
+    _client_buffered.set_function(_client_buffered_bytes)
+
+    _backend_buffered = Gauge(
+        u"grid_router_backend_buffered_bytes",
+        u"Bytes buffered by grid-router for delivery to Tahoe-LAFS nodes.",
+        multiprocess_mode="livesum",
+    )
+    _backend_buffered.set_function(_backend_buffered_bytes)
+
+    def take_over(self, upstream, header, high_water_mark=2 ** 16, clock=None, tub_kind=u"unknown"):
         """
         Begin actively proxying between this protocol and ``upstream``.
 
@@ -289,13 +1112,30 @@ class _Proxy(Protocol):
         :param bytes header: Any data that should be sent downstream before
             engaging the proxy.
 
+        :param int high_water_mark: The number of bytes which may be buffered
+            for delivery to either connection before reading from the other
+            is paused.
+
+        :param IReactorTime clock: The clock to use to time the connection.
+
+        :param unicode tub_kind: ``u"introducer"`` or ``u"storage"`` to label
+            the metrics for this connection.
+
         :return Deferred: A ``Deferred`` that fires when this protocol's
             connection is lost.  This should be tightly coupled to loss of the
             upstream protocol's connection.
         """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
         self.done = Deferred()
 
         self._proxied_connections.inc()
+        self._clock = clock
+        self._tub_kind = tub_kind
+        self._started = clock.seconds()
+        self._to_backend = 0
+        self._to_client = 0
 
         peer = self.transport.getPeer()
         a = start_action(
@@ -305,15 +1145,33 @@ class _Proxy(Protocol):
         with a:
             self.transport.write(header)
 
-            upstream.dataReceived = self.transport.write
+            upstream.dataReceived = self._relay_to_backend
             upstream.connectionLost = self._upstream_connection_lost
 
-            self.dataReceived = upstream.transport.write
+            self.dataReceived = self._relay_to_client
             self.upstream = upstream
+
+            # Let each side throttle the other.
+            self.transport.bufferSize = high_water_mark
+            upstream.transport.bufferSize = high_water_mark
+            self.transport.registerProducer(upstream.transport, True)
+            upstream.transport.registerProducer(self.transport, True)
+            self._active.add(self)
+
             self.upstream.transport.resumeProducing()
             return self.done
 
 
+    def _relay_to_backend(self, data):
+        self._to_backend += len(data)
+        self.transport.write(data)
+
+
+    def _relay_to_client(self, data):
+        self._to_client += len(data)
+        self.upstream.transport.write(data)
+
+
     def _upstream_connection_lost(self, reason):
         """
         The upstream connection was lost.  Close this connection as well.
@@ -327,7 +1185,15 @@ class _Proxy(Protocol):
         well.
         """
         self._proxied_connections.dec()
+        self._active.discard(self)
+
+        _CONNECTION_SECONDS.labels(self._tub_kind).observe(
+            self._clock.seconds() - self._started,
+        )
+        _RELAYED_BYTES.labels(u"to_backend", self._tub_kind).observe(self._to_backend)
+        _RELAYED_BYTES.labels(u"to_client", self._tub_kind).observe(self._to_client)
 
+        self.upstream.transport.unregisterProducer()
         self.upstream.transport.abortConnection()
         del self.upstream.dataReceived
         del self.upstream.connectionLost
@@ -347,17 +1213,58 @@ class _GridRouterService(MultiService):
     :ivar _reactor: A Twisted reactor which can be used to establish
         connections for the proxy.
 
-    :ivar _route_mapping: A mapping from tub identifiers to destination
-        information.  The destination information is a two-tuple of an IP
-        address and a port number.  It gives an address where a Foolscap node
-        capable of servicing the tub identifier can be reached.
+    :ivar _ProxyConfiguration _config: Limits to apply to connections.
+
+    :ivar _route_mapping: A mapping from tub identifiers to ``_Route``
+        instances giving an address where a Foolscap node capable of
+        servicing the tub identifier can be reached.  The mapping is never
+        changed, only replaced.
+
+    :ivar list _observers: One-argument callables to call with the new route
+        mapping whenever it changes.
+
+    :ivar _RouteHealth _health: The routes which are currently unhealthy.
+
+    :ivar _ParkingLot _parking: The connections waiting for their tubs to
+        become routable.
     """
     name = u"grid-router"
 
-    def __init__(self, reactor):
+    def __init__(self, reactor, config=None):
         MultiService.__init__(self)
+        if config is None:
+            config = _ProxyConfiguration()
         self._reactor = reactor
+        self._config = config
         self._route_mapping = freeze({})
+        self._observers = []
+        self._health = _RouteHealth(
+            reactor,
+            config.probe_initial_delay,
+            config.probe_max_delay,
+        )
+        self._parking = _ParkingLot(
+            reactor,
+            config.park_limit,
+            config.park_timeout,
+        )
+
+
+    def observe(self, observer):
+        """
+        Arrange to be told about route mapping changes.
+
+        :param observer: A one-argument callable to call with the new route
+            mapping after each change.
+        """
+        self._observers.append(observer)
+
+
+    def _routes_changed(self):
+        self._health.retain(self._route_mapping)
+        self._parking.routes_changed(self._route_mapping)
+        for observer in self._observers:
+            observer(self._route_mapping)
 
 
     def factory(self):
@@ -367,6 +1274,9 @@ class _GridRouterService(MultiService):
         f = Factory.forProtocol(_FoolscapProxy)
         f.reactor = self._reactor
         f.route_mapping = self.route_mapping
+        f.config = self._config
+        f.health = self._health
+        f.parking = self._parking
         return f
 
 
@@ -374,7 +1284,7 @@ class _GridRouterService(MultiService):
         """
         Retrieve the mapping describing how to route connections to pods.
 
-        :return PMap: A mapping from a tub identifier to a (host, port) pair.
+        :return PMap: A mapping from a tub identifier to a ``_Route``.
         """
         return self._route_mapping
 
@@ -383,10 +1293,76 @@ class _GridRouterService(MultiService):
         """
         Update grid routing rules based on new information about what pods exist.
 
+        Only the routes which differ from the current ones are touched.  If
+        nothing differs, the current mapping is kept.  Pods which are being
+        deleted are ignored.  If more than one pod serves a tub, routes are
+        chosen as ``_replaces`` decides.
+
         :param list[v1.Pod] pods: The pods which were observed to exist very
             recently.
         """
-        self.set_route_mapping(self._pods_to_routes(self._route_mapping, pods))
+        with start_action(action_type=u"router-update:set-pods", count=len(pods)):
+            old = self._route_mapping
+            offered = {}
+            for pod in pods:
+                if not _terminating(pod):
+                    for tub_id, route in _pod_routes(pod):
+                        offered.setdefault(tub_id, []).append(route)
+
+            routes = {}
+            for tub_id, candidates in offered.iteritems():
+                # Start from the current route if its pod still offers it.
+                current = old.get(tub_id)
+                chosen = None
+                for route in candidates:
+                    if current is not None and route.pod_name == current.pod_name:
+                        chosen = route
+                for route in candidates:
+                    if _replaces(chosen, route):
+                        chosen = route
+                routes[tub_id] = chosen
+
+            new = old.evolver()
+            for tub_id, route in old.iteritems():
+                if tub_id not in routes:
+                    Message.log(event_type=u"router-update:remove", pod=route.pod_name)
+                    del new[tub_id]
+            for tub_id, route in routes.iteritems():
+                current = old.get(tub_id)
+                if current != route:
+                    if current is None:
+                        Message.log(event_type=u"router-update:add", pod=route.pod_name)
+                    new[tub_id] = route
+            self._swap(new)
+
+
+    def pod_changed(self, event):
+        """
+        Update grid routing rules based on a single change to a pod.
+
+        Changes to pods which are being deleted are ignored (until the pod is
+        gone).  A tub's route is only replaced as ``_replaces`` decides.
+
+        :param WatchEvent event: The change which was observed.
+        """
+        pod = event.object
+        if event.type != u"DELETED" and _terminating(pod):
+            return
+        old = self._route_mapping
+        new = old.evolver()
+        for tub_id, route in _pod_routes(pod):
+            current = old.get(tub_id)
+            if event.type == u"DELETED":
+                # Only forget the route if it still belongs to this pod.
+                # Another pod may have taken over the tub since.
+                if current is not None and current.pod_name == route.pod_name:
+                    Message.log(event_type=u"router-update:remove", pod=route.pod_name)
+                    del new[tub_id]
+            elif _replaces(current, route):
+                if current is None:
+                    Message.log(event_type=u"router-update:add", pod=route.pod_name)
+                new[tub_id] = route
+        self._swap(new)
 
 
     def set_route_mapping(self, route_mapping):
@@ -397,53 +1373,161 @@ class _GridRouterService(MultiService):
             attribute.
         """
         self._route_mapping = freeze(route_mapping)
+        self._routes_changed()
 
 
-    def _pods_to_routes(self, old, pods):
+    def _swap(self, evolver):
         """
-        Extract the addressing information from some pods.
+        Replace the route mapping with the result of some changes to it, if
+        there were any.
 
-        :param old: The old routing information.  Used to log route changes.
+        Readers only ever see the complete old mapping or the complete new
+        one since the replacement is a single attribute assignment.
 
-        :param list[v1.Pod] pods: Some pods from which routing information can
-            be extracted.
-
-        :return: A mapping of the new routing information deriving solely from
-            ``pods``.
+        :param PMap._Evolver evolver: An evolver of the current route
+            mapping.
         """
-        def _introducer_tub(pod):
-            return pod.metadata.annotations[u"leastauthority.com/introducer-tub-id"]
-        def _storage_tub(pod):
-            return pod.metadata.annotations[u"leastauthority.com/storage-tub-id"]
+        if evolver.is_dirty():
+            self._route_mapping = evolver.persistent()
+            self._routes_changed()
 
-        def _introducer_port_number(pod):
-            return int(pod.metadata.annotations[u"leastauthority.com/introducer-port-number"])
-        def _storage_port_number(pod):
-            return int(pod.metadata.annotations[u"leastauthority.com/storage-port-number"])
 
-        def _introducer_address(pod):
-            return (pod.status.podIP, _introducer_port_number(pod))
-        def _storage_address(pod):
-            return (pod.status.podIP, _storage_port_number(pod))
 
-        with start_action(action_type=u"router-update:set-pods", count=len(pods)):
-            new = pmap([
-                (_introducer_tub(pod), (pod, _introducer_address(pod)))
-                for pod in pods
-            ] + [
-                (_storage_tub(pod), (pod, _storage_address(pod)))
-                for pod in pods
-            ])
+@attr.s(frozen=True, slots=True)
+class _Route(object):
+    """
+    The destination for connections for one tub.
+
+    :ivar unicode ip: The address of the pod serving the tub or ``None`` if
+        it has not been assigned one yet.
+
+    :ivar int port: The port number on which the tub is served.
+
+    :ivar unicode pod_name: The name of the pod serving the tub.
+
+    :ivar unicode kind: ``u"introducer"`` or ``u"storage"``, depending on
+        what the tub is.
+    """
+    ip = attr.ib()
+    port = attr.ib()
+    pod_name = attr.ib()
+    kind = attr.ib()
+
+
+
+def _routes_to_json(route_mapping):
+    """
+    Serialize a route mapping for a worker.
+
+    :param route_mapping: A mapping like the one managed by
+        ``_GridRouterService``.
+
+    :return bytes: A single line of JSON (without the line terminator).
+    """
+    return dumps({
+        tub_id: [route.ip, route.port, route.pod_name, route.kind]
+        for (tub_id, route)
+        in route_mapping.iteritems()
+    })
+
+
+
+def _routes_from_json(serialized):
+    """
+    Load a route mapping serialized by ``_routes_to_json``.
+    """
+    return pmap({
+        tub_id: _Route(ip, port, pod_name, kind)
+        for (tub_id, (ip, port, pod_name, kind))
+        in loads(serialized).iteritems()
+    })
+
+
+
+def _terminating(pod):
+    """
+    :return bool: ``True`` if the pod is being deleted, ``False`` otherwise.
+    """
+    return pod.metadata.deletionTimestamp is not None
+
+
+
+def _replaces(current, route):
+    """
+    Decide whether a tub's route should change.
+
+    Two pods serve the same tubs while a deployment rolls out a change.  The
+    new pod has no address at first so its route is not used in place of
+    the old pod's working route until it has one.
+
+    :param _Route current: The tub's current route or ``None`` if it has
+        none.
+
+    :param _Route route: A route for the tub from some pod.
+
+    :return bool: ``True`` if ``route`` should become the tub's route,
+        ``False`` otherwise.
+    """
+    if current is None:
+        return True
+    if current.pod_name == route.pod_name:
+        return current != route
+    return route.ip is not None or current.ip is None
 
-            adding = pset(new.keys()) - pset(old.keys())
-            removing = pset(old.keys()) - pset(new.keys())
 
-            for tub_id in adding:
-                Message.log(event_type=u"router-update:add", pod=new[tub_id][0].metadata.name)
-            for tub_id in removing:
-                Message.log(event_type=u"router-update:remove", pod=old[tub_id][0].metadata.name)
 
-            return new
+def _pod_routes(pod):
+    """
+    Extract the addressing information from one pod.
+
+    :param v1.Pod pod: A customer grid pod.
+
+    :return: A list of two-tuples of tub identifier and ``_Route``.  There is
+        one element for the introducer and one for the storage server.
+    """
+    annotations = pod.metadata.annotations
+    ip = pod.status.podIP if pod.status is not None else None
+    name = pod.metadata.name
+    return [
+        (
+            annotations[u"leastauthority.com/introducer-tub-id"],
+            _Route(
+                ip,
+                int(annotations[u"leastauthority.com/introducer-port-number"]),
+                name,
+                u"introducer",
+            ),
+        ),
+        (
+            annotations[u"leastauthority.com/storage-tub-id"],
+            _Route(
+                ip,
+                int(annotations[u"leastauthority.com/storage-port-number"]),
+                name,
+                u"storage",
+            ),
+        ),
+    ]
+
+
+
+def _router_watch_service(reactor, interval, k8s, namespace, router):
+    """
+    Create a service which reports pods to a ``_GridRouterService`` by
+    watching them.
+
+    A full list is only done at startup and whenever the watch expires.
+    Otherwise, individual pod changes are applied as they are reported.
+    """
+    return ListWatchService(
+        reactor,
+        interval,
+        KubeClient(k8s=k8s),
+        k8s.model.v1.Pod,
+        customer_grid_selector(namespace),
+        router.set_pods,
+        router.pod_changed,
+    )
 
 
 
@@ -476,3 +1560,73 @@ class _RouterUpdateService(TimerService):
             )
             d.addCallback(self._router.set_pods)
             return d.addActionFinish()
+
+
+
+class _RouteSnapshotService(TimerService):
+    """
+    ``_RouteSnapshotService`` keeps a copy of a ``_GridRouterService``'s
+    routes on disk and gives them back to it when it starts.
+
+    The snapshot routes may be out of date.  They are replaced as soon as the
+    router hears about the pods from Kubernetes.  Until then, they let
+    clients which were connected before a restart reconnect right away.
+
+    :ivar FilePath _path: The location of the snapshot.
+
+    :ivar _saved: The route mapping most recently written to the snapshot.
+    """
+    def __init__(self, reactor, interval, path, router):
+        self._logged_save = divert_errors_to_log(self._save, u"route-snapshot")
+        TimerService.__init__(self, interval, self._logged_save)
+        self.clock = reactor
+        self._path = path
+        self._router = router
+        self._saved = None
+
+
+    def startService(self):
+        self._load()
+        # Only write a snapshot once there is something new to put in it.
+        self._saved = self._router.route_mapping()
+        TimerService.startService(self)
+
+
+    def stopService(self):
+        d = TimerService.stopService(self)
+        self._logged_save()
+        return d
+
+
+    def _load(self):
+        with start_action(action_type=u"route-snapshot:load", path=self._path.path) as a:
+            try:
+                serialized = self._path.getContent()
+            except IOError as e:
+                # No snapshot (yet).  Start with no routes.
+                a.add_success_fields(count=0, reason=u"{}".format(e))
+                return
+            try:
+                route_mapping = _routes_from_json(serialized)
+            except Exception as e:
+                # Not worth failing to start over.  Kubernetes will tell us
+                # the routes soon enough.
+                a.add_success_fields(count=0, reason=u"{}".format(e))
+                return
+            a.add_success_fields(count=len(route_mapping))
+            self._router.set_route_mapping(route_mapping)
+
+
+    def _save(self):
+        route_mapping = self._router.route_mapping()
+        if route_mapping is self._saved:
+            return
+        with start_action(
+            action_type=u"route-snapshot:save",
+            path=self._path.path,
+            count=len(route_mapping),
+        ):
+            # setContent writes a temporary file and renames it so the
+            # snapshot is never left half written.
+            self._path.setContent(_routes_to_json(route_mapping))
+            self._saved = route_mapping
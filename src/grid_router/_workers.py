@@ -0,0 +1,309 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+Support for running the grid router as a coordinator process and several
+worker processes.
+
+The coordinator process keeps track of the routes (using Kubernetes) and
+sends them to the workers.  The workers each listen on the same port (using
+``SO_REUSEPORT`` so the kernel spreads connections amongst them) and do the
+proxying.  Prometheus metrics from the workers are written to a directory
+shared with the coordinator which publishes them all together.
+"""
+
+from socket import (
+    AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SO_REUSEPORT,
+    socket,
+)
+
+from zope.interface import implementer
+
+import attr
+
+from twisted.internet.interfaces import IStreamServerEndpoint
+from twisted.internet.defer import Deferred, DeferredList, execute
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.stdio import StandardIO
+from twisted.protocols.basic import LineOnlyReceiver
+from twisted.application.service import Service
+
+from eliot import Message
+
+from prometheus_client.multiprocess import mark_process_dead
+
+
+@implementer(IStreamServerEndpoint)
+@attr.s(frozen=True)
+class _ReusePortEndpoint(object):
+    """
+    A TCP server endpoint which allows other processes to listen on the same
+    port at the same time.
+
+    :ivar int port: The port number on which to listen.
+
+    :ivar bytes interface: The address of the interface on which to listen.
+    """
+    reactor = attr.ib()
+    port = attr.ib()
+    interface = attr.ib(default=b"")
+    backlog = attr.ib(default=50)
+
+    def listen(self, factory):
+        return execute(self._listen, factory)
+
+
+    def _listen(self, factory):
+        s = socket(AF_INET, SOCK_STREAM)
+        try:
+            s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+            s.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+            s.bind((self.interface, self.port))
+            s.listen(self.backlog)
+            s.setblocking(False)
+            # The reactor makes its own copy of the file descriptor.
+            return self.reactor.adoptStreamPort(s.fileno(), AF_INET, factory)
+        finally:
+            s.close()
+
+
+
+class _RouteFeed(LineOnlyReceiver):
+    """
+    Receive route mappings from the coordinator (on a worker's stdin).
+
+    :ivar _routes_received: A one-argument callable to call with each
+        serialized route mapping received.
+
+    :ivar _lost: A no-argument callable to call when the coordinator goes
+        away.
+    """
+    delimiter = b"\n"
+
+    # A route is around 100 bytes.  This leaves room for a great many.
+    MAX_LENGTH = 2 ** 26
+
+    def __init__(self, routes_received, lost):
+        self._routes_received = routes_received
+        self._lost = lost
+
+
+    def lineReceived(self, line):
+        self._routes_received(line)
+
+
+    def connectionLost(self, reason):
+        Message.log(
+            event_type=u"grid-router-worker:coordinator-lost",
+            reason=u"{}".format(reason.value),
+        )
+        self._lost()
+
+
+
+class _RouteFeedService(Service):
+    """
+    Keep a worker's routes up to date with those sent by the coordinator.
+
+    The coordinator going away means no more route updates are coming so the
+    worker stops its reactor in that case.
+    """
+    def __init__(self, reactor, routes_received):
+        self._reactor = reactor
+        self._routes_received = routes_received
+
+
+    def startService(self):
+        Service.startService(self)
+        StandardIO(
+            _RouteFeed(self._routes_received, self._coordinator_lost),
+            reactor=self._reactor,
+        )
+
+
+    def _coordinator_lost(self):
+        if self.running:
+            self._reactor.stop()
+
+
+
+class _WorkerProcess(ProcessProtocol):
+    """
+    The coordinator's side of its connection to one worker process.
+
+    :ivar int index: The position of this worker in the pool.
+
+    :ivar pid: The process id of the worker.
+
+    :ivar Deferred ended: Fires when the worker process exits.
+    """
+    def __init__(self, pool, index):
+        self._pool = pool
+        self.index = index
+        self.pid = None
+        self.ended = Deferred()
+
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        self._pool._worker_started(self)
+
+
+    def send_routes(self, serialized):
+        """
+        Give the worker a new route mapping.
+
+        :param bytes serialized: The route mapping, serialized as one line.
+        """
+        self.transport.write(serialized + b"\n")
+
+
+    def processEnded(self, reason):
+        self._pool._worker_ended(self, reason)
+        self.ended.callback(None)
+
+
+
+class _WorkerPool(Service):
+    """
+    Keep a number of grid router worker processes running and supplied with
+    the current routes.
+
+    :ivar int _count: The number of workers to run.
+
+    :ivar _argv: A one-argument callable which takes a worker index and
+        returns the command line with which to start that worker.
+
+    :ivar dict _environ: The environment for the worker processes.
+
+    :ivar FilePath _metrics_dir: The directory to which workers write their
+        Prometheus metrics.
+
+    :ivar float _respawn_delay: The number of seconds to wait before starting
+        a replacement for a worker which exited.
+
+    :ivar bytes _routes: The serialized form of the most recent route
+        mapping.  Route mappings are serialized by the caller as a single
+        line (without the terminator).
+
+    :ivar dict _workers: The currently running workers, keyed by index.
+    """
+    def __init__(self, reactor, count, argv, environ, metrics_dir, respawn_delay=1.0):
+        self._reactor = reactor
+        self._count = count
+        self._argv = argv
+        self._environ = environ
+        self._metrics_dir = metrics_dir
+        self._respawn_delay = respawn_delay
+        self._routes = b"{}"
+        self._workers = {}
+        self._respawns = {}
+
+
+    def startService(self):
+        Service.startService(self)
+        for index in range(self._count):
+            self._spawn(index)
+
+
+    def stopService(self):
+        Service.stopService(self)
+        for delayed in self._respawns.values():
+            delayed.cancel()
+        self._respawns.clear()
+
+        ended = []
+        for worker in self._workers.values():
+            ended.append(worker.ended)
+            worker.transport.signalProcess("TERM")
+        d = DeferredList(ended)
+        d.addCallback(lambda ignored: self._metrics_dir.remove())
+        return d
+
+
+    def routes_changed(self, serialized):
+        """
+        Send a new route mapping to all of the workers.
+
+        :param bytes serialized: The route mapping, serialized as one line.
+        """
+        self._routes = serialized
+        for worker in self._workers.values():
+            worker.send_routes(self._routes)
+
+
+    def _spawn(self, index):
+        self._respawns.pop(index, None)
+        argv = self._argv(index)
+        self._reactor.spawnProcess(
+            _WorkerProcess(self, index),
+            argv[0],
+            argv,
+            env=self._environ,
+            # Routes go to stdin.  Logs go wherever ours go.
+            childFDs={0: "w", 1: 1, 2: 2},
+        )
+
+
+    def _worker_started(self, worker):
+        Message.log(
+            event_type=u"grid-router:worker-started",
+            index=worker.index,
+            pid=worker.pid,
+        )
+        self._workers[worker.index] = worker
+        worker.send_routes(self._routes)
+
+
+    def _worker_ended(self, worker, reason):
+        Message.log(
+            event_type=u"grid-router:worker-ended",
+            index=worker.index,
+            pid=worker.pid,
+            reason=u"{}".format(reason.value),
+        )
+        del self._workers[worker.index]
+        if worker.pid is not None:
+            # Stop reporting the live gauges of the dead process.
+            mark_process_dead(worker.pid, self._metrics_dir.path)
+        if self.running:
+            self._respawns[worker.index] = self._reactor.callLater(
+                self._respawn_delay, self._spawn, worker.index,
+            )
+
+
+
+def worker_environment(environ, metrics_dir):
+    """
+    Compute the environment for worker processes.
+
+    :param dict environ: The coordinator's environment.
+
+    :param FilePath metrics_dir: The directory to which workers will write
+        their Prometheus metrics.
+
+    :return dict: The worker environment.
+    """
+    environ = dict(environ)
+    # prometheus_client switches to its multi-process mode when it finds
+    # this set at import time.
+    environ["prometheus_multiproc_dir"] = metrics_dir.path
+    return environ
+
+
+
+def worker_destination(description, index):
+    """
+    Compute an Eliot destination description for a worker process so that
+    workers do not all write to the same file as the coordinator.
+
+    :param bytes description: The coordinator's destination description.
+
+    :param int index: The index of the worker.
+
+    :return bytes: The destination description for the worker.
+    """
+    if description.startswith(b"file:") and description != b"file:-":
+        return u"{}.worker-{}".format(description.decode("ascii"), index).encode("ascii")
+    return description
+
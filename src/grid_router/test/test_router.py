@@ -10,6 +10,8 @@ from socket import AF_INET, socket
 from testtools.matchers import (
     AfterPreprocessing,
     Equals,
+    HasLength,
+    Is,
 )
 
 from hypothesis import given, assume
@@ -20,10 +22,14 @@ from hypothesis.strategies import (
 from hypothesis.stateful import RuleBasedStateMachine, rule, run_state_machine_as_test
 
 from twisted.python.log import msg
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase as AsyncTestCase
 from twisted.internet.address import IPv4Address
 from twisted.internet.interfaces import IReactorTCP, IReactorTime
 from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone, ConnectionRefusedError
+from twisted.internet.protocol import Protocol
 from twisted.internet.endpoints import AdoptedStreamServerEndpoint, TCP4ServerEndpoint
 from twisted.test.proto_helpers import StringTransport, MemoryReactor
 from twisted.python.components import proxyForInterface
@@ -31,6 +37,8 @@ from twisted.internet.task import Clock, deferLater
 
 from pyrsistent import freeze
 
+from prometheus_client import REGISTRY
+
 from foolscap.pb import Tub
 from foolscap.referenceable import Referenceable
 
@@ -43,14 +51,26 @@ from lae_automation.containers import create_deployment
 from lae_automation.model import NullDeploymentConfiguration, SubscriptionDetails
 
 from lae_util.k8s import derive_pod
+from lae_automation.kubeclient import WatchEvent
 
 from .. import Options, makeService
-from .._router import _GridRouterService
+from .._router import (
+    _GridRouterService, _Proxy, _ProxyConfiguration, _Route, _RouteHealth,
+    _RouteSnapshotService, _routes_to_json,
+)
 
 from txkube import memory_kubernetes, v1_5_model as model
 
 
 
+def sample(name, **labels):
+    """
+    :return float: The current value of a Prometheus sample.
+    """
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+
 class FakeReactor(
         proxyForInterface(IReactorTCP, "_tcp"),
         proxyForInterface(IReactorTime, "_time")
@@ -208,8 +228,8 @@ class GridRouterStateMachine(RuleBasedStateMachine):
             mapping,
             AfterPreprocessing(
                 lambda m: {
-                    tub_id: address
-                    for (tub_id, (pod, address))
+                    tub_id: (route.ip, route.port)
+                    for (tub_id, route)
                     in m.iteritems()
                 },
                 Equals(expected),
@@ -242,8 +262,8 @@ class GridRouterTests(TestCase):
             mapping,
             AfterPreprocessing(
                 lambda m: {
-                    tub_id: address
-                    for (tub_id, (pod, address))
+                    tub_id: (route.ip, route.port)
+                    for (tub_id, route)
                     in m.iteritems()
                 },
                 Equals({
@@ -253,6 +273,165 @@ class GridRouterTests(TestCase):
             ),
         )
 
+    @given(
+        ip=ipv4_addresses(),
+        deploy_config=deployment_configuration(),
+        details=subscription_details()
+    )
+    def test_pod_changed(self, ip, deploy_config, details):
+        """
+        ``_GridRouterService.pod_changed`` adds the routes for an added pod and
+        removes them again for a deleted pod.
+        """
+        service = _GridRouterService(object())
+        deployment = create_deployment(deploy_config, details, model)
+        pod = derive_pod(model, deployment, ip)
+
+        def addresses():
+            return {
+                tub_id: (route.ip, route.port)
+                for (tub_id, route)
+                in service.route_mapping().iteritems()
+            }
+
+        service.pod_changed(WatchEvent(type=u"ADDED", object=pod))
+        self.expectThat(
+            addresses(),
+            Equals({
+                details.introducer_tub_id: (ip, details.introducer_port_number),
+                details.storage_tub_id: (ip, details.storage_port_number),
+            }),
+        )
+        service.pod_changed(WatchEvent(type=u"DELETED", object=pod))
+        self.expectThat(addresses(), Equals({}))
+
+
+    def _rolling_update(self, old_ip, new_ip, deploy_config, details):
+        """
+        Make the pods involved in a rolling update of a subscription's
+        deployment.
+
+        :return: A four-tuple of the old pod, the old pod being deleted, the
+            new pod before it has an address and the new pod with
+            ``new_ip``.
+        """
+        deployment = create_deployment(deploy_config, details, model)
+        old = derive_pod(model, deployment, old_ip)
+        terminating = old.transform(
+            [u"metadata", u"deletionTimestamp"], u"2017-01-01T00:00:00Z",
+        )
+        new = derive_pod(model, deployment, new_ip).transform(
+            [u"metadata", u"name"], old.metadata.name + u"-new",
+        )
+        pending = new.transform([u"status", u"podIP"], None)
+        return old, terminating, pending, new
+
+
+    def _addresses(self, service):
+        return {
+            tub_id: (route.ip, route.pod_name)
+            for (tub_id, route)
+            in service.route_mapping().iteritems()
+        }
+
+
+    @given(
+        old_ip=ipv4_addresses(),
+        new_ip=ipv4_addresses(),
+        deploy_config=deployment_configuration(),
+        details=subscription_details()
+    )
+    def test_rolling_update_events(self, old_ip, new_ip, deploy_config, details):
+        """
+        While a deployment rolls out a change, the old pod's routes are kept
+        until the new pod has an address and changes to the old pod after
+        that are ignored.
+        """
+        old, terminating, pending, new = self._rolling_update(
+            old_ip, new_ip, deploy_config, details,
+        )
+        service = _GridRouterService(object())
+        service.pod_changed(WatchEvent(type=u"ADDED", object=old))
+
+        def routed(pod, ip):
+            return {
+                details.introducer_tub_id: (ip, pod.metadata.name),
+                details.storage_tub_id: (ip, pod.metadata.name),
+            }
+
+        service.pod_changed(WatchEvent(type=u"ADDED", object=pending))
+        self.expectThat(self._addresses(service), Equals(routed(old, old_ip)))
+        service.pod_changed(WatchEvent(type=u"MODIFIED", object=terminating))
+        self.expectThat(self._addresses(service), Equals(routed(old, old_ip)))
+        service.pod_changed(WatchEvent(type=u"MODIFIED", object=new))
+        self.expectThat(self._addresses(service), Equals(routed(new, new_ip)))
+        service.pod_changed(WatchEvent(type=u"MODIFIED", object=terminating))
+        self.expectThat(self._addresses(service), Equals(routed(new, new_ip)))
+        service.pod_changed(WatchEvent(type=u"DELETED", object=terminating))
+        self.expectThat(self._addresses(service), Equals(routed(new, new_ip)))
+
+
+    @given(
+        old_ip=ipv4_addresses(),
+        new_ip=ipv4_addresses(),
+        deploy_config=deployment_configuration(),
+        details=subscription_details()
+    )
+    def test_rolling_update_pods(self, old_ip, new_ip, deploy_config, details):
+        """
+        ``_GridRouterService.set_pods`` applies the same rules as
+        ``pod_changed`` to pods which serve the same tubs.
+        """
+        old, terminating, pending, new = self._rolling_update(
+            old_ip, new_ip, deploy_config, details,
+        )
+        service = _GridRouterService(object())
+
+        def routed(pod, ip):
+            return {
+                details.introducer_tub_id: (ip, pod.metadata.name),
+                details.storage_tub_id: (ip, pod.metadata.name),
+            }
+
+        service.set_pods([old])
+        service.set_pods([pending, old])
+        self.expectThat(self._addresses(service), Equals(routed(old, old_ip)))
+        service.set_pods([old, pending])
+        self.expectThat(self._addresses(service), Equals(routed(old, old_ip)))
+        service.set_pods([terminating, new])
+        self.expectThat(self._addresses(service), Equals(routed(new, new_ip)))
+        service.set_pods([terminating, pending])
+        self.expectThat(self._addresses(service), Equals(routed(pending, None)))
+
+
+    @given(
+        ip=ipv4_addresses(),
+        deploy_config=deployment_configuration(),
+        details=subscription_details()
+    )
+    def test_unchanged_pods(self, ip, deploy_config, details):
+        """
+        When ``_GridRouterService.set_pods`` is given pods with the same routes
+        as before, the route mapping is left alone and observers are not
+        notified.
+        """
+        service = _GridRouterService(object())
+        deployment = create_deployment(deploy_config, details, model)
+        pod = derive_pod(model, deployment, ip)
+        service.set_pods([pod])
+        before = service.route_mapping()
+
+        changes = []
+        service.observe(changes.append)
+        service.set_pods([pod])
+        self.expectThat(service.route_mapping(), Is(before))
+        self.expectThat(changes, Equals([]))
+
+        service.set_pods([])
+        self.expectThat(changes, Equals([service.route_mapping()]))
+        self.expectThat(service.route_mapping(), Equals({}))
+
+
     @given(
         ip=ipv4_addresses(),
         deploy_config=deployment_configuration(),
@@ -284,11 +463,509 @@ class GridRouterTests(TestCase):
 
 
 
+class ProxyTests(TestCase):
+    """
+    Tests for ``_Proxy``.
+    """
+    def test_backpressure(self):
+        """
+        After ``_Proxy.take_over``, each side of the proxy is registered as the
+        streaming producer for the other and is limited to buffering the
+        given number of bytes.
+        """
+        upstream = Protocol()
+        upstream.makeConnection(StringTransport())
+        downstream = _Proxy()
+        downstream.makeConnection(StringTransport())
+
+        downstream.take_over(upstream, b"header", 1234)
+
+        self.expectThat(downstream.transport.value(), Equals(b"header"))
+        self.expectThat(
+            downstream.transport.producer, Is(upstream.transport),
+        )
+        self.expectThat(
+            upstream.transport.producer, Is(downstream.transport),
+        )
+        self.expectThat(downstream.transport.streaming, Equals(True))
+        self.expectThat(upstream.transport.streaming, Equals(True))
+        self.expectThat(downstream.transport.bufferSize, Equals(1234))
+        self.expectThat(upstream.transport.bufferSize, Equals(1234))
+
+        downstream.connectionLost(Failure(ConnectionDone()))
+        self.expectThat(upstream.transport.producer, Is(None))
+
+
+    def test_metrics(self):
+        """
+        When the proxied connection ends, its lifetime and the number of bytes
+        relayed in each direction are recorded.
+        """
+        def samples():
+            return (
+                sample(u"grid_router_connection_seconds_sum", tub_kind=u"storage"),
+                sample(u"grid_router_relayed_bytes_sum", direction=u"to_backend", tub_kind=u"storage"),
+                sample(u"grid_router_relayed_bytes_sum", direction=u"to_client", tub_kind=u"storage"),
+            )
+        before = samples()
+
+        clock = Clock()
+        upstream = Protocol()
+        upstream.makeConnection(StringTransport())
+        downstream = _Proxy()
+        downstream.makeConnection(StringTransport())
+        downstream.take_over(upstream, b"header", 1234, clock, u"storage")
+
+        upstream.dataReceived(b"abc")
+        downstream.dataReceived(b"hello")
+        clock.advance(7)
+        downstream.connectionLost(Failure(ConnectionDone()))
+
+        self.expectThat(downstream.transport.value(), Equals(b"headerabc"))
+        self.expectThat(upstream.transport.value(), Equals(b"hello"))
+        self.expectThat(
+            tuple(b - a for (a, b) in zip(before, samples())),
+            Equals((7.0, 3.0, 5.0)),
+        )
+
+
+
 # XXX Doesn't seem to be easily reversible.
 from foolscap.logging.log import bridgeLogsToTwisted
 bridgeLogsToTwisted(lambda event: True)
 
 
+class FoolscapHeaderTests(TestCase):
+    """
+    Tests for the negotiation header handling of ``_FoolscapProxy``.
+    """
+    def setUp(self):
+        super(FoolscapHeaderTests, self).setUp()
+        self.network = MemoryReactor()
+        self.clock = Clock()
+        self.service = _GridRouterService(
+            FakeReactor(self.network, self.clock),
+            _ProxyConfiguration(
+                max_header_size=64,
+                negotiation_timeout=10.0,
+                connect_timeout=3.0,
+            ),
+        )
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(u"10.0.0.1", 12345, u"pod-1", u"storage"),
+        }))
+        self.protocol = self.service.factory().buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+
+    def test_fragmented(self):
+        """
+        A header which arrives one byte at a time is still routed.
+        """
+        header = (
+            b"GET /id/abcdef HTTP/1.1\r\n"
+            b"Host: example.invalid\r\n"
+            b"\r\n"
+        )
+        for i in range(len(header)):
+            self.protocol.dataReceived(header[i:i + 1])
+
+        self.expectThat(
+            self.network.connectors.pop(0).getDestination(),
+            Equals(IPv4Address("TCP", "10.0.0.1", 12345)),
+        )
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+    def test_too_long(self):
+        """
+        A client which sends more than the maximum header size without
+        finishing the header is disconnected.
+        """
+        self.protocol.dataReceived(b"GET /id/" + b"a" * 64)
+        self.expectThat(self.transport.disconnecting, Equals(True))
+        self.expectThat(self.network.connectors, Equals([]))
+
+
+    def test_timeout(self):
+        """
+        A client which does not finish sending the header before the
+        negotiation timeout is disconnected.
+        """
+        self.protocol.dataReceived(b"GET /id/abcdef HTTP/1.1\r\n")
+        self.clock.advance(9.0)
+        self.expectThat(self.transport.disconnecting, Equals(False))
+        self.clock.advance(1.0)
+        self.expectThat(self.transport.disconnecting, Equals(True))
+
+
+    def test_invalid(self):
+        """
+        A client which sends a malformed header is disconnected.
+        """
+        self.protocol.dataReceived(b"POST /foo HTTP/1.1\r\n\r\n")
+        self.expectThat(self.transport.disconnecting, Equals(True))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+    def connect(self, tub_id):
+        """
+        Make a new client connection which asks for ``tub_id``.
+        """
+        self.transport = StringTransport()
+        self.protocol = self.service.factory().buildProtocol(None)
+        self.protocol.makeConnection(self.transport)
+        self.protocol.dataReceived(
+            b"GET /id/" + tub_id + b" HTTP/1.1\r\n\r\n",
+        )
+
+
+    def test_unreachable(self):
+        """
+        Connections to a node are attempted with the configured timeout.  When
+        one fails, clients of that route are rejected without a connection
+        attempt until the probe delay passes.
+        """
+        self.connect(b"abcdef")
+        [(host, port, factory, timeout, _)] = self.network.tcpClients
+        self.expectThat(timeout, Equals(3.0))
+        factory.clientConnectionFailed(
+            self.network.connectors[0], Failure(ConnectionRefusedError()),
+        )
+        self.expectThat(self.transport.disconnecting, Equals(True))
+
+        self.connect(b"abcdef")
+        self.expectThat(self.transport.disconnecting, Equals(True))
+        self.expectThat(self.network.tcpClients, HasLength(1))
+
+        self.clock.advance(1.0)
+        self.connect(b"abcdef")
+        self.expectThat(self.network.tcpClients, HasLength(2))
+
+
+    def assert_rejected(self, data, reason):
+        """
+        Assert that the client is disconnected after sending ``data`` and the
+        rejection is counted with the given reason.
+        """
+        name = u"grid_router_negotiation_errors"
+        before = sample(name, reason=reason)
+        self.protocol.dataReceived(data)
+        self.expectThat(self.transport.disconnecting, Equals(True))
+        self.expectThat(sample(name, reason=reason) - before, Equals(1.0))
+
+
+    def test_rejections_counted(self):
+        """
+        Each kind of rejection is counted separately.
+        """
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(u"10.0.0.1", 12345, u"pod-1", u"storage"),
+            u"ghijkl": _Route(None, 12345, u"pod-2", u"storage"),
+        }))
+        cases = [
+            (b"GET /id/xyz HTTP/1.1\r\n\r\n", u"unknown_tub"),
+            (b"GET /id/ghijkl HTTP/1.1\r\n\r\n", u"tub_not_ready"),
+            (b"POST /foo HTTP/1.1\r\n\r\n", u"malformed_header"),
+            (b"x" * 65, u"header_too_long"),
+        ]
+        self.service.factory().health.connect_failed(
+            u"abcdef", self.service.route_mapping()[u"abcdef"],
+        )
+        cases.append((b"GET /id/abcdef HTTP/1.1\r\n\r\n", u"tub_unhealthy"))
+        for received, reason in cases:
+            self.transport = StringTransport()
+            self.protocol = self.service.factory().buildProtocol(None)
+            self.protocol.makeConnection(self.transport)
+            self.assert_rejected(received, reason)
+
+        before = sample(u"grid_router_negotiation_errors", reason=u"timeout")
+        self.clock.advance(10.0)
+        self.expectThat(
+            sample(u"grid_router_negotiation_errors", reason=u"timeout") - before,
+            # Only the connection made by setUp is left to time out.
+            Equals(1.0),
+        )
+
+
+
+class ParkingTests(TestCase):
+    """
+    Tests for holding connections for tubs which are not yet routable.
+    """
+    def setUp(self):
+        super(ParkingTests, self).setUp()
+        self.network = MemoryReactor()
+        self.clock = Clock()
+        self.service = _GridRouterService(
+            FakeReactor(self.network, self.clock),
+            _ProxyConfiguration(park_limit=2, park_timeout=5.0),
+        )
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(None, 12345, u"pod-1", u"storage"),
+        }))
+
+
+    def connect(self, tub_id):
+        transport = StringTransport()
+        protocol = self.service.factory().buildProtocol(None)
+        protocol.makeConnection(transport)
+        protocol.dataReceived(
+            b"GET /id/" + tub_id + b" HTTP/1.1\r\n\r\n",
+        )
+        return protocol, transport
+
+
+    def test_routed(self):
+        """
+        Connections for unknown tubs and tubs without an address are held
+        until the tub is routable and then proxied.
+        """
+        _, unknown = self.connect(b"ghijkl")
+        _, not_ready = self.connect(b"abcdef")
+        self.expectThat(unknown.disconnecting, Equals(False))
+        self.expectThat(not_ready.disconnecting, Equals(False))
+        self.expectThat(self.network.connectors, Equals([]))
+
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(u"10.0.0.1", 12345, u"pod-1", u"storage"),
+            u"ghijkl": _Route(u"10.0.0.2", 23456, u"pod-2", u"storage"),
+        }))
+        self.expectThat(
+            sorted(
+                (c.getDestination() for c in self.network.connectors),
+                key=lambda address: address.port,
+            ),
+            Equals([
+                IPv4Address("TCP", "10.0.0.1", 12345),
+                IPv4Address("TCP", "10.0.0.2", 23456),
+            ]),
+        )
+
+
+    def test_expired(self):
+        """
+        A held connection is rejected if its tub does not become routable in
+        time.
+        """
+        before = sample(u"grid_router_negotiation_errors", reason=u"tub_not_ready")
+        _, transport = self.connect(b"abcdef")
+        self.clock.advance(5.0)
+        self.expectThat(transport.disconnecting, Equals(True))
+        self.expectThat(
+            sample(u"grid_router_negotiation_errors", reason=u"tub_not_ready") - before,
+            Equals(1.0),
+        )
+
+
+    def test_limit(self):
+        """
+        Once the limit is reached, connections for tubs which are not routable
+        are rejected right away.
+        """
+        self.connect(b"abcdef")
+        self.connect(b"abcdef")
+        _, transport = self.connect(b"abcdef")
+        self.expectThat(transport.disconnecting, Equals(True))
+
+
+    def test_abandoned(self):
+        """
+        A held connection which is closed by the client is forgotten.
+        """
+        protocol, _ = self.connect(b"abcdef")
+        protocol.connectionLost(Failure(ConnectionDone()))
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(u"10.0.0.1", 12345, u"pod-1", u"storage"),
+        }))
+        self.expectThat(self.network.connectors, Equals([]))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+    def test_paused(self):
+        """
+        Reading from a held connection is paused until the tub is routable.
+        Anything received from it in the meantime is passed on along with the
+        header.
+        """
+        protocol, transport = self.connect(b"abcdef")
+        self.expectThat(transport.producerState, Equals(u"paused"))
+        protocol.dataReceived(b"more")
+
+        self.service.set_route_mapping(freeze({
+            u"abcdef": _Route(u"10.0.0.1", 12345, u"pod-1", u"storage"),
+        }))
+        [(host, port, factory, timeout, _)] = self.network.tcpClients
+        downstream = StringTransport()
+        factory.buildProtocol(None).makeConnection(downstream)
+        self.expectThat(transport.producerState, Equals(u"producing"))
+        self.expectThat(
+            downstream.value(),
+            Equals(b"GET /id/abcdef HTTP/1.1\r\n\r\nmore"),
+        )
+
+
+
+class RouteHealthTests(TestCase):
+    """
+    Tests for ``_RouteHealth``.
+    """
+    def setUp(self):
+        super(RouteHealthTests, self).setUp()
+        self.clock = Clock()
+        self.health = _RouteHealth(self.clock, 1.0, 4.0)
+        self.route = _Route(u"10.0.0.1", 1234, u"pod-1", u"storage")
+
+
+    def test_healthy(self):
+        """
+        Routes are healthy until a connection fails.
+        """
+        self.assertThat(self.health.check(u"abc", self.route), Equals(True))
+
+
+    def test_backoff(self):
+        """
+        After a failure, a route is unhealthy until the delay passes.  Then
+        one probe is allowed.  Each failed probe doubles the delay up to the
+        maximum.
+        """
+        self.health.connect_failed(u"abc", self.route)
+        for delay in [1.0, 2.0, 4.0, 4.0]:
+            self.clock.advance(delay - 0.5)
+            self.expectThat(self.health.check(u"abc", self.route), Equals(False))
+            self.clock.advance(0.5)
+            self.expectThat(self.health.check(u"abc", self.route), Equals(True))
+            # Only one probe at a time.
+            self.expectThat(self.health.check(u"abc", self.route), Equals(False))
+            self.health.connect_failed(u"abc", self.route)
+
+
+    def test_concurrent_failures(self):
+        """
+        Failures of attempts made before the route was known to be unhealthy
+        do not increase the delay.
+        """
+        self.health.connect_failed(u"abc", self.route)
+        self.health.connect_failed(u"abc", self.route)
+        self.clock.advance(1.0)
+        self.assertThat(self.health.check(u"abc", self.route), Equals(True))
+
+
+    def test_recovery(self):
+        """
+        A successful connection makes the route healthy again.
+        """
+        self.health.connect_failed(u"abc", self.route)
+        self.clock.advance(1.0)
+        self.health.check(u"abc", self.route)
+        self.health.connected(u"abc")
+        self.assertThat(self.health.check(u"abc", self.route), Equals(True))
+
+
+    def test_moved(self):
+        """
+        When a tub moves to a new address, its route is healthy.
+        """
+        self.health.connect_failed(u"abc", self.route)
+        moved = _Route(u"10.0.0.2", 1234, u"pod-2", u"storage")
+        self.assertThat(self.health.check(u"abc", moved), Equals(True))
+
+
+    def test_retain(self):
+        """
+        ``_RouteHealth.retain`` forgets routes which are not in the given
+        route mapping.
+        """
+        self.health.connect_failed(u"abc", self.route)
+        self.health.retain(freeze({u"abc": self.route}))
+        self.expectThat(self.health.check(u"abc", self.route), Equals(False))
+        self.health.retain(freeze({}))
+        self.expectThat(self.health.check(u"abc", self.route), Equals(True))
+
+
+
+class RouteSnapshotTests(TestCase):
+    """
+    Tests for ``_RouteSnapshotService``.
+    """
+    def setUp(self):
+        super(RouteSnapshotTests, self).setUp()
+        self.clock = Clock()
+        self.path = FilePath(self.mktemp())
+        self.router = _GridRouterService(self.clock)
+        self.service = _RouteSnapshotService(self.clock, 10.0, self.path, self.router)
+        self.routes = freeze({
+            u"abc": _Route(u"10.0.0.1", 1234, u"pod-1", u"storage"),
+        })
+
+
+    def test_load(self):
+        """
+        When the service starts, the router is given the routes from the
+        snapshot.
+        """
+        self.path.setContent(_routes_to_json(self.routes))
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.assertThat(self.router.route_mapping(), Equals(self.routes))
+
+
+    def test_missing(self):
+        """
+        If there is no snapshot, the router starts with no routes and a
+        snapshot is written once there are some.
+        """
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.expectThat(self.router.route_mapping(), Equals(freeze({})))
+        self.expectThat(self.path.exists(), Equals(False))
+
+        self.router.set_route_mapping(self.routes)
+        self.clock.advance(10.0)
+        self.expectThat(
+            self.path.getContent(),
+            Equals(_routes_to_json(self.routes)),
+        )
+
+
+    def test_malformed(self):
+        """
+        A snapshot which cannot be loaded is ignored.
+        """
+        self.path.setContent(b"{not json")
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.assertThat(self.router.route_mapping(), Equals(freeze({})))
+
+
+    def test_unchanged(self):
+        """
+        The snapshot is not rewritten if the routes have not changed.
+        """
+        self.path.setContent(_routes_to_json(self.routes))
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.path.setContent(b"sentinel")
+        self.clock.advance(10.0)
+        self.assertThat(self.path.getContent(), Equals(b"sentinel"))
+
+
+    def test_stop(self):
+        """
+        Changed routes are saved when the service stops.
+        """
+        self.service.startService()
+        self.router.set_route_mapping(self.routes)
+        self.service.stopService()
+        self.assertThat(
+            self.path.getContent(),
+            Equals(_routes_to_json(self.routes)),
+        )
+
+
+
 class FoolscapProxyTests(AsyncTestCase):
     """
     Tests for ``_FoolscapProxy``.
@@ -339,7 +1016,9 @@ class FoolscapProxyTests(AsyncTestCase):
         # should be able to proxy connections to it for us.
         grid_router = _GridRouterService(self.reactor)
         grid_router.set_route_mapping(freeze({
-            server.getTubID().decode("ascii"): (None, server_address),
+            server.getTubID().decode("ascii"): _Route(
+                server_address[0].decode("ascii"), server_address[1], u"pod", u"storage",
+            ),
         }))
 
         # Start the proxy listening.
@@ -0,0 +1,220 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+Tests for ``grid_router._workers``.
+"""
+
+from testtools.matchers import Equals, HasLength
+
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase as AsyncTestCase
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import Factory, Protocol
+
+from pyrsistent import freeze
+
+from lae_util.testtools import TestCase, FakeProcessReactor
+
+from .. import Options
+from .._router import (
+    _GridRouterService, _Route, _worker_argv,
+    _routes_to_json, _routes_from_json, _router_frontend_service,
+)
+from .._workers import _ReusePortEndpoint, _WorkerPool
+
+
+
+class ReusePortEndpointTests(AsyncTestCase):
+    """
+    Tests for ``_ReusePortEndpoint``.
+    """
+    def test_shared(self):
+        """
+        More than one ``_ReusePortEndpoint`` can listen on the same port.
+        """
+        from twisted.internet import reactor
+        factory = Factory.forProtocol(Protocol)
+        d = _ReusePortEndpoint(reactor, 0, b"127.0.0.1").listen(factory)
+        def listening(first):
+            self.addCleanup(first.stopListening)
+            port_number = first.getHost().port
+            return _ReusePortEndpoint(
+                reactor, port_number, b"127.0.0.1",
+            ).listen(factory).addCallback(
+                lambda second: (port_number, second),
+            )
+        d.addCallback(listening)
+        def also_listening((port_number, second)):
+            self.addCleanup(second.stopListening)
+            self.assertEqual(port_number, second.getHost().port)
+        d.addCallback(also_listening)
+        return d
+
+
+
+class RouteSerializationTests(TestCase):
+    """
+    Tests for ``_routes_to_json`` and ``_routes_from_json``.
+    """
+    def test_roundtrip(self):
+        """
+        A route mapping survives serialization.
+        """
+        routes = freeze({
+            u"abc": _Route(u"10.0.0.1", 1234, u"pod-1", u"introducer"),
+            u"def": _Route(None, 5678, u"pod-2", u"storage"),
+        })
+        self.assertThat(
+            _routes_from_json(_routes_to_json(routes)),
+            Equals(routes),
+        )
+
+
+
+class WorkerPoolTests(TestCase):
+    """
+    Tests for ``_WorkerPool``.
+    """
+    def setUp(self):
+        super(WorkerPoolTests, self).setUp()
+        self.reactor = FakeProcessReactor()
+        self.metrics_dir = FilePath(self.mktemp())
+        self.metrics_dir.makedirs()
+        self.router = _GridRouterService(self.reactor)
+        self.pool = _WorkerPool(
+            self.reactor,
+            2,
+            lambda index: [b"worker", u"{}".format(index).encode("ascii")],
+            {b"FOO": b"bar"},
+            self.metrics_dir,
+            respawn_delay=3.0,
+        )
+        _router_frontend_service(self.reactor, self.router, self.pool)
+        self.router.set_route_mapping({
+            u"abc": _Route(u"10.0.0.1", 1234, u"pod-1", u"introducer"),
+        })
+        self.reactor.advance(0)
+
+
+    def test_start(self):
+        """
+        Starting the pool starts the requested number of workers and sends
+        them the current routes.
+        """
+        self.pool.startService()
+        self.expectThat(
+            list(
+                (p.executable, p.args, p.env, p.childFDs)
+                for p in self.reactor.processes
+            ),
+            Equals([
+                (b"worker", [b"worker", b"0"], {b"FOO": b"bar"}, {0: "w", 1: 1, 2: 2}),
+                (b"worker", [b"worker", b"1"], {b"FOO": b"bar"}, {0: "w", 1: 1, 2: 2}),
+            ]),
+        )
+        for p in self.reactor.processes:
+            self.expectThat(
+                p.transport.written,
+                Equals([_routes_to_json(self.router.route_mapping()) + b"\n"]),
+            )
+
+
+    def test_routes_changed(self):
+        """
+        Route changes are sent to every worker.
+        """
+        self.pool.startService()
+        self.router.set_route_mapping({})
+        self.reactor.advance(0)
+        for p in self.reactor.processes:
+            self.expectThat(p.transport.written[-1], Equals(b"{}\n"))
+
+
+    def test_routes_coalesced(self):
+        """
+        Only the last of several route changes made together is sent to the
+        workers.
+        """
+        self.pool.startService()
+        self.router.set_route_mapping({})
+        self.router.set_route_mapping({
+            u"def": _Route(u"10.0.0.2", 5678, u"pod-2", u"storage"),
+        })
+        for p in self.reactor.processes:
+            # Only the routes sent at startup so far.
+            self.expectThat(p.transport.written, HasLength(1))
+        self.reactor.advance(0)
+        for p in self.reactor.processes:
+            self.expectThat(
+                p.transport.written[1:],
+                Equals([_routes_to_json(self.router.route_mapping()) + b"\n"]),
+            )
+
+
+    def test_respawn(self):
+        """
+        A worker which exits is replaced after the respawn delay.
+        """
+        self.pool.startService()
+        first = self.reactor.processes[0]
+        first.processProtocol.processEnded(Failure(ProcessDone(0)))
+        self.expectThat(self.reactor.processes, HasLength(2))
+
+        self.reactor.advance(3.0)
+        self.expectThat(self.reactor.processes, HasLength(3))
+        self.expectThat(self.reactor.processes[-1].args, Equals([b"worker", b"0"]))
+
+
+    def test_stop(self):
+        """
+        Stopping the pool terminates the workers without replacing them and
+        cleans up the metrics directory.
+        """
+        self.pool.startService()
+        d = self.pool.stopService()
+        for p in self.reactor.processes:
+            self.expectThat(p.transport.signals, Equals(["TERM"]))
+            p.processProtocol.processEnded(Failure(ProcessDone(0)))
+        self.successResultOf(d)
+        self.reactor.advance(3.0)
+        self.expectThat(self.reactor.processes, HasLength(2))
+        self.expectThat(self.metrics_dir.exists(), Equals(False))
+
+
+
+class WorkerArgvTests(TestCase):
+    """
+    Tests for ``_worker_argv``.
+    """
+    def test_argv(self):
+        """
+        Workers are given their index, the proxy limits, and their own
+        Eliot log files.
+        """
+        options = Options()
+        options.parseOptions([
+            b"--workers", b"2",
+            b"--max-header-size", b"100",
+            b"--eliot-destination", b"file:/foo/router.json",
+            b"--kubernetes-namespace", b"testing",
+            b"--k8s-service-account",
+            b"--kubernetes", b"http://127.0.0.1:1234/",
+        ])
+        argv = _worker_argv(options, 1)
+        self.expectThat(
+            argv[argv.index(b"--worker-index") + 1],
+            Equals(b"1"),
+        )
+        self.expectThat(
+            argv[argv.index(b"--max-header-size") + 1],
+            Equals(b"100"),
+        )
+        self.expectThat(
+            argv[argv.index(b"--eliot-destination") + 1],
+            Equals(b"file:/foo/router.json.worker-1"),
+        )
+
+        # And a worker is happy with these options.
+        Options().parseOptions(argv[argv.index(b"s4-grid-router") + 1:])
@@ -31,6 +31,98 @@ CUSTOMER_METADATA_LABELS = {
 
 
 
+# The annotation on customer ConfigMaps and Deployments holding a digest of
+# everything they were created from.  If the digest of the current inputs is
+# the same, the object does not need to be updated (and there is no need to
+# create the desired object to compare it with the actual one).
+SPEC_HASH_ANNOTATION = u"leastauthority.com/spec-hash"
+
+# Change this whenever create_configuration or create_deployment change what
+# they create from the same inputs.
+_SPEC_HASH_VERSION = 1
+
+
+
+def _spec_hash(kind, inputs):
+    return sha256(dumps(
+        [_SPEC_HASH_VERSION, CONTAINERIZED_SUBSCRIPTION_VERSION, kind, inputs],
+        sort_keys=True,
+    )).hexdigest().decode("ascii")
+
+
+
+def _subscription_spec_inputs(details):
+    """
+    The parts of a subscription which go into both its ConfigMap and its
+    Deployment.
+    """
+    return {
+        u"subscription_id": details.subscription_id,
+        u"customer_email": details.customer_email,
+        u"customer_id": details.customer_id,
+        u"product_id": details.product_id,
+        u"introducer_port_number": details.introducer_port_number,
+        u"storage_port_number": details.storage_port_number,
+        # Tub identifiers are derived from these.
+        u"introducer_node_pem": details.introducer_node_pem,
+        u"server_node_pem": details.server_node_pem,
+    }
+
+
+
+def configuration_spec_hash(deploy_config, details):
+    """
+    Compute the digest of the inputs to ``create_configuration``.
+
+    :return unicode: The digest.
+    """
+    inputs = _subscription_spec_inputs(details)
+    inputs.update({
+        u"bucketname": details.bucketname,
+        u"key_prefix": details.key_prefix,
+        u"server_node_privkey": details.oldsecrets.get(u"server_node_privkey"),
+        u"internal_introducer_furl": details.oldsecrets.get(u"internal_introducer_furl"),
+        u"publichost": details.oldsecrets.get(u"publichost"),
+        u"domain": deploy_config.domain,
+        u"private_host": deploy_config.private_host,
+        u"kubernetes_namespace": deploy_config.kubernetes_namespace,
+        u"s3_access_key_id": deploy_config.s3_access_key_id,
+        u"s3_secret_key": deploy_config.s3_secret_key,
+        u"log_gatherer_furl": deploy_config.log_gatherer_furl,
+        u"stats_gatherer_furl": deploy_config.stats_gatherer_furl,
+    })
+    return _spec_hash(u"ConfigMap", inputs)
+
+
+
+def deployment_spec_hash(deploy_config, details):
+    """
+    Compute the digest of the inputs to ``create_deployment``.
+
+    :return unicode: The digest.
+    """
+    inputs = _subscription_spec_inputs(details)
+    inputs.update({
+        u"kubernetes_namespace": deploy_config.kubernetes_namespace,
+        u"introducer_image": deploy_config.introducer_image,
+        u"storageserver_image": deploy_config.storageserver_image,
+    })
+    return _spec_hash(u"Deployment", inputs)
+
+
+
+def spec_hash(obj):
+    """
+    :return: The spec hash annotation of a Kubernetes object or ``None`` if
+        it has none.
+    """
+    annotations = obj.metadata.annotations
+    if annotations is None:
+        return None
+    return annotations.get(SPEC_HASH_ANNOTATION)
+
+
+
 def _s4_customer_metadata(model):
     return model.v1.ObjectMeta(labels=CUSTOMER_METADATA_LABELS)
 
@@ -122,6 +214,9 @@ def create_configuration(deploy_config, details, model):
         [u"metadata", u"namespace"], deploy_config.kubernetes_namespace,
         # Assign it a unique identifier the deployment can use to refer to it.
         [u"metadata", u"name"], name,
+        # Remember what it was made from.
+        [u"metadata", u"annotations", SPEC_HASH_ANNOTATION],
+        configuration_spec_hash(deploy_config, details),
         # Some other metadata to make inspecting this stuff a little easier.
         *metadata
     ).transform(
@@ -420,6 +515,11 @@ def create_deployment(deploy_config, details, model):
         [u"spec", u"template"],
         lambda template: template.transform(*subscription_metadata(details)),
 
+        # Remember what it was made from.  Only on the deployment so that a
+        # change to this alone does not replace the pods.
+        [u"metadata", u"annotations", SPEC_HASH_ANNOTATION],
+        deployment_spec_hash(deploy_config, details),
+
         # ... and then to the deployment spec.
         *subscription_metadata(details)
     )
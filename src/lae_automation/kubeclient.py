@@ -1,15 +1,62 @@
 # Copyright Least Authority Enterprises.
 # See LICENSE for details.
 
+from json import loads
+from functools import partial
+
 from twisted.python.url import URL
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import Protocol
+from twisted.web.client import ResponseDone, PotentialDataLoss, readBody
+from twisted.web.http import OK, NOT_FOUND, NOT_ALLOWED, GONE
+from twisted.application.service import Service, MultiService
 
 import attr
 import attr.validators
 
+from pyrsistent import pmap
+
+from eliot import Message, start_action, write_failure
+from eliot.twisted import DeferredContext
+
+from prometheus_client import Gauge
+
 from txkube import (
-    IKubernetesClient,
+    IKubernetesClient, KubernetesError,
     network_kubernetes, authenticate_with_serviceaccount,
 )
+# There is no public API for constructing collection URLs or for checking
+# responses.
+from txkube._network import version_to_segments, check_status
+
+@attr.s(frozen=True)
+class _Query(object):
+    """
+    The parts of a selector which the Kubernetes API server can evaluate for
+    us.
+
+    :ivar unicode namespace: The namespace to which results are restricted or
+        ``None`` to search all namespaces.
+
+    :ivar labels: A mapping of label names to the values they must have.
+    """
+    namespace = attr.ib(default=None)
+    labels = attr.ib(default=pmap())
+
+    def label_selector(self):
+        """
+        :return: The ``labelSelector`` query argument for this query or
+            ``None`` if there is no label constraint.
+        """
+        if not self.labels:
+            return None
+        return u",".join(
+            u"{}={}".format(key, value)
+            for (key, value)
+            in sorted(self.labels.items())
+        )
+
+
 
 @attr.s(frozen=True)
 class LabelSelector(object):
@@ -22,12 +69,18 @@ class LabelSelector(object):
             for key in self.labels
         } == self.labels
 
+    def query(self, query):
+        return attr.assoc(query, labels=query.labels.update(self.labels))
+
 
 
 class NullSelector(object):
     def match(self, obj):
         return True
 
+    def query(self, query):
+        return query
+
 
 
 @attr.s(frozen=True)
@@ -37,6 +90,11 @@ class And(object):
     def match(self, obj):
         return all(s.match(obj) for s in self.selectors)
 
+    def query(self, query):
+        for s in self.selectors:
+            query = s.query(query)
+        return query
+
 
 
 @attr.s(frozen=True)
@@ -46,6 +104,26 @@ class NamespaceSelector(object):
     def match(self, obj):
         return self.namespace == obj.metadata.namespace
 
+    def query(self, query):
+        return attr.assoc(query, namespace=self.namespace)
+
+
+
+def _conjuncts(selector):
+    """
+    :return list: Selectors which an object must all match to match the given
+        one.
+    """
+    if isinstance(selector, NullSelector):
+        return []
+    if isinstance(selector, And):
+        return list(
+            conjunct
+            for s in selector.selectors
+            for conjunct in _conjuncts(s)
+        )
+    return [selector]
+
 
 
 def select(collection, selector):
@@ -53,9 +131,137 @@ def select(collection, selector):
 
 
 
+def _collection_location(kind, namespace):
+    """
+    Get the path segments of the collection of objects of a given kind.
+
+    :param kind: A txkube model class (for example, ``v1.Pod``).
+
+    :param unicode namespace: The namespace of the collection or ``None`` for
+        the collection spanning all namespaces.
+
+    :return tuple[unicode]: The segments.
+    """
+    prefix = version_to_segments[kind.apiVersion]
+    collection = kind.kind.lower() + u"s"
+    if namespace is None:
+        return prefix + (collection,)
+    return prefix + (u"namespaces", namespace, collection)
+
+
+
+class WatchExpired(Exception):
+    """
+    The resource version from which a watch was requested is too old for the
+    server to produce events from.  The caller must list the collection again
+    to find a new resource version to watch from.
+    """
+
+
+
+@attr.s(frozen=True)
+class WatchEvent(object):
+    """
+    One change observed by a Kubernetes watch.
+
+    :ivar unicode type: One of ``u"ADDED"``, ``u"MODIFIED"``, or
+        ``u"DELETED"``.
+
+    :ivar object: The Kubernetes object which was changed, as of the change.
+    """
+    type = attr.ib(validator=attr.validators.in_({u"ADDED", u"MODIFIED", u"DELETED"}))
+    object = attr.ib()
+
+
+
+class _WatchProtocol(Protocol):
+    """
+    Interpret the newline-delimited JSON event stream of a Kubernetes watch
+    response.
+
+    :ivar _model: The txkube model to use to load objects from the events.
+
+    :ivar _event_received: A one-argument callable to call with each
+        ``WatchEvent``.
+
+    :ivar list[bytes] _partial: The chunks received since the last complete
+        line.  Only newly received data is searched for the end of a line so
+        a large event costs no more than its size to receive.
+
+    :ivar Deferred done: Fires with ``None`` when the server ends the watch
+        normally, fails with ``WatchExpired`` if the server reports the watch
+        resource version is too old or fails with ``KubernetesError`` (with
+        the event's status as a ``dict``) if the server reports some other
+        error.
+    """
+    def __init__(self, model, event_received):
+        self._model = model
+        self._event_received = event_received
+        self._partial = []
+        self.done = Deferred()
+
+
+    def dataReceived(self, data):
+        start = 0
+        end = data.find(b"\n")
+        while end != -1:
+            self._partial.append(data[start:end])
+            line = b"".join(self._partial)
+            self._partial = []
+            if line.strip():
+                self._line_received(line)
+            start = end + 1
+            end = data.find(b"\n", start)
+        if start < len(data):
+            self._partial.append(data[start:])
+
+
+    def _line_received(self, line):
+        event = loads(line)
+        if event[u"type"] == u"ERROR":
+            # 410 Gone is how Kubernetes tells us our resourceVersion is too
+            # old.  Everything else is also unrecoverable for this watch but
+            # isn't fixed by listing again right away.
+            status = event[u"object"]
+            Message.log(event_type=u"kubeclient:watch:error", status=status)
+            self.transport.stopProducing()
+            if status.get(u"code") == GONE:
+                self._finish(WatchExpired(status.get(u"message")))
+            else:
+                self._finish(KubernetesError(status.get(u"code"), status))
+            return
+        self._event_received(WatchEvent(
+            type=event[u"type"],
+            object=self._model.iobject_from_raw(event[u"object"]),
+        ))
+
+
+    def _finish(self, reason=None):
+        if self.done.called:
+            return
+        if reason is None:
+            self.done.callback(None)
+        else:
+            self.done.errback(reason)
+
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self._finish()
+        else:
+            self._finish(reason)
+
+
+
 @attr.s(frozen=True)
 class KubeClient(object):
+    """
+    :ivar ObjectCache cache: If not ``None``, a local copy of some objects.
+        Selections of kinds it holds which are no broader than its selector
+        are answered from it instead of the API server while it is current.
+    """
     k8s = attr.ib(validator=attr.validators.provides(IKubernetesClient))
+    cache = attr.ib(default=None)
 
     @classmethod
     def from_service_account(cls):
@@ -68,7 +274,142 @@ class KubeClient(object):
         return cls(k8s=client)
 
     def select(self, kind, selector):
-        return self.k8s.list(kind).addCallback(select, selector)
+        if (
+            self.cache is not None and
+            self.cache.current(kind) and
+            self.cache.covers(selector)
+        ):
+            return succeed(self.cache.select(kind, selector))
+        return self._list(kind, selector).addCallback(select, selector)
+
+    def _list(self, kind, selector):
+        """
+        Retrieve a collection, asking the API server to leave out objects which
+        do not match the selector.
+
+        If the server cannot restrict the collection (for example, it does
+        not support listing a single namespace) the whole collection is
+        retrieved instead.  Callers should still match the selector against
+        the result.
+
+        :param kind: A txkube model class (for example, ``v1.Pod``).
+
+        :param selector: The selector to push to the server.
+
+        :return Deferred: Fires with the collection.
+        """
+        query = selector.query(_Query())
+        label_selector = query.label_selector()
+        if query.namespace is None and label_selector is None:
+            return self.k8s.list(kind)
+
+        url = self.k8s.kubernetes.base_url.child(
+            *_collection_location(kind, query.namespace)
+        )
+        if label_selector is not None:
+            url = url.add(u"labelSelector", label_selector)
+
+        action = start_action(
+            action_type=u"kubeclient:list",
+            kind=kind.kind,
+            namespace=query.namespace,
+            label_selector=label_selector,
+        )
+        with action.context():
+            d = DeferredContext(
+                self.k8s.agent.request(b"GET", url.asURI().asText().encode("ascii")),
+            )
+            def got_response(response):
+                if response.code in (NOT_FOUND, NOT_ALLOWED):
+                    Message.log(
+                        event_type=u"kubeclient:list:unrestricted",
+                        code=response.code,
+                    )
+                    discarded = readBody(response)
+                    discarded.addCallback(lambda ignored: self.k8s.list(kind))
+                    return discarded
+                checked = succeed(response)
+                checked.addCallback(check_status, (OK,), self.k8s.model)
+                checked.addCallback(readBody)
+                checked.addCallback(
+                    lambda body: self.k8s.model.iobject_from_raw(loads(body)),
+                )
+                return checked
+            d.addCallback(got_response)
+            return d.addActionFinish()
+
+    def select_versioned(self, kind, selector):
+        """
+        Like ``select`` but also report the resource version of the collection.
+
+        :return Deferred: Fires with a two-tuple of the list of matching
+            objects and the collection resource version from which a watch
+            can be started.
+        """
+        def selected(collection):
+            if collection.metadata is None:
+                resource_version = None
+            else:
+                resource_version = collection.metadata.resourceVersion
+            return (select(collection, selector), resource_version)
+        return self._list(kind, selector).addCallback(selected)
+
+    def watch(self, kind, selector, resource_version, event_received, timeout=None):
+        """
+        Watch for changes to objects of a kind.
+
+        The selector is evaluated by the API server so it must be able to
+        express itself as a ``_Query``.
+
+        :param kind: A txkube model class (for example, ``v1.Pod``).
+
+        :param selector: Restrict the events to objects matching this.
+
+        :param unicode resource_version: Report only changes which happened
+            after this version.
+
+        :param event_received: A one-argument callable to call with a
+            ``WatchEvent`` for each change.
+
+        :param int timeout: If not ``None``, ask the server to end the watch
+            after this many seconds.
+
+        :return Deferred: Fires with ``None`` when the server ends the watch
+            (which it will do periodically), fails with ``WatchExpired`` if
+            ``resource_version`` is too old to watch from or fails with
+            ``KubernetesError`` if the server rejects the watch for some
+            other reason.
+        """
+        query = selector.query(_Query())
+        url = self.k8s.kubernetes.base_url.child(
+            *_collection_location(kind, query.namespace)
+        ).add(
+            u"watch", u"true",
+        ).add(
+            u"resourceVersion", resource_version,
+        )
+        label_selector = query.label_selector()
+        if label_selector is not None:
+            url = url.add(u"labelSelector", label_selector)
+        if timeout is not None:
+            url = url.add(u"timeoutSeconds", u"{}".format(int(timeout)))
+
+        d = self.k8s.agent.request(b"GET", url.asURI().asText().encode("ascii"))
+        def got_response(response):
+            if response.code == GONE:
+                def expired(ignored):
+                    raise WatchExpired(u"Watch request failed: {}".format(response.code))
+                discarded = readBody(response)
+                discarded.addCallback(expired)
+                return discarded
+            if response.code != OK:
+                # Reads the body and turns it into a KubernetesError.
+                return check_status(response, (OK,), self.k8s.model)
+            protocol = _WatchProtocol(self.k8s.model, event_received)
+            response.deliverBody(protocol)
+            return protocol.done
+        d.addCallback(got_response)
+        return d
 
     def get_configmaps(self, selector=NullSelector()):
         return self.select(self.k8s.model.v1.ConfigMap, selector)
@@ -93,3 +434,265 @@ class KubeClient(object):
 
     def replace(self, obj):
         return self.k8s.replace(obj)
+
+
+
+class ListWatchService(Service):
+    """
+    ``ListWatchService`` keeps an observer up to date with the objects of one
+    kind using a single full list followed by a long-lived watch.
+
+    Whenever the watch expires (or fails in some other way) it goes back to a
+    full list and starts a new watch from there.  If a resync interval is
+    given, it also goes back to a full list once that much time has passed
+    since the last one, in case any changes were missed.
+
+    :ivar _listed: A one-argument callable which is called with the complete
+        list of matching objects after each full list.
+
+    :ivar _changed: A one-argument callable which is called with a
+        ``WatchEvent`` for each change observed between full lists.
+
+    :ivar float _retry_interval: The number of seconds to wait after an error
+        before listing again.
+
+    :ivar float _resync_interval: The number of seconds after which to list
+        again even if nothing went wrong or ``None`` to list again only after
+        an error.
+
+    :ivar _listed_at: The time of the last successful list or ``None``.
+
+    :ivar _stale_since: The time since which the observer may have been
+        missing changes or ``None`` if it is believed to be up to date.
+    """
+    _resource_version = None
+    _d = None
+    _delayed = None
+    _listed_at = None
+
+    def __init__(
+            self, reactor, retry_interval, kube, kind, selector, listed, changed,
+            resync_interval=None,
+    ):
+        self._reactor = reactor
+        self._retry_interval = retry_interval
+        self._resync_interval = resync_interval
+        self._stale_since = reactor.seconds()
+        self._kube = kube
+        self._kind = kind
+        self._selector = selector
+        self._listed = listed
+        self._changed = changed
+
+
+    def startService(self):
+        Service.startService(self)
+        self._list()
+
+
+    def up_to_date(self):
+        """
+        :return bool: ``True`` if the observer is believed to have seen every
+            change, ``False`` otherwise.
+        """
+        return self._stale_since is None
+
+
+    def staleness(self):
+        """
+        :return float: The number of seconds for which the observer may have
+            been missing changes.  This is ``0`` while the list and watch are
+            working.
+        """
+        if self._stale_since is None:
+            return 0.0
+        return self._reactor.seconds() - self._stale_since
+
+
+    def stopService(self):
+        Service.stopService(self)
+        if self._delayed is not None and self._delayed.active():
+            self._delayed.cancel()
+        self._delayed = None
+        if self._d is not None:
+            d, self._d = self._d, None
+            d.cancel()
+
+
+    def _list(self):
+        self._delayed = None
+        a = start_action(action_type=u"list-watch:list", kind=self._kind.kind)
+        with a.context():
+            d = DeferredContext(self._kube.select_versioned(self._kind, self._selector))
+            def listed(result):
+                objects, resource_version = result
+                a.add_success_fields(
+                    count=len(objects),
+                    resource_version=resource_version,
+                )
+                self._resource_version = resource_version
+                self._listed_at = self._reactor.seconds()
+                self._stale_since = None
+                self._listed(objects)
+            d.addCallback(listed)
+            self._running(d.addActionFinish(), self._watch)
+
+
+    def _watch(self):
+        a = start_action(
+            action_type=u"list-watch:watch",
+            kind=self._kind.kind,
+            resource_version=self._resource_version,
+        )
+        with a.context():
+            d = DeferredContext(self._kube.watch(
+                self._kind,
+                self._selector,
+                self._resource_version,
+                self._event_received,
+                timeout=self._resync_interval,
+            ))
+            self._running(d.addActionFinish(), self._watch_ended)
+
+
+    def _watch_ended(self):
+        if self._resync_due():
+            self._list()
+        else:
+            self._watch()
+
+
+    def _resync_due(self):
+        return (
+            self._resync_interval is not None
+            and self._reactor.seconds() - self._listed_at >= self._resync_interval
+        )
+
+
+    def _event_received(self, event):
+        self._resource_version = event.object.metadata.resourceVersion
+        self._changed(event)
+
+
+    def _running(self, d, next_step):
+        """
+        Keep track of the current outstanding operation and arrange for the
+        next one when it completes.
+        """
+        self._d = d
+        def succeeded(ignored):
+            self._d = None
+            if self.running:
+                next_step()
+        def failed(reason):
+            self._d = None
+            if not self.running:
+                return
+            self._resource_version = None
+            if self._stale_since is None:
+                self._stale_since = self._reactor.seconds()
+            if reason.check(WatchExpired):
+                # Nothing is wrong, our view is just too old.  Catch up right
+                # away.
+                self._list()
+            else:
+                write_failure(reason)
+                self._delayed = self._reactor.callLater(
+                    self._retry_interval, self._list,
+                )
+        d.addCallbacks(succeeded, failed)
+
+
+
+_CACHE_STALENESS = Gauge(
+    u"s4_kubernetes_cache_staleness_seconds",
+    u"The number of seconds for which the local copy of Kubernetes objects "
+    u"may have been missing changes, by kind.",
+    [u"kind"],
+)
+
+
+
+class ObjectCache(MultiService):
+    """
+    ``ObjectCache`` keeps a local copy of the objects of several kinds using
+    a ``ListWatchService`` for each.
+
+    :ivar selector: The selector the held objects match.
+
+    :ivar dict _services: The ``ListWatchService`` for each kind.
+
+    :ivar dict _objects: For each kind which has been listed at least once, a
+        mapping from namespace and name to the object.
+    """
+    def __init__(self, reactor, retry_interval, resync_interval, kube, kinds, selector):
+        MultiService.__init__(self)
+        self.selector = selector
+        self._services = {}
+        self._objects = {}
+        for kind in kinds:
+            service = ListWatchService(
+                reactor,
+                retry_interval,
+                kube,
+                kind,
+                selector,
+                partial(self._listed, kind),
+                partial(self._changed, kind),
+                resync_interval=resync_interval,
+            )
+            service.setServiceParent(self)
+            self._services[kind] = service
+            _CACHE_STALENESS.labels(kind.kind).set_function(service.staleness)
+
+
+    def current(self, kind):
+        """
+        :return bool: ``True`` if objects of the given kind are held and
+            believed to be up to date, ``False`` otherwise.
+        """
+        return (
+            kind in self._objects
+            and self._services[kind].up_to_date()
+        )
+
+
+    def covers(self, selector):
+        """
+        :return bool: ``True`` if every object matching the given selector is
+            known to match ``selector`` too (so the held objects include all
+            of them), ``False`` otherwise.
+        """
+        wanted = _conjuncts(selector)
+        return all(
+            conjunct in wanted
+            for conjunct in _conjuncts(self.selector)
+        )
+
+
+    def select(self, kind, selector):
+        """
+        :return list: The held objects of the given kind which match the
+            selector.
+        """
+        return filter(
+            selector.match,
+            (obj for (key, obj) in sorted(self._objects[kind].items())),
+        )
+
+
+    def _listed(self, kind, objects):
+        self._objects[kind] = pmap({_key(obj): obj for obj in objects})
+
+
+    def _changed(self, kind, event):
+        objects = self._objects[kind]
+        if event.type == u"DELETED":
+            self._objects[kind] = objects.discard(_key(event.object))
+        else:
+            self._objects[kind] = objects.set(_key(event.object), event.object)
+
+
+
+def _key(obj):
+    return (obj.metadata.namespace, obj.metadata.name)
@@ -25,6 +25,7 @@ from twisted.internet.defer import (
 )
 from twisted.internet.task import react, deferLater
 from twisted.web.client import ResponseNeverReceived, Agent, readBody
+from twisted.python.filepath import FilePath
 
 from txkube import (
     KubernetesError,
@@ -35,6 +36,12 @@ from lae_automation.subscription_manager import (
     UnexpectedResponseCode,
     network_client,
 )
+from lae_automation.subscription_store import (
+    SQLITE_DATABASE,
+    DirectoryStore,
+    SQLiteStore,
+    migrate,
+)
 
 
 
@@ -108,11 +115,7 @@ def _get_subscription_id(subscription_manager_client, email_or_subscription_id):
         returnValue(email_or_subscription_id)
 
     email = email_or_subscription_id
-    found = []
-    subscriptions = yield subscription_manager_client.list()
-    for subscription in subscriptions:
-        if email == subscription.customer_email:
-            found.append(subscription.subscription_id)
+    found = yield subscription_manager_client.search(email=email)
     if len(found) == 0:
         raise Exception("Could not find subscription with matching email")
     elif len(found) > 1:
@@ -248,6 +251,26 @@ def _get_active_stripe_subscriptions(reactor, api_key):
 
 
 
+def migrate_subscription_database():
+    """
+    Copy the subscriptions in the JSON files in the given subscription manager
+    state directory into an SQLite database in the same directory.
+
+    Run this once (with the subscription manager stopped) before starting the
+    subscription manager with ``--storage=sqlite``.  The JSON files are left
+    alone.
+    """
+    path = FilePath(argv[1].decode("utf-8"))
+    count = migrate(
+        DirectoryStore(path),
+        SQLiteStore.from_path(path.child(SQLITE_DATABASE)),
+    )
+    print("Migrated {} subscriptions to {}.".format(
+        count, path.child(SQLITE_DATABASE).path,
+    ))
+
+
+
 def copy_subscriptions_to_account():
     _copy_subscriptions_to_account(argv[1], argv[2])
 
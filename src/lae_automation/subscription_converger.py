@@ -14,30 +14,34 @@ them.
 """
 
 from os import environ
+from signal import SIGUSR1, SIG_DFL, signal
+from time import time
 from functools import partial
 from hashlib import sha256
 
 import attr
-from pyrsistent import PClass, field
+from pyrsistent import PClass, field, pmap
 
 from eliot import Message, start_action, write_failure
 from eliot.twisted import DeferredContext
 
 from twisted.internet.defer import (
-    Deferred, maybeDeferred, gatherResults, succeed,
+    Deferred, DeferredList, DeferredSemaphore, maybeDeferred, gatherResults,
+    succeed,
 )
 from twisted.internet import task
-from twisted.application.service import MultiService
-from twisted.application.internet import TimerService
+from twisted.application.service import Service, MultiService
 from twisted.python.usage import Options as _Options, UsageError
 from twisted.python.filepath import FilePath
 from twisted.python.url import URL
 from twisted.web.client import Agent
 
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 from txaws.credentials import AWSCredentials
 from txaws.service import AWSServiceRegion
+from txaws.route53.client import Route53Error
+from txaws.util import XML
 from txaws.route53.model import (
     Name, CNAME, RRSetKey, RRSet, delete_rrset, create_rrset, upsert_rrset,
 )
@@ -47,7 +51,7 @@ from lae_util.eliot_destination import (
     opt_eliot_destination,
     eliot_logging_service,
 )
-from lae_util import opt_metrics_port
+from lae_util import opt_metrics_port, retry_failure, backoff
 
 from .model import DeploymentConfiguration
 from .subscription_manager import Client as SMClient
@@ -61,8 +65,14 @@ from .containers import (
     create_configuration,
     create_deployment,
     new_service,
+    SPEC_HASH_ANNOTATION,
+    spec_hash,
+    configuration_spec_hash,
+    deployment_spec_hash,
+)
+from .kubeclient import (
+    KubeClient, ObjectCache, And, LabelSelector, NamespaceSelector,
 )
-from .kubeclient import KubeClient, And, LabelSelector, NamespaceSelector
 
 from txkube import (
     network_kubernetes, authenticate_with_serviceaccount,
@@ -137,7 +147,37 @@ class Options(_Options, KubernetesClientOptionsMixin):
         ("introducer-image", None, None, "The Docker image to run a Tahoe-LAFS introducer."),
         ("storageserver-image", None, None, "The Docker image to run a Tahoe-LAFS storage server."),
 
-        ("interval", None, 10.0, "The interval (in seconds) at which to iterate on convergence.", float),
+        ("interval", None, 10.0,
+         "The interval (in seconds) at which to iterate on convergence while "
+         "there are changes to make.",
+         float,
+        ),
+
+        ("maximum-interval", None, 60.0,
+         "The interval (in seconds) to which iterations slow down while there "
+         "is nothing to change.  Send SIGUSR1 to iterate right away.",
+         float,
+        ),
+
+        ("parallelism", None, 8,
+         "The greatest number of convergence changes to make at once.  "
+         "Changes for any one subscription are always made in order.",
+         int,
+        ),
+
+        ("zone-rescan-interval", None, 3600.0,
+         "The interval (in seconds) at which to load all of the Route53 "
+         "records again instead of relying on the changes the converger "
+         "makes to keep up with them.",
+         float,
+        ),
+
+        ("resync-interval", None, 300.0,
+         "The interval (in seconds) at which to list all customer grid "
+         "objects again instead of relying only on watches to keep up with "
+         "changes to them.",
+         float,
+        ),
 
         ("log-gatherer-furl", None, None,
          "A fURL pointing at a Foolscap log gatherer where Tahoe-LAFS nodes should ship their logs.",
@@ -158,6 +198,10 @@ class Options(_Options, KubernetesClientOptionsMixin):
             raise UsageError("--endpoint is required")
         if self["endpoint"].endswith("/"):
             self["endpoint"] = self["endpoint"][:-1]
+        if self["parallelism"] < 1:
+            raise UsageError("--parallelism must be at least 1")
+        if self["maximum-interval"] < self["interval"]:
+            raise UsageError("--maximum-interval must be at least --interval")
 
 
 
@@ -212,7 +256,15 @@ _CONVERGE_COMPLETE = Gauge(
 def _finish_convergence_service(
     k8s_client, options, subscription_client, reactor,
 ):
-    k8s = KubeClient(k8s=k8s_client)
+    namespace = options["kubernetes-namespace"].decode("ascii")
+    cache = _customer_grid_cache(
+        reactor,
+        options["interval"],
+        options["resync-interval"],
+        k8s_client,
+        namespace,
+    )
+    k8s = KubeClient(k8s=k8s_client, cache=cache)
 
     access_key_id = FilePath(options["aws-access-key-id-path"]).getContent().strip()
     secret_access_key = FilePath(options["aws-secret-access-key-path"]).getContent().strip()
@@ -243,18 +295,203 @@ def _finish_convergence_service(
         stats_gatherer_furl=options["stats-gatherer-furl"],
     )
 
-    return _convergence_service(
+    parent = MultiService()
+    cache.setServiceParent(parent)
+    service = _convergence_service(
         reactor,
         options["interval"],
         config,
         subscription_client,
         k8s,
         aws,
+        options["parallelism"],
+        options["zone-rescan-interval"],
+        options["maximum-interval"],
     )
+    service.trigger_signal = SIGUSR1
+    service.setServiceParent(parent)
+    return parent
+
+
+
+def _customer_grid_cache(reactor, retry_interval, resync_interval, k8s_client, namespace):
+    """
+    Create an ``ObjectCache`` holding the customer grid objects which the
+    converger inspects on each iteration so that it does not need to list
+    them all from the API server every time.
+    """
+    model = k8s_client.model
+    return ObjectCache(
+        reactor,
+        retry_interval,
+        resync_interval,
+        KubeClient(k8s=k8s_client),
+        [
+            model.v1.ConfigMap,
+            model.v1beta1.Deployment,
+            model.v1beta1.ReplicaSet,
+            model.v1.Pod,
+            model.v1.Service,
+        ],
+        customer_grid_selector(namespace),
+    )
+
+
+
+class _AdaptiveTimerService(Service):
+    """
+    Call a function repeatedly, more often while it has work to do.
+
+    The function is called when the service starts.  After each call
+    finishes, the next one is scheduled ``minimum_interval`` seconds later if
+    the call reported work or failed.  Otherwise, the delay doubles (up to
+    ``maximum_interval``) after each call with nothing to do.
+
+    :ivar _clock: An ``IReactorTime`` provider to use to schedule calls.
+
+    :ivar float _minimum_interval: The delay after a call which had work.
+
+    :ivar float _maximum_interval: The longest delay.
+
+    :ivar _busy: A one-argument callable which takes the result of a call and
+        returns ``True`` if it did some work (so that the next call should
+        come soon).
+
+    :ivar float _interval: The current delay.
+
+    :ivar _delayed: The ``IDelayedCall`` for the next call or ``None`` if a
+        call is running or the service is stopped.
+
+    :ivar Deferred _call: The result of the running call or ``None``.
+
+    :ivar bool _triggered: Whether ``trigger`` was called while a call was
+        running.
 
+    :ivar trigger_signal: The number of a signal which calls ``trigger``
+        while the service is running or ``None``.  ``_clock`` must provide
+        ``IReactorThreads`` to use this.
 
+    :ivar _previous_handler: The handler ``trigger_signal`` had before the
+        service started, to restore when it stops.
+    """
+    trigger_signal = None
+    _previous_handler = None
+
+    def __init__(self, clock, minimum_interval, maximum_interval, busy, f, *args, **kwargs):
+        self._clock = clock
+        self._minimum_interval = minimum_interval
+        self._maximum_interval = maximum_interval
+        self._busy = busy
+        self._f = f
+        self._args = args
+        self._kwargs = kwargs
+        self._interval = minimum_interval
+        self._delayed = None
+        self._call = None
+        self._triggered = False
+
+
+    def startService(self):
+        Service.startService(self)
+        if self.trigger_signal is not None:
+            self._previous_handler = signal(
+                self.trigger_signal,
+                lambda *args: self._clock.callFromThread(self.trigger),
+            )
+        self._schedule(0)
+
+
+    def stopService(self):
+        Service.stopService(self)
+        if self.trigger_signal is not None:
+            # None means the handler was not installed from Python.
+            previous = self._previous_handler
+            signal(self.trigger_signal, SIG_DFL if previous is None else previous)
+            self._previous_handler = None
+        if self._delayed is not None:
+            self._delayed.cancel()
+            self._delayed = None
+        if self._call is None:
+            return succeed(None)
+        # Let the running call finish first.
+        d = Deferred()
+        self._call.addBoth(lambda result: d.callback(None))
+        return d
+
+
+    def trigger(self):
+        """
+        Call the function as soon as possible (after the running call finishes,
+        if there is one).
+        """
+        self._interval = self._minimum_interval
+        if self._call is not None:
+            self._triggered = True
+        elif self._delayed is not None:
+            self._delayed.cancel()
+            self._schedule(0)
+
+
+    def _schedule(self, delay):
+        self._delayed = self._clock.callLater(delay, self._run)
+
+
+    def _run(self):
+        self._delayed = None
+        self._triggered = False
+        self._call = maybeDeferred(self._f, *self._args, **self._kwargs)
+        def failed(reason):
+            write_failure(reason)
+            return True
+        self._call.addCallbacks(self._busy, failed)
+        self._call.addCallback(self._finished)
+
+
+    def _finished(self, busy):
+        self._call = None
+        if not self.running:
+            return
+        if self._triggered:
+            self._schedule(0)
+            return
+        if busy:
+            self._interval = self._minimum_interval
+        else:
+            self._interval = min(self._interval * 2, self._maximum_interval)
+        self._schedule(self._interval)
+
+
+
+def _iteration_busy(iteration):
+    """
+    Decide whether a convergence iteration had work to do.
+
+    :param _Iteration iteration: The result of the iteration or ``None`` if
+        it failed outright.
+    """
+    return iteration is None or iteration.jobs > 0 or iteration.failed > 0
+
+
+
+def _convergence_service(
+    reactor, interval, config, subscription_client, k8s, aws, parallelism=1,
+    zone_rescan_interval=0, maximum_interval=None,
+):
+    """
+    Create a service which runs convergence iterations.
+
+    :param float interval: The number of seconds between iterations while
+        there are changes to make.
+
+    :param float maximum_interval: The number of seconds between iterations
+        which iterations slow down to while there is nothing to change or
+        ``None`` to use ``interval`` all the time.
+
+    :return _AdaptiveTimerService: The service.
+    """
+    if maximum_interval is None:
+        maximum_interval = interval
 
-def _convergence_service(reactor, interval, config, subscription_client, k8s, aws):
     def monitorable_converge(*a, **kw):
         d = converge(*a, **kw)
         def finished(passthrough):
@@ -267,16 +504,20 @@ def _convergence_service(reactor, interval, config, subscription_client, k8s, aw
         monitorable_converge, u"subscription_converger",
     )
 
-    service = TimerService(
+    return _AdaptiveTimerService(
+        reactor,
         interval,
+        maximum_interval,
+        _iteration_busy,
         safe_converge,
         config,
         subscription_client,
         k8s,
         aws,
+        parallelism=parallelism,
+        zones=_ZoneCache(reactor, zone_rescan_interval),
+        subscription_cache=_SubscriptionCache(),
     )
-    service.clock = reactor
-    return service
 
 
 
@@ -310,7 +551,7 @@ def with_action(action_type):
     return wrapper
 
 
-def _s4_selector(namespace):
+def customer_grid_selector(namespace):
     return And([
         LabelSelector(CUSTOMER_METADATA_LABELS),
         NamespaceSelector(namespace),
@@ -320,7 +561,7 @@ def _s4_selector(namespace):
 def get_customer_grid_service(k8s, namespace):
     action = start_action(action_type=u"load-services")
     with action.context():
-        d = DeferredContext(k8s.get_services(_s4_selector(namespace)))
+        d = DeferredContext(k8s.get_services(customer_grid_selector(namespace)))
         def got_services(services):
             services = list(services)
             action.add_success_fields(service_count=len(services))
@@ -335,7 +576,7 @@ def get_customer_grid_service(k8s, namespace):
 def get_customer_grid_configmaps(k8s, namespace):
     action = start_action(action_type=u"load-configmaps")
     with action.context():
-        d = DeferredContext(k8s.get_configmaps(_s4_selector(namespace)))
+        d = DeferredContext(k8s.get_configmaps(customer_grid_selector(namespace)))
         def got_configmaps(configmaps):
             configmaps = list(configmaps)
             action.add_success_fields(configmap_count=len(configmaps))
@@ -355,7 +596,7 @@ _DEPLOYMENTS = Gauge(
 def get_customer_grid_deployments(k8s, namespace):
     action = start_action(action_type=u"load-deployments")
     with action.context():
-        d = DeferredContext(k8s.get_deployments(_s4_selector(namespace)))
+        d = DeferredContext(k8s.get_deployments(customer_grid_selector(namespace)))
         def got_deployments(deployments):
             deployments = list(deployments)
             action.add_success_fields(deployment_count=len(deployments))
@@ -369,7 +610,7 @@ def get_customer_grid_deployments(k8s, namespace):
 def get_customer_grid_replicasets(k8s, namespace):
     action = start_action(action_type=u"load-replicasets")
     with action.context():
-        d = DeferredContext(k8s.get_replicasets(_s4_selector(namespace)))
+        d = DeferredContext(k8s.get_replicasets(customer_grid_selector(namespace)))
         def got_replicasets(replicasets):
             replicasets = list(replicasets)
             action.add_success_fields(replicaset_count=len(replicasets))
@@ -397,7 +638,7 @@ def count(iterator):
 def get_customer_grid_pods(k8s, namespace):
     action = start_action(action_type=u"load-pods")
     with action.context():
-        d = DeferredContext(k8s.get_pods(_s4_selector(namespace)))
+        d = DeferredContext(k8s.get_pods(customer_grid_selector(namespace)))
         def got_pods(pods):
             pods = list(pods)
             running = count(pod for pod in pods if pod.status.phase == u"Running")
@@ -410,10 +651,25 @@ def get_customer_grid_pods(k8s, namespace):
 
 
 
-def get_active_subscriptions(subscriptions):
+def get_active_subscriptions(subscriptions, cache=None):
+    """
+    Get the details of all active subscriptions.
+
+    :param subscription_manager.Client subscriptions: A client for the
+        subscription manager.
+
+    :param _SubscriptionCache cache: The subscriptions remembered from
+        previous iterations or ``None`` to load them all now.
+
+    :return Deferred(dict): A mapping from subscription identifiers to
+        ``SubscriptionDetails``.
+    """
     action = start_action(action_type=u"load-subscriptions")
     with action.context():
-        d = DeferredContext(subscriptions.list())
+        if cache is None:
+            d = DeferredContext(subscriptions.list())
+        else:
+            d = DeferredContext(cache.get(subscriptions))
         def got_subscriptions(subscriptions):
             subscriptions = list(subscriptions)
             action.add_success_fields(subscription_count=len(subscriptions))
@@ -427,9 +683,194 @@ def get_active_subscriptions(subscriptions):
 
 
 
+class _SubscriptionCache(object):
+    """
+    ``_SubscriptionCache`` remembers the active subscriptions from one
+    iteration to the next.
+
+    The subscriptions are loaded in full the first time.  After that, only
+    the changes since the last revision seen are retrieved from the
+    subscription manager and applied.  If retrieving changes fails, the
+    subscriptions are loaded in full again at the next iteration.
+
+    :ivar _revision: The revision of the subscription manager's database
+        which ``_subscriptions`` reflect or ``None`` if they must be loaded
+        again.
+
+    :ivar _subscriptions: A mapping from subscription identifiers to
+        ``SubscriptionDetails``.
+    """
+    def __init__(self):
+        self._revision = None
+        self._subscriptions = pmap()
+
+
+    def get(self, subscriptions):
+        """
+        Get the active subscriptions.
+
+        :param subscription_manager.Client subscriptions: A client for the
+            subscription manager.
+
+        :return Deferred(list): The ``SubscriptionDetails`` of the active
+            subscriptions.
+        """
+        d = subscriptions.changes(self._revision)
+        d.addCallbacks(self._changed, self._change_failed)
+        return d
+
+
+    def _changed(self, changes):
+        if changes.reset:
+            subscriptions = pmap().evolver()
+        else:
+            subscriptions = self._subscriptions.evolver()
+        for subscription_id in changes.deactivated:
+            if subscription_id in subscriptions:
+                subscriptions.remove(subscription_id)
+        for details in changes.subscriptions:
+            subscriptions[details.subscription_id] = details
+        self._subscriptions = subscriptions.persistent()
+        self._revision = changes.revision
+        return self._subscriptions.values()
+
+
+    def _change_failed(self, reason):
+        self._revision = None
+        return reason
+
+
+
 class _ZoneState(PClass):
+    """
+    :ivar zone: The ``HostedZone``.
+
+    :ivar rrsets: A mapping from ``RRSetKey`` to ``RRSet`` for the zone.
+
+    :ivar _ZoneCache cache: The cache this state came from, if any.  It is
+        told about changes made to the zone.
+    """
     zone = field()
     rrsets = field()
+    cache = field(initial=None)
+
+    def track(self, changes, d):
+        """
+        Arrange for the cache (if there is one) to learn the outcome of
+        submitting some changes.
+
+        :param list changes: The rrset changes which were submitted.
+
+        :param Deferred d: Fires when the changes have been made or fails if
+            they might not have been.
+
+        :return: ``d``
+        """
+        if self.cache is not None:
+            self.cache.track(changes, d)
+        return d
+
+
+
+class _ZoneCache(object):
+    """
+    ``_ZoneCache`` remembers the converger's hosted zone and its rrsets from
+    one iteration to the next.
+
+    The zone is only looked up once.  The rrsets are loaded in full at most
+    every ``rescan_interval`` seconds.  In between, they are kept up to date
+    by applying the changes the converger itself makes.  If any change is
+    rejected, the rrsets are loaded in full again at the next iteration.
+
+    :ivar _zone: The ``HostedZone`` or ``None`` if it has not been found
+        yet.
+
+    :ivar _rrsets: The rrsets of the zone or ``None`` if they must be loaded
+        again.
+
+    :ivar _loaded_at: The time at which ``_rrsets`` were last loaded in full.
+    """
+    def __init__(self, clock, rescan_interval):
+        self._clock = clock
+        self._rescan_interval = rescan_interval
+        self._zone = None
+        self._rrsets = None
+        self._loaded_at = None
+
+
+    def get(self, route53, name):
+        """
+        Get the state of the hosted zone with the given name.
+
+        :return Deferred(_ZoneState): The zone and its rrsets.
+        """
+        # XXX Bleuch zone.name should be a Name!
+        if self._zone is None or Name(self._zone.name) != name:
+            d = get_hosted_zone_by_name(route53, name)
+            d.addCallback(lambda state: self._loaded(state.zone, state.rrsets))
+        elif (
+            self._rrsets is None
+            or self._clock.seconds() - self._loaded_at >= self._rescan_interval
+        ):
+            d = _load_all_rrsets(route53, self._zone.identifier)
+            d.addCallback(lambda rrsets: self._loaded(self._zone, rrsets))
+            d.addErrback(self._load_failed)
+        else:
+            d = succeed(self._state())
+        return d
+
+
+    def _loaded(self, zone, rrsets):
+        self._zone = zone
+        self._rrsets = pmap(rrsets)
+        self._loaded_at = self._clock.seconds()
+        return self._state()
+
+
+    def _load_failed(self, reason):
+        # Perhaps the zone is gone.  Look it up again next time.
+        self._zone = None
+        return reason
+
+
+    def _state(self):
+        return _ZoneState(zone=self._zone, rrsets=self._rrsets, cache=self)
+
+
+    def track(self, changes, d):
+        """
+        Apply some changes to the rrsets if they are made or arrange to load
+        them in full if they are not.
+
+        :see: ``_ZoneState.track``
+        """
+        def succeeded(result):
+            if self._rrsets is not None:
+                self._rrsets = _apply_rrset_changes(self._rrsets, changes)
+            return result
+        def failed(reason):
+            self._rrsets = None
+            return reason
+        d.addCallbacks(succeeded, failed)
+
+
+
+def _apply_rrset_changes(rrsets, changes):
+    """
+    :param rrsets: A mapping from ``RRSetKey`` to ``RRSet``.
+
+    :param list changes: Route53 rrset changes which were made.
+
+    :return: ``rrsets`` updated with ``changes``.
+    """
+    rrsets = rrsets.evolver()
+    for change in changes:
+        key = RRSetKey(label=change.rrset.label, type=change.rrset.type)
+        if change.action == u"DELETE":
+            rrsets.remove(key)
+        else:
+            rrsets[key] = change.rrset
+    return rrsets.persistent()
 
 
 
@@ -444,37 +885,99 @@ class _State(PClass):
 
 
 
-def _get_converge_inputs(config, subscriptions, k8s, aws):
+_INPUT_SECONDS = Histogram(
+    u"s4_convergence_input_seconds",
+    u"Time taken to load one of the inputs to a convergence iteration.",
+    [u"source"],
+)
+
+_LOGIC_SECONDS = Histogram(
+    u"s4_convergence_logic_seconds",
+    u"Time taken by one converger to compute the changes it wants to make.",
+    [u"converger"],
+)
+
+_EXECUTE_SECONDS = Histogram(
+    u"s4_convergence_execute_seconds",
+    u"Time taken to make all of the changes computed by a convergence "
+    u"iteration.",
+)
+
+_JOBS_CREATED = Counter(
+    u"s4_convergence_jobs_created",
+    u"The number of changes computed by convergence iterations.",
+    [u"converger", u"operation"],
+)
+
+_JOBS_SUCCEEDED = Counter(
+    u"s4_convergence_jobs_succeeded",
+    u"The number of changes made successfully by convergence iterations.",
+    [u"converger", u"operation"],
+)
+
+_JOBS_FAILED = Counter(
+    u"s4_convergence_jobs_failed",
+    u"The number of changes convergence iterations failed to make.",
+    [u"converger", u"operation"],
+)
+
+
+
+def _timed(histogram, f, *args, **kwargs):
+    """
+    Call a function and observe how long it takes for the result to be
+    available (whether it succeeds or fails).
+
+    :param histogram: The Prometheus histogram (or labeled histogram) in
+        which to observe the duration.
+
+    :return Deferred: Fires with the result of ``f``.
+    """
+    before = time()
+    d = maybeDeferred(f, *args, **kwargs)
+    def observe(passthrough):
+        histogram.observe(time() - before)
+        return passthrough
+    d.addBoth(observe)
+    return d
+
+
+
+def _get_converge_inputs(config, subscriptions, k8s, aws, zones, subscription_cache):
     a = start_action(action_type=u"load-converge-inputs")
     with a.context():
+        namespace = config.kubernetes_namespace
+        # The _State field each input is for, how to load it, and with what.
+        inputs = [
+            (u"subscriptions", get_active_subscriptions, (subscriptions, subscription_cache)),
+            (u"configmaps", get_customer_grid_configmaps, (k8s, namespace)),
+            (u"deployments", get_customer_grid_deployments, (k8s, namespace)),
+            (u"replicasets", get_customer_grid_replicasets, (k8s, namespace)),
+            (u"pods", get_customer_grid_pods, (k8s, namespace)),
+            (u"service", get_customer_grid_service, (k8s, namespace)),
+            (u"zone", _get_zone, (zones, aws.get_route53_client(), Name(config.domain))),
+        ]
         d = DeferredContext(
-            gatherResults([
-                get_active_subscriptions(subscriptions),
-                get_customer_grid_configmaps(k8s, config.kubernetes_namespace),
-                get_customer_grid_deployments(k8s, config.kubernetes_namespace),
-                get_customer_grid_replicasets(k8s, config.kubernetes_namespace),
-                get_customer_grid_pods(k8s, config.kubernetes_namespace),
-                get_customer_grid_service(k8s, config.kubernetes_namespace),
-                get_hosted_zone_by_name(aws.get_route53_client(), Name(config.domain)),
-            ]),
+            gatherResults(list(
+                _timed(_INPUT_SECONDS.labels(source), f, *args)
+                for (source, f, args) in inputs
+            )),
         )
         d.addCallback(
             lambda state: _State(**dict(
-                zip([
-                    u"subscriptions",
-                    u"configmaps",
-                    u"deployments",
-                    u"replicasets",
-                    u"pods",
-                    u"service",
-                    u"zone",
-                ], state,
-                ),
+                zip(list(source for (source, f, args) in inputs), state),
             )),
         )
         return d.addActionFinish()
 
 
+def _get_zone(zones, route53, name):
+    if zones is None:
+        return get_hosted_zone_by_name(route53, name)
+    return zones.get(route53, name)
+
+
+
 @with_action(action_type=u"converge-logic")
 def _converge_logic(actual, config, subscriptions, k8s, aws):
     convergers = [
@@ -489,16 +992,62 @@ def _converge_logic(actual, config, subscriptions, k8s, aws):
 
     jobs = []
     for converger in convergers:
-        with start_action(action_type=converger.func_name):
-            jobs.extend(converger(actual, config, subscriptions, k8s, aws))
+        name = converger.func_name
+        with start_action(action_type=name):
+            with _LOGIC_SECONDS.labels(name).time():
+                for job in converger(actual, config, subscriptions, k8s, aws):
+                    _JOBS_CREATED.labels(name, job.operation).inc()
+                    jobs.append(job.set(converger=name))
 
     return jobs
 
 
 
+class _Job(PClass):
+    """
+    One change to make to bring the actual state in line with the desired
+    state.
+
+    :ivar key: Jobs with the same key are run one at a time in the order they
+        were computed.  This is the subscription identifier for
+        subscription-specific jobs (so that, for example, a deletion happens
+        before the corresponding creation and a subscription's ConfigMap is
+        created before its Deployment) or ``None`` for others.
+
+    :ivar run: A no-argument callable which makes the change.  It may return
+        a ``Deferred``.
+
+    :ivar unicode operation: What kind of change this is (for example,
+        ``u"create"``).
+
+    :ivar unicode converger: The name of the converger which computed this
+        job.
+    """
+    key = field()
+    run = field()
+    operation = field(initial=u"change")
+    converger = field(initial=u"unknown")
+
+
+
+class _Iteration(PClass):
+    """
+    The outcome of one convergence iteration.
+
+    :ivar int jobs: The number of changes the iteration tried to make.
+
+    :ivar int failed: The number of those changes which failed.
+    """
+    jobs = field()
+    failed = field()
+
+
+
 class _Changes(PClass):
     create = field()
+    update = field()
     delete = field()
+    annotate = field(initial=())
 
 
 
@@ -509,7 +1058,9 @@ def _compute_changes(desired, actual):
     """
     # Start with the assumption that everything will need to be created.
     to_create = set(sorted(desired.iterkeys()))
+    to_update = set()
     to_delete = set()
+    to_annotate = set()
 
     # Visit everything in the actual state and determine if it needs to be
     # changed somehow.  Since we started with the assumption that everything
@@ -527,19 +1078,61 @@ def _compute_changes(desired, actual):
             to_delete.add(sid)
             continue
 
+        # It exists so it does not need to be created.
+        to_create.remove(sid)
         if actual.needs_update(subscription):
             # Something about the actual state disagrees with the subscription
-            # state.  Delete the current state and re-create the new state.
+            # state.  Change it in place so that Kubernetes can roll the
+            # change out instead of everything going away at once.
             Message.log(condition=u"needs-update", subscription=sid)
-            to_delete.add(sid)
-        else:
-            # It appears to be fine as-is.  Don't delete it and don't create
-            # it.
-            to_create.remove(sid)
+            to_update.add(sid)
+        elif actual.needs_annotation(subscription):
+            # It agrees with the subscription but predates spec hashes.
+            # Record the hash once so later iterations can skip the
+            # comparison.
+            Message.log(condition=u"needs-annotation", subscription=sid)
+            to_annotate.add(sid)
 
     return _Changes(
         create=list(desired[sid] for sid in to_create),
+        update=list(desired[sid] for sid in sorted(to_update)),
         delete=to_delete,
+        annotate=list(desired[sid] for sid in sorted(to_annotate)),
+    )
+
+
+
+def _replacement(actual, desired):
+    """
+    Make an object suitable for replacing an existing object.
+
+    :param actual: The existing object.
+    :param desired: The object as it should be.
+
+    :return: ``desired`` with the resource version of ``actual`` so that the
+        replacement fails if ``actual`` has been changed by someone else in
+        the meantime (the next iteration will try again).
+    """
+    return desired.transform(
+        [u"metadata", u"resourceVersion"], actual.metadata.resourceVersion,
+    )
+
+
+
+def _annotated(actual, hash):
+    """
+    Make an object suitable for recording the spec hash of an existing object
+    which agrees with the desired state but predates spec hashes.
+
+    :param actual: The existing object.
+    :param unicode hash: The spec hash of the desired object.
+
+    :return: ``actual`` with ``hash`` in its spec hash annotation.  Nothing
+        else changes so replacing ``actual`` with it does not roll anything
+        out.
+    """
+    return actual.transform(
+        [u"metadata", u"annotations", SPEC_HASH_ANNOTATION], hash,
     )
 
 
@@ -549,7 +1142,7 @@ def _converge_service(actual, config, subscriptions, k8s, aws):
     if create_service:
         service = new_service(config.kubernetes_namespace, k8s.k8s.model)
         # Create it if it was missing.
-        return [lambda: k8s.create(service)]
+        return [_Job(key=None, operation=u"create", run=lambda: k8s.create(service))]
 
     return []
 
@@ -570,6 +1163,12 @@ class _ChangeableDeployments(PClass):
 
     def needs_update(self, subscription):
         deployment = self.deployments[subscription.subscription_id]
+        actual_hash = spec_hash(deployment)
+        if actual_hash is not None:
+            return actual_hash != deployment_spec_hash(self.deploy_config, subscription)
+
+        # It was created before spec hashes.  Look at the parts of it which
+        # may have changed.
         introducer = list(
             container
             for  container
@@ -596,15 +1195,17 @@ class _ChangeableDeployments(PClass):
         )
 
 
+    def needs_annotation(self, subscription):
+        return spec_hash(self.deployments[subscription.subscription_id]) is None
+
+
 
 def _converge_deployments(actual, deploy_config, subscriptions, k8s, aws):
-    changes = _compute_changes(
-        actual.subscriptions,
-        _ChangeableDeployments(
-            deploy_config=deploy_config,
-            deployments=actual.deployments,
-        ),
+    deployments = _ChangeableDeployments(
+        deploy_config=deploy_config,
+        deployments=actual.deployments,
     )
+    changes = _compute_changes(actual.subscriptions, deployments)
     def delete(sid):
         return k8s.delete(k8s.k8s.model.v1beta1.Deployment(
             metadata=dict(
@@ -615,10 +1216,34 @@ def _converge_deployments(actual, deploy_config, subscriptions, k8s, aws):
     def create(subscription):
         deployment = create_deployment(deploy_config, subscription, k8s.k8s.model)
         return k8s.create(deployment)
+    def update(subscription):
+        return k8s.replace(_replacement(
+            deployments.deployments[subscription.subscription_id],
+            create_deployment(deploy_config, subscription, k8s.k8s.model),
+        ))
+    def annotate(subscription):
+        return k8s.replace(_annotated(
+            deployments.deployments[subscription.subscription_id],
+            deployment_spec_hash(deploy_config, subscription),
+        ))
 
-    deletes = list(partial(delete, sid) for sid in changes.delete)
-    creates = list(partial(create, s) for s in changes.create)
-    return deletes + creates
+    deletes = list(
+        _Job(key=sid, operation=u"delete", run=partial(delete, sid))
+        for sid in changes.delete
+    )
+    creates = list(
+        _Job(key=s.subscription_id, operation=u"create", run=partial(create, s))
+        for s in changes.create
+    )
+    updates = list(
+        _Job(key=s.subscription_id, operation=u"update", run=partial(update, s))
+        for s in changes.update
+    )
+    annotates = list(
+        _Job(key=s.subscription_id, operation=u"annotate", run=partial(annotate, s))
+        for s in changes.annotate
+    )
+    return deletes + creates + updates + annotates
 
 
 def _converge_replicasets(actual, config, subscriptions, k8s, aws):
@@ -629,12 +1254,15 @@ def _converge_replicasets(actual, config, subscriptions, k8s, aws):
         sid = replicaset.metadata.annotations[u"subscription"]
         if sid not in actual.subscriptions:
             Message.log(condition=u"undesired", subscription=sid)
-            deletes.append(replicaset.metadata)
+            deletes.append((sid, replicaset.metadata))
 
     def delete(metadata):
         return k8s.delete(k8s.k8s.model.v1beta1.ReplicaSet(metadata=metadata))
 
-    return list(partial(delete, metadata) for metadata in deletes)
+    return list(
+        _Job(key=sid, operation=u"delete", run=partial(delete, metadata))
+        for (sid, metadata) in deletes
+    )
 
 
 def _converge_pods(actual, config, subscriptions, k8s, aws):
@@ -645,12 +1273,15 @@ def _converge_pods(actual, config, subscriptions, k8s, aws):
         sid = pod.metadata.annotations[u"subscription"]
         if sid not in actual.subscriptions:
             Message.log(condition=u"undesired", subscription=sid)
-            deletes.append(pod.metadata)
+            deletes.append((sid, pod.metadata))
 
     def delete(metadata):
         return k8s.delete(k8s.k8s.model.v1.Pod(metadata=metadata))
 
-    return list(partial(delete, metadata) for metadata in deletes)
+    return list(
+        _Job(key=sid, operation=u"delete", run=partial(delete, metadata))
+        for (sid, metadata) in deletes
+    )
 
 
 class _ChangeableConfigMaps(PClass):
@@ -669,6 +1300,11 @@ class _ChangeableConfigMaps(PClass):
 
     def needs_update(self, subscription):
         actual_configmap = self.configmaps[subscription.subscription_id]
+        actual_hash = spec_hash(actual_configmap)
+        if actual_hash is not None:
+            return actual_hash != configuration_spec_hash(self.deploy_config, subscription)
+
+        # It was created before spec hashes.  Compare it with a new one.
         expected_configmap = create_configuration(
             self.deploy_config,
             subscription,
@@ -677,16 +1313,18 @@ class _ChangeableConfigMaps(PClass):
         return actual_configmap.data != expected_configmap.data
 
 
+    def needs_annotation(self, subscription):
+        return spec_hash(self.configmaps[subscription.subscription_id]) is None
+
+
 
 def _converge_configmaps(actual, deploy_config, subscriptions, k8s, aws):
-    changes = _compute_changes(
-        actual.subscriptions,
-        _ChangeableConfigMaps(
-            deploy_config=deploy_config,
-            k8s_model=k8s.k8s.model,
-            configmaps=actual.configmaps,
-        ),
+    configmaps = _ChangeableConfigMaps(
+        deploy_config=deploy_config,
+        k8s_model=k8s.k8s.model,
+        configmaps=actual.configmaps,
     )
+    changes = _compute_changes(actual.subscriptions, configmaps)
     def delete(sid):
         return k8s.delete(k8s.k8s.model.v1.ConfigMap(
             metadata=dict(
@@ -696,9 +1334,33 @@ def _converge_configmaps(actual, deploy_config, subscriptions, k8s, aws):
         ))
     def create(subscription):
         return k8s.create(create_configuration(deploy_config, subscription, k8s.k8s.model))
-    deletes = list(partial(delete, sid) for sid in changes.delete)
-    creates = list(partial(create, s) for s in changes.create)
-    return deletes + creates
+    def update(subscription):
+        return k8s.replace(_replacement(
+            configmaps.configmaps[subscription.subscription_id],
+            create_configuration(deploy_config, subscription, k8s.k8s.model),
+        ))
+    def annotate(subscription):
+        return k8s.replace(_annotated(
+            configmaps.configmaps[subscription.subscription_id],
+            configuration_spec_hash(deploy_config, subscription),
+        ))
+    deletes = list(
+        _Job(key=sid, operation=u"delete", run=partial(delete, sid))
+        for sid in changes.delete
+    )
+    creates = list(
+        _Job(key=s.subscription_id, operation=u"create", run=partial(create, s))
+        for s in changes.create
+    )
+    updates = list(
+        _Job(key=s.subscription_id, operation=u"update", run=partial(update, s))
+        for s in changes.update
+    )
+    annotates = list(
+        _Job(key=s.subscription_id, operation=u"annotate", run=partial(annotate, s))
+        for s in changes.annotate
+    )
+    return deletes + creates + updates + annotates
 
 
 
@@ -732,6 +1394,10 @@ class _ChangeableZone(PClass):
         return False
 
 
+    def needs_annotation(self, subscription):
+        return False
+
+
 
 def _converge_route53_customer(actual, config, subscriptions, k8s, aws):
     """
@@ -751,22 +1417,32 @@ def _converge_route53_customer(actual, config, subscriptions, k8s, aws):
             domain=config.domain,
         ),
     )
-    # XXX Probably would be nice to group changes.  Also, issue changes insert
-    # of delete/create.  Some structured objects would make that easier.
     route53 = aws.get_route53_client()
-    def delete(sid):
-        return delete_route53_rrsets(route53, actual.zone.zone, [sid])
-    def create(subscription):
-        return create_route53_rrsets(route53, actual.zone.zone, [subscription])
-    deletes = list(partial(delete, sid) for sid in changes.delete)
-    creates = list(partial(create, s) for s in changes.create)
+    zone = actual.zone.zone
+    rrset_changes = list(
+        delete_rrset(_rrset_for_subscription(sid, zone.name))
+        for sid in sorted(changes.delete)
+    ) + list(
+        create_rrset(_rrset_for_subscription(subscription.subscription_id, zone.name))
+        for subscription in changes.create
+    )
 
     Message.log(
         event=u"convergence-service:route53-customer",
         create=list(subscription.subscription_id for subscription in changes.create),
         delete=list(changes.delete),
     )
-    return deletes + creates
+    # Submit everything together, in as few requests as Route53 allows,
+    # instead of one request per subscription.
+    def submit(batch):
+        return actual.zone.track(
+            batch,
+            submit_route53_changes(route53, zone, batch),
+        )
+    return list(
+        _Job(key=None, operation=u"change", run=partial(submit, batch))
+        for batch in _route53_batches(rrset_changes)
+    )
 
 
 
@@ -807,38 +1483,94 @@ def _converge_route53_infrastructure(actual, config, subscriptions, k8s, aws):
     # Create it or change it to what we want.
     route53 = aws.get_route53_client()
     return [
-        lambda: change_route53_rrsets(route53, actual.zone.zone, desired_rrset),
+        _Job(
+            key=None,
+            operation=u"change",
+            run=lambda: actual.zone.track(
+                [upsert_rrset(desired_rrset)],
+                change_route53_rrsets(route53, actual.zone.zone, desired_rrset),
+            ),
+        ),
     ]
 
 
-def _execute_converge_output(jobs):
+def _execute_converge_output(jobs, failures):
     if not jobs:
         return succeed(None)
 
     a = start_action(action_type=u"execute-converge-step")
     with a.context():
         job = jobs.pop(0)
-        d = DeferredContext(job())
-        d.addErrback(write_failure)
+        d = DeferredContext(maybeDeferred(job.run))
+        def succeeded(result):
+            _JOBS_SUCCEEDED.labels(job.converger, job.operation).inc()
+            return result
+        def failed(reason):
+            _JOBS_FAILED.labels(job.converger, job.operation).inc()
+            write_failure(reason)
+            failures.append(job)
+        d.addCallbacks(succeeded, failed)
         d = d.addActionFinish()
 
     if jobs:
         # Capture whatever action context is active now and make sure it is
         # also active when we get back here to process the next job.
         DeferredContext(d).addCallback(
-            lambda ignored: _execute_converge_output(jobs),
+            lambda ignored: _execute_converge_output(jobs, failures),
         )
     return d
 
 
-def _execute_converge_outputs(jobs):
-    a = start_action(action_type=u"execute-converge-steps")
+def _execute_converge_outputs(jobs, parallelism=1):
+    """
+    Run converge jobs, up to ``parallelism`` of them at a time.
+
+    Jobs with the same key are run in order, one after another.  A failed job
+    is logged and does not stop any other job from running.
+
+    :param list[_Job] jobs: The jobs to run.
+
+    :param int parallelism: The greatest number of jobs to run at once.
+
+    :return Deferred: Fires with a list of the jobs which failed when all of
+        the jobs have finished.
+    """
+    a = start_action(
+        action_type=u"execute-converge-steps",
+        count=len(jobs),
+        parallelism=parallelism,
+    )
     with a.context():
-        d = DeferredContext(_execute_converge_output(jobs))
+        failures = []
+        sequences = {}
+        keys = []
+        for job in jobs:
+            if job.key not in sequences:
+                sequences[job.key] = []
+                keys.append(job.key)
+            sequences[job.key].append(job)
+
+        semaphore = DeferredSemaphore(parallelism)
+        def execute(sequence):
+            # The semaphore may run this after the current action context is
+            # gone.  Put it back.
+            with a.context():
+                return _execute_converge_output(sequence, failures)
+
+        def execute_all():
+            return gatherResults(list(
+                semaphore.run(execute, sequences[key])
+                for key in keys
+            ))
+        d = DeferredContext(_timed(_EXECUTE_SECONDS, execute_all))
+        d.addCallback(lambda ignored: failures)
         return d.addActionFinish()
 
 
-def converge(config, subscriptions, k8s, aws):
+def converge(
+    config, subscriptions, k8s, aws, parallelism=1, zones=None,
+    subscription_cache=None,
+):
     """
     Bring provisioned resources in line with active subscriptions.
 
@@ -853,7 +1585,15 @@ def converge(config, subscriptions, k8s, aws):
 
     :param AWSServiceRegion aws: A client for interacting with AWS.
 
-    :return Deferred(NoneType): The returned ``Deferred`` fires after one
+    :param int parallelism: The greatest number of changes to make at once.
+
+    :param _ZoneCache zones: The hosted zone state remembered from previous
+        iterations or ``None`` to load it all now.
+
+    :param _SubscriptionCache subscription_cache: The subscriptions
+        remembered from previous iterations or ``None`` to load them all now.
+
+    :return Deferred(_Iteration): The returned ``Deferred`` fires after one
         attempt has been made to bring the actual state of provisioned
         resources in line with the desired state of provisioned resources
         based on the currently active subscriptions.
@@ -865,10 +1605,17 @@ def converge(config, subscriptions, k8s, aws):
     # mis-configurations and correct them.
     a = start_action(action_type=u"converge")
     with a.context():
-        d = DeferredContext(_get_converge_inputs(config, subscriptions, k8s, aws))
+        d = DeferredContext(_get_converge_inputs(
+            config, subscriptions, k8s, aws, zones, subscription_cache,
+        ))
         d.addCallback(_converge_logic, config, subscriptions, k8s, aws)
-        d.addCallback(_execute_converge_outputs)
-        d.addCallback(lambda result: None)
+        def execute(jobs):
+            d = _execute_converge_outputs(jobs, parallelism)
+            d.addCallback(
+                lambda failures: _Iteration(jobs=len(jobs), failed=len(failures)),
+            )
+            return d
+        d.addCallback(execute)
         return d.addActionFinish()
 
 
@@ -981,30 +1728,181 @@ def _rrset_for_subscription(subscription_id, zone_name):
     )
 
 
-def delete_route53_rrsets(route53, zone, subscription_ids):
-    a = start_action(action_type=u"delete-route53", subscription_ids=list(subscription_ids))
-    with a.context():
-        d = route53.change_resource_record_sets(zone.identifier, list(
-            delete_rrset(_rrset_for_subscription(subscription_id, zone.name))
-            for subscription_id
-            in subscription_ids
-        ))
-        d = DeferredContext(d)
-        return d.addActionFinish()
+# Route53's limits on the content of one ChangeResourceRecordSets request.
+# See
+# http://docs.aws.amazon.com/Route53/latest/DeveloperGuide/DNSLimitations.html#limits-api-requests-changeresourcerecordsets
+_ROUTE53_MAX_RECORDS = 1000
+_ROUTE53_MAX_VALUE_CHARACTERS = 32000
+
+# The error codes with which Route53 tells us to slow down.
+_ROUTE53_THROTTLING_CODES = {u"Throttling", u"PriorRequestNotComplete"}
 
 
-def create_route53_rrsets(route53, zone, subscriptions):
-    a = start_action(action_type=u"create-route53")
+
+def _route53_change_size(change):
+    """
+    :return: A two-tuple of the number of records and the number of
+        characters of record values which ``change`` counts for towards
+        Route53's request limits.
+    """
+    # UPSERTs count double.
+    factor = 2 if change.action == u"UPSERT" else 1
+    return (
+        factor * len(change.rrset.records),
+        factor * sum(_record_value_length(record) for record in change.rrset.records),
+    )
+
+
+
+def _record_value_length(record):
+    try:
+        return len(record.to_text())
+    except UnicodeError:
+        # The record cannot be put into a request at all (txaws IDNA-encodes
+        # names).  It will fail on its own when its batch is split; it just
+        # does not count towards the limit.
+        return 0
+
+
+
+def _route53_batches(changes):
+    """
+    Split rrset changes into as few batches as possible such that each fits
+    in one Route53 request.
+
+    :param list changes: The changes, in the order they should be made.
+
+    :return list[list]: The batches, in the order they should be submitted.
+    """
+    batches = []
+    batch = []
+    records = characters = 0
+    for change in changes:
+        more_records, more_characters = _route53_change_size(change)
+        if batch and (
+            records + more_records > _ROUTE53_MAX_RECORDS
+            or characters + more_characters > _ROUTE53_MAX_VALUE_CHARACTERS
+        ):
+            batches.append(batch)
+            batch = []
+            records = characters = 0
+        batch.append(change)
+        records += more_records
+        characters += more_characters
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+
+class _Route53Throttled(Exception):
+    """
+    Route53 rejected a request because too many have been made recently.
+    """
+
+
+
+def _route53_error_codes(error):
+    """
+    :param Route53Error error: An error response from Route53.
+
+    :return set[unicode]: The error codes in the response.
+    """
+    # txaws only interprets the body of 5xx responses.  Throttling is a 400
+    # response so look at the body ourselves.
+    tree = XML(error.original.strip())
+    return {
+        node.text
+        for node in tree.iter()
+        if node.tag.rsplit(u"}", 1)[-1] == u"Code"
+    }
+
+
+
+def _check_route53_throttling(reason):
+    reason.trap(Route53Error)
+    if _route53_error_codes(reason.value) & _ROUTE53_THROTTLING_CODES:
+        raise _Route53Throttled(reason.value)
+    return reason
+
+
+
+def _first_failure(results):
+    """
+    Log all but the first failure in the result of a ``DeferredList`` and
+    return the first one.  If there are no failures, return ``None``.
+    """
+    failures = list(result for (success, result) in results if not success)
+    for reason in failures[1:]:
+        write_failure(reason)
+    if failures:
+        return failures[0]
+    return None
+
+
+
+def submit_route53_changes(route53, zone, changes, reactor=None, steps=None):
+    """
+    Submit a batch of rrset changes to Route53.
+
+    If Route53 throttles the request, it is retried after a delay.  If it
+    rejects the request for some other reason, the batch is split and the
+    halves are submitted separately so that one bad change does not prevent
+    all of the others from being made.
+
+    :param zone: The ``HostedZone`` to change.
+
+    :param list changes: The changes to make.  They must fit in one request
+        (see ``_route53_batches``).
+
+    :param reactor: The reactor to use to delay retries.
+
+    :param steps: The delays between retries of a throttled request.
+        ``None`` means a backoff lasting up to five minutes.
+
+    :return Deferred: Fires when the changes have been made, or fails with
+        the reason a change could not be made.  If several changes could not
+        be made, it fails with the reason for the first of them and the
+        others are logged.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    if steps is None:
+        delays = backoff(step=1.0, maximum_step=30.0, timeout=5 * 60.0)
+    else:
+        delays = steps
+
+    a = start_action(
+        action_type=u"submit-route53",
+        zone=zone.identifier,
+        change_count=len(changes),
+    )
     with a.context():
-        d = route53.change_resource_record_sets(zone.identifier, list(
-            create_rrset(_rrset_for_subscription(subscription.subscription_id, zone.name))
-            for subscription
-            in subscriptions
+        def submit():
+            d = route53.change_resource_record_sets(zone.identifier, changes)
+            d.addErrback(_check_route53_throttling)
+            return d
+        d = DeferredContext(retry_failure(
+            reactor, submit, expected=[_Route53Throttled], steps=delays,
         ))
-        d = DeferredContext(d)
+        def failed(reason):
+            if len(changes) == 1 or reason.check(_Route53Throttled):
+                return reason
+            middle = len(changes) // 2
+            halves = [changes[:middle], changes[middle:]]
+            Message.log(event=u"submit-route53:split", reason=unicode(reason.value))
+            return DeferredList(
+                list(
+                    submit_route53_changes(route53, zone, half, reactor, steps)
+                    for half in halves
+                ),
+                consumeErrors=True,
+            ).addCallback(_first_failure)
+        d.addErrback(failed)
         return d.addActionFinish()
 
 
+
 def change_route53_rrsets(route53, zone, rrset):
     a = start_action(action_type=u"change-route53", zone=zone.identifier, rrset=attr.asdict(rrset))
     with a.context():
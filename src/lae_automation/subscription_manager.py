@@ -8,25 +8,34 @@ provides persistence of S4 subscriptions.
 
 from io import BytesIO
 from json import loads, dumps
-from os import O_CREAT, O_EXCL, O_WRONLY, open as os_open, fdopen
-from base64 import b32encode, b32decode
 from urllib import quote
+from collections import OrderedDict
 
 import attr
 from attr import validators
 
-from eliot import start_action
+from zope.interface import implementer
+
+from eliot import start_action, write_failure
 from eliot.twisted import DeferredContext
 
+from prometheus_client import Counter
+
 from twisted.python.url import URL
 from twisted.web.iweb import IAgent, IResponse
 from twisted.web.resource import Resource
-from twisted.web.http import CREATED, NO_CONTENT, OK, BAD_REQUEST
-from twisted.web.server import Site
+from twisted.web.http import (
+    CREATED, NO_CONTENT, OK, BAD_REQUEST, NOT_MODIFIED, CACHED,
+)
+from twisted.web.http_headers import Headers
+from twisted.web.server import Site, NOT_DONE_YET
+from twisted.internet.defer import CancelledError, TimeoutError
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.task import TaskFinished, TaskStopped
 from twisted.internet import task as theCooperator
 from twisted.web.client import FileBodyProducer, readBody
 from twisted.python.usage import Options as _Options, UsageError
-from twisted.python.filepath import IFilePath, FilePath
+from twisted.python.filepath import FilePath
 from twisted.application.service import MultiService
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet.endpoints import serverFromString
@@ -34,10 +43,11 @@ from twisted.internet.endpoints import serverFromString
 from .containers import configmap_public_host
 from .model import NullDeploymentConfiguration, SubscriptionDetails
 from .server import new_tahoe_configuration, secrets_to_legacy_format
+from .subscription_store import ISubscriptionStore, SEARCH_FIELDS, STORES
 
-from lae_util import validators as my_validators
+from lae_util import opt_metrics_port
 from lae_util.fileutil import make_dirs
-from lae_util.memoryagent import MemoryAgent
+from lae_util.memoryagent import MemoryAgent, EventChannel
 from lae_util.uncooperator import Uncooperator
 from lae_util.eliot_destination import (
     opt_eliot_destination,
@@ -45,12 +55,34 @@ from lae_util.eliot_destination import (
 )
 
 
+CACHE_HITS = Counter(
+    "s4_subscription_cache_hits",
+    "Subscription details retrieved from the subscription manager's cache.",
+)
+CACHE_MISSES = Counter(
+    "s4_subscription_cache_misses",
+    "Subscription details which had to be read from the subscription manager's store.",
+)
+
+# The number of subscriptions for which the subscription manager keeps the
+# decoded details by default.
+DEFAULT_CACHE_SIZE = 10000
+
+# The greatest number of seconds for which a request for changes is held
+# open waiting for one.
+MAXIMUM_CHANGES_TIMEOUT = 300.0
+
+# The number of subscriptions the client asks for in each page of a listing.
+LIST_PAGE_SIZE = 1000
+
+
 class Search(Resource):
     """
     Handle requests relating to searches of the collection of subscriptions.
 
-    GET ?email=... -> list of subscription identifiers with matching email
-                       address
+    GET ?email=...&customer_id=...&stripe_subscription_id=...
+        -> list of identifiers of active subscriptions matching all of the
+           given fields (at least one is required)
     """
     def __init__(self, database):
         Resource.__init__(self)
@@ -61,25 +93,210 @@ class Search(Resource):
         """
         Search for subscriptions matching the request parameters.
         """
-        email = request.args.get("email", [None])[0]
-        if email is None:
+        criteria = {
+            field: request.args[field.encode("ascii")][0].decode("utf-8")
+            for field in SEARCH_FIELDS
+            if field.encode("ascii") in request.args
+        }
+        if not criteria:
             request.setResponseCode(BAD_REQUEST)
-            return
+            return b""
 
-        subscription_ids = self.database.search(email=email.decode("utf-8"))
+        subscription_ids = self.database.search(**criteria)
         return dumps(subscription_ids)
 
 
 
+def _etag(revision):
+    return b'"%d"' % (revision,)
+
+
+
+class Changes(Resource):
+    """
+    Handle requests relating to changes to the collection of subscriptions.
+
+    GET ?since=<revision>&timeout=<seconds>
+        -> the current revision and the details of the subscriptions created
+           or changed and the identifiers of those deactivated since the given
+           revision.  Without a revision (or given one the database has not
+           reached), all active subscriptions are included and ``reset`` is
+           true.  With a timeout, a request which finds no changes waits up to
+           that long for one.
+    """
+    def __init__(self, database, clock):
+        Resource.__init__(self)
+        self.database = database
+        self.clock = clock
+
+
+    def render_GET(self, request):
+        """
+        Get the changes since the revision given by the request.
+        """
+        try:
+            since = request.args.get(b"since")
+            if since is not None:
+                since = int(since[0])
+            timeout = float(request.args.get(b"timeout", [0])[0])
+        except ValueError:
+            request.setResponseCode(BAD_REQUEST)
+            return b""
+        timeout = min(timeout, MAXIMUM_CHANGES_TIMEOUT)
+
+        request.responseHeaders.setRawHeaders(u"content-type", [u"application/json"])
+        if since is None or since != self.database.revision() or timeout <= 0:
+            return self._changes(since)
+
+        # Nothing has changed yet.  Answer when something does or when the
+        # timeout passes, whichever is first.
+        d = self.database.when_changed()
+        d.addTimeout(timeout, self.clock)
+        d.addErrback(lambda reason: reason.trap(TimeoutError))
+        def respond(ignored):
+            request.write(self._changes(since))
+            request.finish()
+        d.addCallback(respond)
+        d.addErrback(lambda reason: reason.trap(CancelledError))
+        # If the client goes away first, stop waiting.
+        request.notifyFinish().addErrback(lambda ignored: d.cancel())
+        return NOT_DONE_YET
+
+
+    def _changes(self, since):
+        with start_action(action_type=u"subscription-database:changes", since=since) as a:
+            revision = self.database.revision()
+            if since is None or since > revision:
+                # The client has nothing to build on (or has come from a
+                # different database).  Send everything.
+                reset = True
+                subscriptions = self.database.list_active_subscriptions()
+                deactivated = []
+            elif since == revision:
+                # The client is up to date.  Don't go looking.
+                reset = False
+                subscriptions = []
+                deactivated = []
+            else:
+                reset = False
+                revision, subscriptions, deactivated = self.database.changes(since)
+            a.add_success_fields(
+                revision=revision,
+                reset=reset,
+                changed=len(subscriptions),
+                deactivated=len(deactivated),
+            )
+            return dumps(dict(
+                revision=revision,
+                reset=reset,
+                subscriptions=list(
+                    marshal_subscription(details)
+                    for details
+                    in subscriptions
+                ),
+                deactivated=deactivated,
+            ))
+
+
+
+@implementer(IPushProducer)
+@attr.s(frozen=True)
+class _TaskProducer(object):
+    """
+    Let a consumer pause and resume a cooperative task which writes to it.
+
+    :ivar task: The ``CooperativeTask``.
+    """
+    task = attr.ib()
+
+    def pauseProducing(self):
+        self.task.pause()
+
+
+    def resumeProducing(self):
+        self.task.resume()
+
+
+    def stopProducing(self):
+        self.task.stop()
+
+
+
+def _write_subscriptions(request, cooperator, database, subscription_ids, **fields):
+    """
+    Write a JSON object holding the details of some subscriptions (as
+    ``subscriptions``) and some other fields to a request and then finish it.
+
+    The subscriptions are loaded and written one at a time by a cooperative
+    task which is paused while the request's transport has a backlog, so the
+    response is never held in memory in full.
+
+    :param cooperator: The ``Cooperator`` with which to run the task.
+
+    :param SubscriptionDatabase database: The database to load the
+        subscriptions from.
+
+    :param list subscription_ids: The identifiers of the subscriptions to
+        write, in order.
+
+    :return: ``NOT_DONE_YET``
+    """
+    def write():
+        request.write(b'{"subscriptions": [')
+        separator = b""
+        for subscription_id in subscription_ids:
+            details = database.get_subscription(subscription_id)
+            request.write(separator + dumps(marshal_subscription(details)))
+            separator = b", "
+            yield
+        request.write(b"]")
+        for name, value in sorted(fields.items()):
+            request.write(b", " + dumps(name) + b": " + dumps(value))
+        request.write(b"}")
+
+    def disconnected(reason):
+        # The channel stops its producer before telling the request the
+        # connection is gone so the task may well be stopped already.
+        try:
+            task.stop()
+        except TaskFinished:
+            pass
+
+    def written(ignored):
+        request.unregisterProducer()
+        request.finish()
+
+    def failed(reason):
+        request.unregisterProducer()
+        if not reason.check(TaskStopped):
+            write_failure(reason)
+            # Don't let a truncated response pass for a complete one.
+            request.loseConnection()
+
+    request.notifyFinish().addErrback(disconnected)
+    task = cooperator.cooperate(write())
+    request.registerProducer(_TaskProducer(task), True)
+    task.whenDone().addCallbacks(written, failed)
+    return NOT_DONE_YET
+
+
+
 class Subscriptions(Resource):
     """
     Handle requests relating to the collection of subscriptions.
 
-    GET / -> list of subscription identifiers
+    GET ?limit=<count>&after=<subscription id>
+        -> the details of active subscriptions, in order of their identifiers
+           (with an ETag which changes when any subscription does).  With
+           ``after``, only subscriptions with identifiers sorting after it are
+           included.  With ``limit``, no more than that many are included and
+           ``next`` is the identifier to give as ``after`` to get the next
+           page (or null if there are no more).
     """
-    def __init__(self, database):
+    def __init__(self, database, cooperator):
         Resource.__init__(self)
         self.database = database
+        self.cooperator = cooperator
 
     def getChild(self, name, request):
         return Subscription(self.database, name)
@@ -99,17 +316,58 @@ class Subscriptions(Resource):
 
     def render_GET(self, request):
         """
-        Get the subscription identifiers of all active subscriptions.
+        Get the details of a page of active subscriptions.
         """
-        with start_action(action_type=u"subscription-database:list-subscriptions"):
-            ids = self.database.list_active_subscription_identifiers()
-            subscriptions = list(
-                marshal_subscription(self.database.get_subscription(sid))
-                for sid
-                in ids
-            )
-            request.responseHeaders.setRawHeaders(u"content-type", [u"application/json"])
-            return dumps(dict(subscriptions=subscriptions))
+        try:
+            limit = request.args.get(b"limit")
+            if limit is not None:
+                limit = int(limit[0])
+                if limit < 1:
+                    raise ValueError(limit)
+            after = request.args.get(b"after")
+            if after is not None:
+                after = after[0].decode("utf-8")
+        except ValueError:
+            request.setResponseCode(BAD_REQUEST)
+            return b""
+
+        a = start_action(
+            action_type=u"subscription-database:list-subscriptions",
+            limit=limit,
+            after=after,
+        )
+        with a:
+            # Get the revision first so that a change made while listing
+            # makes the ETag out of date rather than the response.
+            revision = self.database.revision()
+            etag = _etag(revision)
+            # Request only sends the tag given to setETag if it writes the
+            # response itself.  Make sure it is sent either way.
+            request.responseHeaders.setRawHeaders(b"etag", [etag])
+            if request.setETag(etag) is CACHED:
+                a.add_success_fields(modified=False)
+                return b""
+            if limit is None:
+                subscription_ids = self.database.list_active_subscription_identifiers(
+                    after=after,
+                )
+                next_after = None
+            else:
+                # Ask for one more to find out whether there is another page.
+                subscription_ids = self.database.list_active_subscription_identifiers(
+                    after=after, limit=limit + 1,
+                )
+                if len(subscription_ids) > limit:
+                    subscription_ids = subscription_ids[:limit]
+                    next_after = subscription_ids[-1]
+                else:
+                    next_after = None
+            a.add_success_fields(count=len(subscription_ids), next=next_after)
+        request.responseHeaders.setRawHeaders(u"content-type", [u"application/json"])
+        return _write_subscriptions(
+            request, self.cooperator, self.database, subscription_ids,
+            next=next_after,
+        )
 
 
 def _marshal_oldsecrets(oldsecrets):
@@ -197,39 +455,112 @@ class Subscription(Resource):
         return b""
 
 
-# XXX Just filesystem based for now (easier to get right quickly;
-# dunno what database makes sense yet, etc).  At some point, put a
-# real database here.
+@attr.s
+class _DetailsCache(object):
+    """
+    A bounded cache of decoded subscription details which discards the least
+    recently used entries first.
+
+    Each entry is kept with a stamp from ``ISubscriptionStore.stamp`` (or
+    ``None``) and is only used if it is retrieved with the same stamp.
+
+    :ivar int capacity: The greatest number of entries to keep.
+
+    :ivar OrderedDict _entries: A mapping from subscription identifiers to
+        two-tuples of stamps and ``SubscriptionDetails``, least recently used
+        first.
+    """
+    capacity = attr.ib(validator=validators.instance_of(int))
+    _entries = attr.ib(default=attr.Factory(OrderedDict), repr=False)
+
+    def get(self, subscription_id, stamp):
+        """
+        :return: The cached ``SubscriptionDetails`` for the given subscription
+            or ``None`` if there are none with the given stamp.
+        """
+        entry = self._entries.pop(subscription_id, None)
+        if entry is None or entry[0] != stamp:
+            CACHE_MISSES.inc()
+            return None
+        self._entries[subscription_id] = entry
+        CACHE_HITS.inc()
+        return entry[1]
+
+
+    def put(self, subscription_id, stamp, details):
+        self._entries.pop(subscription_id, None)
+        if self.capacity < 1:
+            return
+        self._entries[subscription_id] = (stamp, details)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+
+    def invalidate(self, subscription_id):
+        self._entries.pop(subscription_id, None)
+
+
+
 @attr.s(frozen=True)
 class SubscriptionDatabase(object):
+    """
+    :ivar _DetailsCache _cache: Details of recently used subscriptions.  Every
+        change made through this database invalidates the changed
+        subscription's entry.
+
+    :ivar bool _validate_cache: ``True`` to check cached details against the
+        store's stamp for the subscription before using them so that changes
+        made to the store by something else are noticed.
+
+    :ivar EventChannel _changed: Fired after every change made through this
+        database.
+    """
     domain = attr.ib(validator=validators.instance_of(unicode))
     bucket_name = attr.ib(
         validator=validators.instance_of(unicode),
     )
 
-    path = attr.ib(validator=my_validators.all(
-        validators.provides(IFilePath),
-        my_validators.after(
-            lambda i, a, v: v.basename(),
-            validators.instance_of(unicode),
-        ),
-    ))
+    store = attr.ib(validator=validators.provides(ISubscriptionStore))
+
+    _cache = attr.ib(
+        default=attr.Factory(lambda: _DetailsCache(DEFAULT_CACHE_SIZE)),
+        validator=validators.instance_of(_DetailsCache),
+        cmp=False,
+    )
+    _validate_cache = attr.ib(default=False, cmp=False)
+    _changed = attr.ib(
+        default=attr.Factory(EventChannel), cmp=False, repr=False,
+    )
 
     @classmethod
-    def from_directory(cls, path, domain, bucket_name):
+    def from_directory(
+        cls, path, domain, bucket_name, storage=u"directory",
+        cache_size=DEFAULT_CACHE_SIZE, validate_cache=False,
+    ):
+        """
+        :param IFilePath path: The subscription state directory.
+
+        :param unicode storage: The name of the kind of store (a key of
+            ``STORES``) in which to keep subscriptions in that directory.
+
+        :param int cache_size: The number of subscriptions for which to keep
+            decoded details.
+
+        :param bool validate_cache: ``True`` to check that cached details are
+            still current before using them.
+        """
         if not path.exists():
             raise ValueError("State directory ({}) does not exist.".format(path.path))
         if not path.isdir():
             raise ValueError("State path ({}) is not a directory.".format(path.path))
         return SubscriptionDatabase(
-            path=path,
+            store=STORES[storage](path),
             domain=domain,
             bucket_name=bucket_name,
+            cache=_DetailsCache(cache_size),
+            validate_cache=validate_cache,
         )
 
-    def _subscription_path(self, subscription_id):
-        return self.path.child(b32encode(subscription_id) + u".json")
-
     def _subscription_state(self, subscription_id, details):
         return dict(
             version=3,
@@ -253,18 +584,6 @@ class SubscriptionDatabase(object):
         )
 
 
-    def _create(self, path, content):
-        with path.create() as subscription_file:
-            # XXX Crash here and we have inconsistent state on disk.
-            # It would be better to write to a temporary file and then
-            # renameat2(..., RENAME_NOREPLACE) but Python doesn't
-            # expose that API.
-            #
-            # At least we can dump the whole config in memory and then
-            # write it in one go.
-            subscription_file.write(content)
-
-
     def _assign_addresses(self):
         with start_action(action_type=u"subscription-database:assign-addresses") as a:
             result = dict(
@@ -275,16 +594,16 @@ class SubscriptionDatabase(object):
             return result
 
 
-    def search(self, email):
+    def search(self, **criteria):
         """
-        Find subscriptions matching certain conditions.
+        Find active subscriptions matching certain conditions.
+
+        :param criteria: Values for one or more of the fields named by
+            ``SEARCH_FIELDS``.
+
+        :return: A ``list`` of the identifiers of the matching subscriptions.
         """
-        results = []
-        for sid in self.list_active_subscription_identifiers():
-            subscription = self.get_subscription(sid)
-            if email == subscription.customer_email:
-                results.append(sid)
-        return results
+        return self.store.search(**criteria)
 
 
     def change_subscription(self, details):
@@ -297,13 +616,13 @@ class SubscriptionDatabase(object):
 
         :return SubscriptionDetails: The new subscription.
         """
-        path = self._subscription_path(details.subscription_id)
-        subscription = loads(path.getContent())
-        active = subscription["details"]["active"]
-        state = self._subscription_state(details.subscription_id, details)
-        subscription["details"] = state
-        subscription["details"]["active"] = active
-        path.setContent(dumps(subscription))
+        def change(subscription):
+            state = self._subscription_state(details.subscription_id, details)
+            state["details"]["active"] = subscription["details"]["active"]
+            return state
+        self._cache.invalidate(details.subscription_id)
+        self.store.update(details.subscription_id, change)
+        self._changed.callback(None)
         return details
 
 
@@ -322,10 +641,11 @@ class SubscriptionDatabase(object):
         )
         with a:
             subscription_id = details.subscription_id
-            path = self._subscription_path(subscription_id)
             details = attr.assoc(details, **self._assign_addresses())
             state = self._subscription_state(subscription_id, details)
-            self._create(path, dumps(state))
+            self._cache.invalidate(subscription_id)
+            self.store.create(subscription_id, state)
+            self._changed.callback(None)
             return details
 
 
@@ -387,18 +707,36 @@ class SubscriptionDatabase(object):
 
 
     def deactivate_subscription(self, subscription_id):
-        path = self._subscription_path(subscription_id)
-        subscription = loads(path.getContent())
-        subscription["details"]["active"] = False
-        path.setContent(dumps(subscription))
+        def deactivate(subscription):
+            subscription["details"]["active"] = False
+            return subscription
+        self._cache.invalidate(subscription_id)
+        self.store.update(subscription_id, deactivate)
+        self._changed.callback(None)
 
     def get_subscription(self, subscription_id):
         with start_action(action_type=u"subscription-database:get-subscription") as a:
-            path = self._subscription_path(subscription_id)
-            state = loads(path.getContent())
-            loader = getattr(self, "_load_{}".format(state["version"]))
+            # Get the stamp first so that a change made after it is never
+            # cached under it.
+            stamp = self._stamp(subscription_id)
+            details = self._cache.get(subscription_id, stamp)
+            if details is not None:
+                a.add_success_fields(cached=True)
+                return details
+            state = self.store.get(subscription_id)
             a.add_success_fields(subscription=state)
-            return loader(state)
+            details = self._load(state)
+            self._cache.put(subscription_id, stamp, details)
+            return details
+
+    def _stamp(self, subscription_id):
+        if self._validate_cache:
+            return self.store.stamp(subscription_id)
+        return None
+
+    def _load(self, state):
+        loader = getattr(self, "_load_{}".format(state["version"]))
+        return loader(state)
 
     def _load_1(self, state):
         details = state["details"]
@@ -440,33 +778,98 @@ class SubscriptionDatabase(object):
         )
 
     def list_all_subscription_identifiers(self):
-        return (
-            b32decode(child.basename()[:-len(u".json")])
-            for child in self.path.children()
+        return self.store.list_identifiers()
+
+    def list_active_subscription_identifiers(self, after=None, limit=None):
+        """
+        :see: ``ISubscriptionStore.list_identifiers``
+        """
+        return self.store.list_identifiers(
+            active_only=True, after=after, limit=limit,
         )
 
-    def list_active_subscription_identifiers(self):
+    def list_active_subscriptions(self):
+        """
+        Get the details of all active subscriptions, reading only those which
+        are not cached.
+
+        :return: A ``list`` of ``SubscriptionDetails``.
+        """
         return list(
-            b32decode(child.basename()[:-len(u".json")])
-            for child in self.path.children()
-            if loads(child.getContent())["details"]["active"]
+            self.get_subscription(subscription_id)
+            for subscription_id
+            in self.store.list_identifiers(active_only=True)
         )
 
+    def revision(self):
+        """
+        :return int: The revision of the most recent change to the database.
+        """
+        return self.store.revision()
+
+    def changes(self, since):
+        """
+        Find the subscriptions changed after a certain revision.
+
+        :param int since: A revision.
+
+        :return: A three-tuple of the current revision, a ``list`` of
+            ``SubscriptionDetails`` of active subscriptions created or changed
+            after ``since`` and a ``list`` of the identifiers of subscriptions
+            deactivated after ``since``.
+        """
+        revision, states = self.store.changes(since)
+        changed = []
+        deactivated = []
+        for subscription_id, state in states:
+            if state["details"]["active"]:
+                changed.append(self._load(state))
+            else:
+                deactivated.append(subscription_id)
+        return revision, changed, deactivated
+
+    def when_changed(self):
+        """
+        :return Deferred: Fires after the next change made through this
+            database.  Changes made to the store by anything else are not
+            noticed.
+        """
+        return self._changed.subscribe()
+
 
 def required(options, key):
     if options[key] is None:
         raise UsageError("--{} is required.".format(key))
 
 
-def make_resource(path, domain, bucket_name):
+def make_resource(
+    path, domain, bucket_name, storage=u"directory",
+    cache_size=DEFAULT_CACHE_SIZE, validate_cache=False, clock=None,
+    cooperator=None,
+):
+    """
+    :param IReactorTime clock: The clock used to time out requests waiting
+        for changes or ``None`` to use the global reactor.
+
+    :param cooperator: The ``Cooperator`` used to write responses a piece at
+        a time or ``None`` to use the global cooperator.
+    """
+    if clock is None:
+        from twisted.internet import reactor as clock
+    if cooperator is None:
+        cooperator = theCooperator
     database = SubscriptionDatabase.from_directory(
         path,
         domain=domain,
         bucket_name=bucket_name,
+        storage=storage,
+        cache_size=cache_size,
+        validate_cache=validate_cache,
     )
     v1 = Resource()
-    v1.putChild("subscriptions", Subscriptions(database))
+    v1.putChild("subscriptions", Subscriptions(database, cooperator))
     v1.putChild("search", Search(database))
+    v1.putChild("changes", Changes(database, clock))
 
     root = Resource()
     root.putChild("v1", v1)
@@ -474,7 +877,15 @@ def make_resource(path, domain, bucket_name):
     return root
 
 
+@opt_metrics_port
 class Options(_Options):
+    optFlags = [
+        ("validate-cache", None,
+         "Check that cached subscription details are current before using "
+         "them (necessary if anything else changes the state directory).",
+        ),
+    ]
+
     optParameters = [
         ("domain", None, None,
          "The domain on which the service is running "
@@ -484,7 +895,16 @@ class Options(_Options):
          "The name of the S3 bucket which holds Tahoe-LAFS shares.",
         ),
         ("state-path", "p", None, "Path to the subscription state directory."),
+        ("storage", None, u"directory",
+         "The kind of store in which to keep subscriptions in the state "
+         "directory (one of {}).".format(", ".join(sorted(STORES))),
+        ),
         ("listen-address", "l", None, "Endpoint on which the server should listen."),
+        ("cache-size", None, DEFAULT_CACHE_SIZE,
+         "The number of subscriptions for which to keep decoded details "
+         "in memory.",
+         int,
+        ),
     ]
 
     opt_eliot_destination = opt_eliot_destination
@@ -494,6 +914,11 @@ class Options(_Options):
         required(self, "listen-address")
         required(self, "bucket-name")
         self["state-path"] = FilePath(self["state-path"].decode("utf-8"))
+        self["storage"] = self["storage"].decode("ascii")
+        if self["storage"] not in STORES:
+            raise UsageError("--storage must be one of {}".format(
+                ", ".join(sorted(STORES)),
+            ))
         # Populated from a configuration file which can easily contain extra
         # trailing whitespace (like a newline).  Clean it up.
         self["domain"] = self["domain"].strip()
@@ -514,11 +939,17 @@ def makeService(options):
         options.get("destinations", []),
     ).setServiceParent(parent)
 
+    options.get_metrics_service(reactor).setServiceParent(parent)
+
     make_dirs(options["state-path"].path)
     site = Site(make_resource(
         options["state-path"],
         options["domain"].decode("ascii"),
         options["bucket-name"].decode("ascii"),
+        options["storage"],
+        options["cache-size"],
+        bool(options["validate-cache"]),
+        reactor,
     ))
 
     StreamServerEndpointService(
@@ -534,6 +965,47 @@ def decode_subscription(fields):
     return SubscriptionDetails(**fields)
 
 
+
+@attr.s(frozen=True)
+class SubscriptionList(object):
+    """
+    The active subscriptions as listed by ``Client.list_if_changed``.
+
+    :ivar bytes etag: The entity tag of the listing.
+
+    :ivar subscriptions: A ``list`` of ``SubscriptionDetails`` or ``None`` if
+        the listing has not changed since the entity tag given with the
+        request.
+    """
+    etag = attr.ib()
+    subscriptions = attr.ib()
+
+
+
+@attr.s(frozen=True)
+class SubscriptionChanges(object):
+    """
+    Changes to the subscriptions as retrieved by ``Client.changes``.
+
+    :ivar int revision: The revision the changes bring the subscriptions up
+        to.  Give this as ``since`` to get the next changes.
+
+    :ivar bool reset: ``True`` if ``subscriptions`` are all of the active
+        subscriptions and any others known from earlier changes should be
+        forgotten.
+
+    :ivar list subscriptions: ``SubscriptionDetails`` of active subscriptions
+        created or changed.
+
+    :ivar list deactivated: The ``unicode`` identifiers of subscriptions
+        deactivated.
+    """
+    revision = attr.ib(validator=validators.instance_of((int, long)))
+    reset = attr.ib(validator=validators.instance_of(bool))
+    subscriptions = attr.ib()
+    deactivated = attr.ib()
+
+
 @attr.s
 class Client(object):
     endpoint = attr.ib(validator=validators.instance_of(bytes))
@@ -552,18 +1024,24 @@ class Client(object):
         return url.asURI().asText().encode("ascii")
 
 
-    def search(self, email):
+    def search(self, **criteria):
         """
-        Find a subscription based on some parameters.
+        Find active subscriptions based on some parameters.
 
         :param unicode email: The customer email address of the subscriptions
             to find.
 
+        :param unicode customer_id: The customer identifier of the
+            subscriptions to find.
+
+        :param unicode stripe_subscription_id: The Stripe subscription
+            identifier of the subscriptions to find.
+
         :return: A ``Deferred`` that fires with the identifiers of
-            subscriptions matching the given parameters.
+            subscriptions matching all of the given parameters.
         """
         d = self.agent.request(
-            b"GET", self._url(u"v1", u"search", email=email),
+            b"GET", self._url(u"v1", u"search", **criteria),
         )
         d.addCallback(require_code(OK))
         d.addCallback(readBody)
@@ -661,24 +1139,138 @@ class Client(object):
         return d
 
 
-    def list(self):
+    def _request_page(self, after, page_size, headers=None):
+        query = {u"limit": u"%d" % (page_size,)}
+        if after is not None:
+            query[u"after"] = after
+        return self.agent.request(
+            b"GET", self._url(u"v1", u"subscriptions", **query), headers,
+        )
+
+
+    def _read_pages(self, response, page_size, subscriptions):
+        """
+        Read a page of subscriptions from a response and then request and read
+        each of the pages after it, one at a time.
+
+        :param list subscriptions: The subscriptions read from earlier pages.
+            Those read from the response and later pages are added.
+
+        :return: A ``Deferred`` that fires with ``subscriptions``.
+        """
+        require_code(OK)(response)
+        d = readBody(response)
+        def got_body(body):
+            page = loads(body)
+            subscriptions.extend(map(decode_subscription, page["subscriptions"]))
+            if page["next"] is None:
+                return subscriptions
+            d = self._request_page(page["next"], page_size)
+            d.addCallback(self._read_pages, page_size, subscriptions)
+            return d
+        d.addCallback(got_body)
+        return d
+
+
+    def list(self, page_size=LIST_PAGE_SIZE):
         """
         Get all existing active subscriptions.
+
+        :param int page_size: The number of subscriptions to request at a
+            time.  Each page is requested after the one before it is read.
         """
         a = start_action(action_type=u"subscription-client:list")
+        with a.context():
+            d = DeferredContext(self._request_page(None, page_size))
+            d.addCallback(self._read_pages, page_size, [])
+            def got_subscriptions(subscriptions):
+                a.add_success_fields(subscription_ids=list(
+                    s.subscription_id for s in subscriptions
+                ))
+                return subscriptions
+            d.addCallback(got_subscriptions)
+            return d.addActionFinish()
+
+    def list_if_changed(self, etag=None, page_size=LIST_PAGE_SIZE):
+        """
+        Get all existing active subscriptions unless they have not changed.
+
+        :param bytes etag: The ``etag`` of a previous ``SubscriptionList`` or
+            ``None`` to get the subscriptions regardless.
+
+        :param int page_size: The number of subscriptions to request at a
+            time.
+
+        :return: A ``Deferred`` that fires with a ``SubscriptionList``.
+        """
+        headers = Headers()
+        if etag is not None:
+            headers.setRawHeaders(b"if-none-match", [etag])
+        a = start_action(action_type=u"subscription-client:list-if-changed")
+        with a.context():
+            d = DeferredContext(self._request_page(None, page_size, headers))
+            def got_response(response):
+                # The tag of the first page covers every page.  If anything
+                # changes while the later pages are read, the tag is out of
+                # date and the next listing reads everything again.
+                new_etag = response.headers.getRawHeaders(b"etag", [None])[0]
+                if response.code == NOT_MODIFIED:
+                    a.add_success_fields(modified=False)
+                    return SubscriptionList(etag=new_etag, subscriptions=None)
+                d = self._read_pages(response, page_size, [])
+                d.addCallback(lambda subscriptions: SubscriptionList(
+                    etag=new_etag,
+                    subscriptions=subscriptions,
+                ))
+                return d
+            d.addCallback(got_response)
+            return d.addActionFinish()
+
+    def changes(self, since=None, timeout=None):
+        """
+        Get the changes made to subscriptions since a certain revision.
+
+        :param int since: The ``revision`` of a previous
+            ``SubscriptionChanges`` or ``None`` to get all active
+            subscriptions.
+
+        :param float timeout: If there are no changes yet, the number of
+            seconds to wait for some before giving up or ``None`` not to wait.
+
+        :return: A ``Deferred`` that fires with a ``SubscriptionChanges``.
+        """
+        query = {}
+        if since is not None:
+            query[u"since"] = u"%d" % (since,)
+        if timeout is not None:
+            query[u"timeout"] = u"%f" % (timeout,)
+        a = start_action(
+            action_type=u"subscription-client:changes",
+            since=since,
+        )
         with a.context():
             d = DeferredContext(self.agent.request(
-                b"GET", self._url(u"v1", u"subscriptions"),
+                b"GET", self._url(u"v1", u"changes", **query),
             ))
             d.addCallback(require_code(OK))
             d.addCallback(readBody)
             def got_body(body):
-                encoded_subscriptions = loads(body)["subscriptions"]
-                subscriptions = map(decode_subscription, encoded_subscriptions)
-                a.add_success_fields(subscription_ids=list(
-                    s.subscription_id for s in subscriptions
-                ))
-                return subscriptions
+                changes = loads(body)
+                result = SubscriptionChanges(
+                    revision=changes["revision"],
+                    reset=changes["reset"],
+                    subscriptions=map(decode_subscription, changes["subscriptions"]),
+                    deactivated=changes["deactivated"],
+                )
+                a.add_success_fields(
+                    revision=result.revision,
+                    reset=result.reset,
+                    subscription_ids=list(
+                        s.subscription_id for s in result.subscriptions
+                    ),
+                    deactivated=result.deactivated,
+                )
+                return result
             d.addCallback(got_body)
             return d.addActionFinish()
 
@@ -724,14 +1316,18 @@ def network_client(endpoint, agent, cooperator=None):
     return Client(endpoint=endpoint, agent=agent, cooperator=cooperator)
 
 
-def memory_client(database_path, domain):
+def memory_client(database_path, domain, storage=u"directory", clock=None):
     """
     Create a subscription manager client which uses in-memory
     interactions with the database at the given path.
     """
-    root = make_resource(database_path, domain, u"s4")
+    cooperator = Uncooperator()
+    root = make_resource(
+        database_path, domain, u"s4", storage,
+        clock=clock, cooperator=cooperator,
+    )
     agent = MemoryAgent(root)
-    return Client(endpoint=b"/", agent=agent, cooperator=Uncooperator())
+    return Client(endpoint=b"/", agent=agent, cooperator=cooperator)
 
 
 def broken_client():
@@ -0,0 +1,845 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+This module implements persistence of the subscription manager's
+subscription states.
+
+A subscription state is the versioned, JSON-compatible ``dict`` which
+``SubscriptionDatabase`` serializes ``SubscriptionDetails`` to.  Stores don't
+interpret it beyond the few ``details`` fields they index: ``active`` and
+those named by ``SEARCH_FIELDS``.
+"""
+
+from json import loads, dumps
+from base64 import b32encode, b32decode
+from contextlib import contextmanager
+from collections import defaultdict
+from bisect import bisect_right
+from sqlite3 import connect
+
+import attr
+from attr import validators
+
+from zope.interface import Interface, implementer
+
+from eliot import start_action
+
+from twisted.python.filepath import IFilePath
+
+from lae_util import validators as my_validators
+
+
+# The name of the SQLite database file in the subscription state directory.
+SQLITE_DATABASE = u"subscriptions.sqlite3"
+
+_JSON_SUFFIX = u".json"
+
+# The name of the file in which ``DirectoryStore`` keeps its revision.
+_REVISION_FILE = u"revision"
+
+# The key under which ``DirectoryStore`` saves the revision of each state
+# alongside it.
+_REVISION_KEY = u"revision"
+
+# The fields by which active subscriptions can be found, as functions which
+# take the details of a subscription state and return the value of the field.
+SEARCH_FIELDS = {
+    u"email": lambda details: details["email"],
+    u"customer_id": lambda details: details["customer_id"],
+    # States from before version 3 have no separate Stripe subscription
+    # identifier.  It is the same as the subscription identifier (see
+    # ``SubscriptionDatabase._load_1``).
+    u"stripe_subscription_id": lambda details: details.get(
+        "stripe_subscription_id", details["subscription_id"],
+    ),
+}
+
+_SEARCH_COLUMNS = sorted(SEARCH_FIELDS)
+
+_SCHEMA = [
+    u"""
+    CREATE TABLE IF NOT EXISTS [subscriptions] (
+        [id] TEXT PRIMARY KEY,
+        [active] INTEGER NOT NULL,
+        [state] TEXT NOT NULL
+    )
+    """,
+    u"""
+    CREATE INDEX IF NOT EXISTS [subscriptions_active]
+    ON [subscriptions] ([active])
+    """,
+]
+
+# Columns which were added to the subscriptions table after it was first
+# created, with their definitions.  Each of ``SEARCH_FIELDS`` gets one too.
+_ADDED_COLUMNS = [
+    (u"revision", u"INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+
+def _search_values(state):
+    """
+    :return: A ``dict`` mapping the names in ``SEARCH_FIELDS`` to their values
+        for the given subscription state.
+    """
+    details = state["details"]
+    return {
+        field: value(details)
+        for (field, value) in SEARCH_FIELDS.items()
+    }
+
+
+
+def _check_criteria(criteria):
+    if not criteria:
+        raise ValueError("At least one search criterion is required.")
+    unknown = set(criteria) - set(SEARCH_FIELDS)
+    if unknown:
+        raise ValueError("Cannot search by {}.".format(", ".join(sorted(unknown))))
+
+
+
+class ISubscriptionStore(Interface):
+    """
+    A persistent collection of subscription states keyed by subscription
+    identifier.
+    """
+    def create(subscription_id, state):
+        """
+        Add a new subscription.
+
+        :param unicode subscription_id: The identifier of the new
+            subscription.  There must not already be a subscription with this
+            identifier.
+
+        :param dict state: The state of the new subscription.
+        """
+
+
+    def import_states(states):
+        """
+        Add many new subscriptions at once.
+
+        :param states: An iterable of two-tuples of subscription identifiers
+            and states, as accepted by ``create``.
+        """
+
+
+    def get(subscription_id):
+        """
+        :param unicode subscription_id: The identifier of an existing
+            subscription.
+
+        :return dict: The state of the subscription.
+        """
+
+
+    def update(subscription_id, f):
+        """
+        Replace the state of an existing subscription.
+
+        :param unicode subscription_id: The identifier of the subscription.
+
+        :param f: A one-argument callable which takes the current state of the
+            subscription and returns its new state.  No other change to the
+            subscription is made between reading its current state and writing
+            its new state.
+
+        :return dict: The new state of the subscription.
+        """
+
+
+    def stamp(subscription_id):
+        """
+        Get a cheap indicator of whether a subscription has changed.
+
+        :param unicode subscription_id: The identifier of an existing
+            subscription.
+
+        :return: A value which is different after any change to the
+            subscription, including changes made by other processes.  Or
+            ``None`` if the store cannot tell.
+        """
+
+
+    def list_identifiers(active_only=False, after=None, limit=None):
+        """
+        :param bool active_only: ``True`` to include only active subscriptions.
+
+        :param unicode after: A subscription identifier to include only the
+            identifiers which sort after it or ``None`` to start from the
+            first.
+
+        :param int limit: The greatest number of identifiers to include or
+            ``None`` to include them all.
+
+        :return: A ``list`` of ``unicode`` subscription identifiers, in
+            order.
+        """
+
+
+    def list_states(active_only=False):
+        """
+        :param bool active_only: ``True`` to include only active subscriptions.
+
+        :return: A ``list`` of subscription states.
+        """
+
+
+    def revision():
+        """
+        Each write to the store is given a revision number greater than that
+        of every write before it.
+
+        :return int: The revision of the most recent write or ``0`` if there
+            have been none.
+        """
+
+
+    def changes(since):
+        """
+        Find the subscriptions written after a certain revision.
+
+        :param int since: A revision.
+
+        :return: A two-tuple of the current revision (as returned by
+            ``revision``) and a ``list`` of two-tuples of the identifiers and
+            states of the subscriptions (active or not) last written after
+            ``since``.
+        """
+
+
+    def search(**criteria):
+        """
+        :param criteria: Values for one or more of the fields named by
+            ``SEARCH_FIELDS``.
+
+        :raise ValueError: If no criteria or unknown criteria are given.
+
+        :return: A ``list`` of the ``unicode`` identifiers of active
+            subscriptions matching all of the criteria, in order.
+        """
+
+
+
+@attr.s
+class _Index(object):
+    """
+    An in-memory index of active subscriptions by the fields named by
+    ``SEARCH_FIELDS``.
+
+    :ivar dict _by_field: A mapping from field names to mappings from field
+        values to ``set``\ s of identifiers of active subscriptions with those
+        values.
+
+    :ivar dict _values: A mapping from the identifier of each indexed
+        subscription to the field values it is indexed under.
+    """
+    _by_field = attr.ib(default=attr.Factory(lambda: {
+        field: defaultdict(set) for field in SEARCH_FIELDS
+    }))
+    _values = attr.ib(default=attr.Factory(dict))
+
+    def add(self, subscription_id, state):
+        """
+        Index (or re-index) a subscription, dropping it if it is not active.
+        """
+        self.remove(subscription_id)
+        if state["details"]["active"]:
+            values = _search_values(state)
+            for field, value in values.items():
+                self._by_field[field][value].add(subscription_id)
+            self._values[subscription_id] = values
+
+
+    def reset(self):
+        for ids in self._by_field.values():
+            ids.clear()
+        self._values.clear()
+
+
+    def identifiers(self):
+        """
+        :return: A ``list`` of the identifiers of the indexed subscriptions,
+            in order.
+        """
+        return sorted(self._values)
+
+
+    def remove(self, subscription_id):
+        values = self._values.pop(subscription_id, {})
+        for field, value in values.items():
+            ids = self._by_field[field][value]
+            ids.discard(subscription_id)
+            if not ids:
+                del self._by_field[field][value]
+
+
+    def search(self, criteria):
+        matches = (
+            self._by_field[field].get(value, set())
+            for (field, value) in criteria.items()
+        )
+        return sorted(set.intersection(*matches))
+
+
+
+@attr.s
+class _RevisionIndex(object):
+    """
+    An in-memory index of subscriptions by the revision of the most recent
+    write to each.
+
+    :ivar revision: The revision of the most recent write the index reflects
+        or ``None`` if it has not been built.
+
+    :ivar dict _revisions: A mapping from the identifier of each indexed
+        subscription to its revision.
+
+    :ivar dict _by_revision: A mapping from revisions to ``set``\ s of
+        identifiers of subscriptions last written with that revision.
+    """
+    revision = attr.ib(default=None)
+    _revisions = attr.ib(default=attr.Factory(dict))
+    _by_revision = attr.ib(default=attr.Factory(lambda: defaultdict(set)))
+
+    def reset(self):
+        self.revision = None
+        self._revisions.clear()
+        self._by_revision.clear()
+
+
+    def add(self, subscription_id, revision):
+        """
+        Index (or re-index) a subscription at a new revision.
+        """
+        previous = self._revisions.get(subscription_id)
+        if previous is not None:
+            ids = self._by_revision[previous]
+            ids.discard(subscription_id)
+            if not ids:
+                del self._by_revision[previous]
+        self._revisions[subscription_id] = revision
+        self._by_revision[revision].add(subscription_id)
+
+
+    def since(self, since):
+        """
+        :return: A ``list`` of the identifiers of the subscriptions last
+            written after the given revision, in order.
+        """
+        first = max(since + 1, 0)
+        if self.revision - first < len(self._revisions):
+            # Fewer revisions to visit than subscriptions.
+            ids = set()
+            for revision in range(first, self.revision + 1):
+                ids.update(self._by_revision.get(revision, ()))
+        else:
+            ids = set(
+                subscription_id
+                for (subscription_id, revision) in self._revisions.items()
+                if revision > since
+            )
+        return sorted(ids)
+
+
+
+def _page(identifiers, after, limit):
+    """
+    :param list identifiers: Subscription identifiers, in order.
+
+    :see: ``ISubscriptionStore.list_identifiers``
+    """
+    if after is not None:
+        identifiers = identifiers[bisect_right(identifiers, after):]
+    if limit is not None:
+        identifiers = identifiers[:limit]
+    return identifiers
+
+
+
+def _with_revision(state, revision):
+    state = state.copy()
+    state[_REVISION_KEY] = revision
+    return state
+
+
+
+@implementer(ISubscriptionStore)
+@attr.s(frozen=True)
+class DirectoryStore(object):
+    """
+    Store each subscription state as JSON in a file named for the base32
+    encoding of its identifier.  The revision of the write which produced the
+    state is saved in the file with it and the revision of the most recent
+    write is saved in a file of its own.  States in files from before
+    revisions were introduced have revision ``0``.
+
+    :ivar IFilePath path: The directory containing the files.
+
+    :ivar _Index _index: An index of the active subscriptions in the
+        directory, built by the first search or listing of active
+        subscriptions and kept up to date by later writes.  It is built again
+        if the directory's revision shows it has been written to by anything
+        else.
+
+    :ivar list _loaded: Empty until ``_index`` has been built.  Then, the
+        revision of the most recent write it reflects.
+
+    :ivar _RevisionIndex _revisions: An index of the subscriptions in the
+        directory by revision, built by the first look for changes and kept
+        up to date by later writes.  It is built again if the directory's
+        revision shows it has been written to by anything else.
+    """
+    path = attr.ib(validator=my_validators.all(
+        validators.provides(IFilePath),
+        my_validators.after(
+            lambda i, a, v: v.basename(),
+            validators.instance_of(unicode),
+        ),
+    ))
+    _index = attr.ib(default=attr.Factory(_Index), cmp=False, repr=False)
+    _loaded = attr.ib(default=attr.Factory(list), cmp=False, repr=False)
+    _revisions = attr.ib(
+        default=attr.Factory(_RevisionIndex), cmp=False, repr=False,
+    )
+
+    def _subscription_path(self, subscription_id):
+        return self.path.child(b32encode(subscription_id) + _JSON_SUFFIX)
+
+
+    def _read(self, path):
+        """
+        :return: A two-tuple of the revision and state in the given file.
+        """
+        state = loads(path.getContent())
+        return state.pop(_REVISION_KEY, 0), state
+
+
+    def _items(self, active_only):
+        """
+        Load every subscription state.
+
+        :return: A generator of three-tuples of subscription identifiers,
+            revisions and states.
+        """
+        for child in self.path.children():
+            name = child.basename()
+            if not name.endswith(_JSON_SUFFIX):
+                continue
+            revision, state = self._read(child)
+            if not active_only or state["details"]["active"]:
+                yield b32decode(name[:-len(_JSON_SUFFIX)]), revision, state
+
+
+    def _written(self, subscription_id, revision, state):
+        # The state is written before the revision so anything which has
+        # seen the revision can see the state.
+        self.path.child(_REVISION_FILE).setContent(b"%d" % (revision,))
+        if self._loaded == [revision - 1]:
+            self._index.add(subscription_id, state)
+            self._loaded[:] = [revision]
+        else:
+            del self._loaded[:]
+        if self._revisions.revision == revision - 1:
+            self._revisions.add(subscription_id, revision)
+            self._revisions.revision = revision
+        else:
+            # Something else wrote in between.  Find out what next time.
+            self._revisions.reset()
+
+
+    def create(self, subscription_id, state):
+        revision = self.revision() + 1
+        with self._subscription_path(subscription_id).create() as subscription_file:
+            # XXX Crash here and we have inconsistent state on disk.
+            # It would be better to write to a temporary file and then
+            # renameat2(..., RENAME_NOREPLACE) but Python doesn't
+            # expose that API.
+            #
+            # At least we can dump the whole config in memory and then
+            # write it in one go.
+            subscription_file.write(dumps(_with_revision(state, revision)))
+        self._written(subscription_id, revision, state)
+
+
+    def import_states(self, states):
+        for subscription_id, state in states:
+            self.create(subscription_id, state)
+
+
+    def _load_index(self):
+        current = self.revision()
+        if self._loaded != [current]:
+            self._index.reset()
+            for subscription_id, revision, state in self._items(active_only=True):
+                self._index.add(subscription_id, state)
+            self._loaded[:] = [current]
+        return self._index
+
+
+    def get(self, subscription_id):
+        revision, state = self._read(self._subscription_path(subscription_id))
+        return state
+
+
+    def stamp(self, subscription_id):
+        path = self._subscription_path(subscription_id)
+        return path.getModificationTime(), path.getsize()
+
+
+    def update(self, subscription_id, f):
+        path = self._subscription_path(subscription_id)
+        revision, state = self._read(path)
+        state = f(state)
+        revision = self.revision() + 1
+        path.setContent(dumps(_with_revision(state, revision)))
+        self._written(subscription_id, revision, state)
+        return state
+
+
+    def list_identifiers(self, active_only=False, after=None, limit=None):
+        if not active_only:
+            # No need to look inside the files.
+            identifiers = list(
+                b32decode(child.basename()[:-len(_JSON_SUFFIX)])
+                for child in self.path.children()
+                if child.basename().endswith(_JSON_SUFFIX)
+            )
+            identifiers.sort()
+        else:
+            # Paging through the listing would otherwise read every file for
+            # every page.
+            identifiers = self._load_index().identifiers()
+        return _page(identifiers, after, limit)
+
+
+    def list_states(self, active_only=False):
+        return list(
+            state
+            for (subscription_id, revision, state) in self._items(active_only)
+        )
+
+
+    def revision(self):
+        path = self.path.child(_REVISION_FILE)
+        if not path.exists():
+            return 0
+        return int(path.getContent())
+
+
+    def _load_revisions(self, current):
+        if self._revisions.revision != current:
+            self._revisions.reset()
+            for subscription_id, revision, state in self._items(active_only=False):
+                self._revisions.add(subscription_id, revision)
+            self._revisions.revision = current
+        return self._revisions
+
+
+    def changes(self, since):
+        # Read the revision first.  Anything written after this shows up
+        # again next time.
+        current = self.revision()
+        return current, list(
+            (subscription_id, self.get(subscription_id))
+            for subscription_id in self._load_revisions(current).since(since)
+        )
+
+
+    def search(self, **criteria):
+        _check_criteria(criteria)
+        return self._load_index().search(criteria)
+
+
+
+def _row(subscription_id, revision, state):
+    values = _search_values(state)
+    return (
+        subscription_id,
+        bool(state["details"]["active"]),
+        revision,
+        dumps(state).decode("ascii"),
+    ) + tuple(values[column] for column in _SEARCH_COLUMNS)
+
+
+
+# The columns of the values returned by ``_row``.
+_ROW_COLUMNS = list(
+    u"[{}]".format(column)
+    for column in [u"id", u"active", u"revision", u"state"] + _SEARCH_COLUMNS
+)
+
+
+
+@implementer(ISubscriptionStore)
+@attr.s(frozen=True)
+class SQLiteStore(object):
+    """
+    Store subscription states in an SQLite database with the fields used to
+    find subscriptions (and the revision of the write which produced each
+    state) in indexed columns of their own.
+
+    :ivar IFilePath path: The database file.
+
+    :ivar _connection: The ``sqlite3.Connection`` to the database, in
+        autocommit mode so that each write can choose its own transaction.
+    """
+    path = attr.ib(validator=validators.provides(IFilePath))
+    _connection = attr.ib()
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Open (creating if necessary) an SQLite subscription database.
+
+        :param IFilePath path: The database file.
+
+        :return SQLiteStore: A store backed by the database.
+        """
+        connection = connect(path.path, isolation_level=None)
+        store = cls(path=path, connection=connection)
+        with store._transaction() as cursor:
+            for statement in _SCHEMA:
+                cursor.execute(statement)
+            store._add_columns(cursor)
+        return store
+
+
+    def _add_columns(self, cursor):
+        """
+        Make sure there is an indexed column for each of ``_ADDED_COLUMNS`` and
+        ``SEARCH_FIELDS``, populating any new search columns from the existing
+        subscription states.
+        """
+        existing = set(
+            row[1]
+            for row in cursor.execute(u"PRAGMA table_info([subscriptions])")
+        )
+        for (column, definition) in _ADDED_COLUMNS:
+            if column not in existing:
+                cursor.execute(
+                    u"ALTER TABLE [subscriptions] ADD COLUMN [{}] {}".format(
+                        column, definition,
+                    ),
+                )
+            cursor.execute(
+                u"CREATE INDEX IF NOT EXISTS [subscriptions_{column}] "
+                u"ON [subscriptions] ([{column}])".format(column=column),
+            )
+        missing = list(
+            column for column in _SEARCH_COLUMNS if column not in existing
+        )
+        for column in missing:
+            cursor.execute(
+                u"ALTER TABLE [subscriptions] ADD COLUMN [{}] TEXT".format(column),
+            )
+        if missing:
+            rows = cursor.execute(
+                u"SELECT [id], [state] FROM [subscriptions]",
+            ).fetchall()
+            for (subscription_id, state) in rows:
+                values = _search_values(loads(state))
+                cursor.execute(
+                    u"UPDATE [subscriptions] SET {} WHERE [id] = ?".format(
+                        u", ".join(u"[{}] = ?".format(column) for column in missing),
+                    ),
+                    tuple(values[column] for column in missing) + (subscription_id,),
+                )
+        for column in _SEARCH_COLUMNS:
+            cursor.execute(
+                u"CREATE INDEX IF NOT EXISTS [subscriptions_{column}] "
+                u"ON [subscriptions] ([{column}], [active])".format(column=column),
+            )
+
+
+    @contextmanager
+    def _transaction(self, mode=u"IMMEDIATE"):
+        cursor = self._connection.cursor()
+        # By default, take the write lock up front so that read-modify-write
+        # sequences can't interleave with another writer.
+        cursor.execute(u"BEGIN {}".format(mode))
+        try:
+            yield cursor
+        except:
+            cursor.execute(u"ROLLBACK")
+            raise
+        else:
+            cursor.execute(u"COMMIT")
+
+
+    def _revision(self, cursor):
+        cursor.execute(
+            u"SELECT COALESCE(MAX([revision]), 0) FROM [subscriptions]",
+        )
+        return cursor.fetchone()[0]
+
+
+    def _insert(self, cursor, subscription_id, revision, state):
+        row = _row(subscription_id, revision, state)
+        cursor.execute(
+            u"INSERT INTO [subscriptions] ({}) VALUES ({})".format(
+                u", ".join(_ROW_COLUMNS), u", ".join(u"?" * len(row)),
+            ),
+            row,
+        )
+
+
+    def _get(self, cursor, subscription_id):
+        cursor.execute(
+            u"SELECT [state] FROM [subscriptions] WHERE [id] = ?",
+            (subscription_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(subscription_id)
+        return loads(row[0])
+
+
+    def create(self, subscription_id, state):
+        with self._transaction() as cursor:
+            self._insert(cursor, subscription_id, self._revision(cursor) + 1, state)
+
+
+    def import_states(self, states):
+        with self._transaction() as cursor:
+            revision = self._revision(cursor)
+            for subscription_id, state in states:
+                revision += 1
+                self._insert(cursor, subscription_id, revision, state)
+
+
+    def get(self, subscription_id):
+        return self._get(self._connection.cursor(), subscription_id)
+
+
+    def stamp(self, subscription_id):
+        # This changes whenever another connection changes the database.  It
+        # doesn't say which subscription changed so every subscription gets
+        # the same stamp.  It doesn't change for writes made with this
+        # connection but those are made by this process which knows about
+        # them already.
+        return self._connection.execute(u"PRAGMA data_version").fetchone()[0]
+
+
+    def update(self, subscription_id, f):
+        with self._transaction() as cursor:
+            state = f(self._get(cursor, subscription_id))
+            revision = self._revision(cursor) + 1
+            cursor.execute(
+                u"UPDATE [subscriptions] SET {} WHERE [id] = ?".format(
+                    u", ".join(u"{} = ?".format(column) for column in _ROW_COLUMNS),
+                ),
+                _row(subscription_id, revision, state) + (subscription_id,),
+            )
+            return state
+
+
+    def _select(self, column, active_only, after=None, limit=None):
+        conditions = []
+        parameters = ()
+        if active_only:
+            conditions.append(u"[active]")
+        if after is not None:
+            conditions.append(u"[id] > ?")
+            parameters += (after,)
+        query = u"SELECT [{}] FROM [subscriptions]".format(column)
+        if conditions:
+            query += u" WHERE " + u" AND ".join(conditions)
+        query += u" ORDER BY [id]"
+        if limit is not None:
+            query += u" LIMIT ?"
+            parameters += (limit,)
+        return self._connection.execute(query, parameters)
+
+
+    def list_identifiers(self, active_only=False, after=None, limit=None):
+        return list(
+            subscription_id
+            for (subscription_id,)
+            in self._select(u"id", active_only, after, limit)
+        )
+
+
+    def list_states(self, active_only=False):
+        return list(
+            loads(state)
+            for (state,) in self._select(u"state", active_only)
+        )
+
+
+    def revision(self):
+        return self._revision(self._connection.cursor())
+
+
+    def changes(self, since):
+        # Read the revision and the changes in one transaction so that they
+        # agree.
+        with self._transaction(u"DEFERRED") as cursor:
+            revision = self._revision(cursor)
+            cursor.execute(
+                u"SELECT [id], [state] FROM [subscriptions] "
+                u"WHERE [revision] > ? ORDER BY [revision]",
+                (since,),
+            )
+            return revision, list(
+                (subscription_id, loads(state))
+                for (subscription_id, state) in cursor.fetchall()
+            )
+
+
+    def search(self, **criteria):
+        _check_criteria(criteria)
+        fields = sorted(criteria)
+        return list(
+            subscription_id
+            for (subscription_id,) in self._connection.execute(
+                u"SELECT [id] FROM [subscriptions] WHERE {} AND [active] "
+                u"ORDER BY [id]".format(
+                    u" AND ".join(u"[{}] = ?".format(field) for field in fields),
+                ),
+                tuple(criteria[field] for field in fields),
+            )
+        )
+
+
+
+# The kinds of store the subscription manager can use, by name, as functions
+# which take the subscription state directory and return a store.
+STORES = {
+    u"directory": DirectoryStore,
+    u"sqlite": lambda path: SQLiteStore.from_path(path.child(SQLITE_DATABASE)),
+}
+
+
+
+def migrate(source, destination):
+    """
+    Copy every subscription from one store to another.
+
+    Subscription states are copied as they are (whatever their version) so
+    nothing is lost and the source store remains usable.
+
+    :param ISubscriptionStore source: The store to copy from.
+
+    :param ISubscriptionStore destination: The store to copy to.  It must not
+        have any subscriptions yet.
+
+    :raise ValueError: If ``destination`` already has subscriptions.
+
+    :return int: The number of subscriptions copied.
+    """
+    with start_action(action_type=u"subscription-store:migrate") as a:
+        if destination.list_identifiers():
+            raise ValueError(
+                "The destination store already has subscriptions.",
+            )
+        identifiers = source.list_identifiers()
+        destination.import_states(
+            (subscription_id, source.get(subscription_id))
+            for subscription_id in identifiers
+        )
+        a.add_success_fields(count=len(identifiers))
+        return len(identifiers)
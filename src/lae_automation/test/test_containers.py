@@ -9,7 +9,10 @@ from __future__ import unicode_literals
 
 from json import loads
 
+import attr
+
 from hypothesis import given
+from hypothesis.strategies import data
 
 from foolscap.furl import decode_furl
 
@@ -19,11 +22,16 @@ from txkube import v1_5_model as model
 
 from lae_util.testtools import TestCase
 
-from .strategies import deployment_configurations, subscription_details
+from .strategies import (
+    deployment_configurations, subscription_details, subscription_id,
+)
 
 from ..containers import (
     create_configuration,
     create_deployment,
+    spec_hash,
+    configuration_spec_hash,
+    deployment_spec_hash,
 )
 
 
@@ -72,3 +80,66 @@ class CreateDeploymentTests(TestCase):
         )
         for container in deployment.spec.template.spec.containers:
             self.assertThat((None, u""), Not(Contains(container.image)))
+
+
+
+class SpecHashTests(TestCase):
+    """
+    Tests for ``configuration_spec_hash``, ``deployment_spec_hash``, and
+    ``spec_hash``.
+    """
+    @given(deployment_configurations(), subscription_details())
+    def test_stamped(self, deploy_config, details):
+        """
+        Created ConfigMaps and Deployments are annotated with the spec hash of
+        the inputs they were created from.
+        """
+        self.expectThat(
+            spec_hash(create_configuration(deploy_config, details, model)),
+            Equals(configuration_spec_hash(deploy_config, details)),
+        )
+        self.expectThat(
+            spec_hash(create_deployment(deploy_config, details, model)),
+            Equals(deployment_spec_hash(deploy_config, details)),
+        )
+
+
+    @given(deployment_configurations(), subscription_details())
+    def test_image_changes_deployment(self, deploy_config, details):
+        """
+        The Deployment spec hash changes if one of the images changes.
+        """
+        changed = attr.assoc(deploy_config, introducer_image=u"tahoe-introducer:other")
+        self.assertThat(
+            deployment_spec_hash(changed, details),
+            Not(Equals(deployment_spec_hash(deploy_config, details))),
+        )
+
+
+    @given(deployment_configurations(), subscription_details(), data())
+    def test_irrelevant_details(self, deploy_config, details, data):
+        """
+        The spec hashes do not depend on details which do not go into the
+        ConfigMap or Deployment.
+        """
+        changed = attr.assoc(
+            details, stripe_subscription_id=data.draw(subscription_id()),
+        )
+        self.expectThat(
+            configuration_spec_hash(deploy_config, changed),
+            Equals(configuration_spec_hash(deploy_config, details)),
+        )
+        self.expectThat(
+            deployment_spec_hash(deploy_config, changed),
+            Equals(deployment_spec_hash(deploy_config, details)),
+        )
+
+
+    def test_unannotated(self):
+        """
+        ``spec_hash`` returns ``None`` for an object without the annotation.
+        """
+        self.assertThat(
+            spec_hash(model.v1.ConfigMap(metadata=model.v1.ObjectMeta(name="foo"))),
+            Equals(None),
+        )
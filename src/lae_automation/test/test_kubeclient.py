@@ -0,0 +1,661 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+Tests for ``lae_automation.kubeclient``.
+"""
+
+from json import dumps
+
+import attr
+
+from testtools.matchers import Equals, Is, HasLength
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.resource import Resource
+from twisted.web.http import OK, FORBIDDEN, GONE
+from twisted.python.url import URL
+from twisted.test.proto_helpers import StringTransport
+
+from treq.testing import RequestTraversalAgent
+
+from txkube import (
+    KubernetesError, memory_kubernetes, network_kubernetes, v1_5_model as model,
+)
+
+from eliot.testing import capture_logging
+
+from lae_util.testtools import TestCase, CustomException
+
+from ..kubeclient import (
+    And, LabelSelector, NamespaceSelector, NullSelector,
+    WatchEvent, WatchExpired, ListWatchService, ObjectCache, KubeClient,
+    _Query, _WatchProtocol,
+)
+
+
+def _pod(name, resource_version):
+    return model.v1.Pod(
+        metadata=model.v1.ObjectMeta(
+            namespace=u"testing",
+            name=name,
+            resourceVersion=resource_version,
+        ),
+    )
+
+
+
+class QueryTests(TestCase):
+    """
+    Tests for translating selectors to ``_Query``.
+    """
+    def test_null(self):
+        """
+        ``NullSelector`` places no constraints on the query.
+        """
+        query = NullSelector().query(_Query())
+        self.expectThat(query.namespace, Is(None))
+        self.expectThat(query.label_selector(), Is(None))
+
+
+    def test_and(self):
+        """
+        ``And`` combines the constraints of all of its selectors.
+        """
+        query = And([
+            LabelSelector({u"b": u"2", u"a": u"1"}),
+            NamespaceSelector(u"testing"),
+        ]).query(_Query())
+        self.expectThat(query.namespace, Equals(u"testing"))
+        self.expectThat(query.label_selector(), Equals(u"a=1,b=2"))
+
+
+
+class WatchProtocolTests(TestCase):
+    """
+    Tests for ``_WatchProtocol``.
+    """
+    def setUp(self):
+        super(WatchProtocolTests, self).setUp()
+        self.events = []
+        self.protocol = _WatchProtocol(model, self.events.append)
+        self.protocol.makeConnection(StringTransport())
+
+
+    def test_events(self):
+        """
+        Each line of the response is delivered as a ``WatchEvent`` even if the
+        lines are split across chunks.
+        """
+        pod = _pod(u"foo", u"3")
+        data = b"".join(
+            dumps({u"type": event_type, u"object": model.iobject_to_raw(pod)}) + b"\n"
+            for event_type in [u"ADDED", u"MODIFIED", u"DELETED"]
+        )
+        for i in range(0, len(data), 7):
+            self.protocol.dataReceived(data[i:i + 7])
+        self.protocol.connectionLost(Failure(ResponseDone()))
+
+        self.expectThat(
+            self.events,
+            Equals([
+                WatchEvent(type=u"ADDED", object=pod),
+                WatchEvent(type=u"MODIFIED", object=pod),
+                WatchEvent(type=u"DELETED", object=pod),
+            ]),
+        )
+        self.expectThat(self.successResultOf(self.protocol.done), Is(None))
+
+
+    def test_one_chunk(self):
+        """
+        Several lines received together, including blank ones, are delivered
+        as separate events and a trailing partial line waits for the rest.
+        """
+        pod = _pod(u"foo", u"3")
+        def line(event_type):
+            return dumps({
+                u"type": event_type, u"object": model.iobject_to_raw(pod),
+            }) + b"\n"
+        deleted = line(u"DELETED")
+        self.protocol.dataReceived(
+            line(u"ADDED") + b"\n" + line(u"MODIFIED") + deleted[:10],
+        )
+        self.expectThat(self.events, HasLength(2))
+        self.protocol.dataReceived(deleted[10:])
+        self.expectThat(
+            self.events,
+            Equals([
+                WatchEvent(type=u"ADDED", object=pod),
+                WatchEvent(type=u"MODIFIED", object=pod),
+                WatchEvent(type=u"DELETED", object=pod),
+            ]),
+        )
+
+
+    def test_expired(self):
+        """
+        An ``ERROR`` event causes ``done`` to fail with ``WatchExpired``.
+        """
+        self.protocol.dataReceived(dumps({
+            u"type": u"ERROR",
+            u"object": {u"kind": u"Status", u"code": 410, u"message": u"too old"},
+        }) + b"\n")
+        self.failureResultOf(self.protocol.done, WatchExpired)
+
+
+    def test_error(self):
+        """
+        An ``ERROR`` event with a status code other than 410 causes ``done`` to
+        fail with ``KubernetesError``.
+        """
+        self.protocol.dataReceived(dumps({
+            u"type": u"ERROR",
+            u"object": {u"kind": u"Status", u"code": 500, u"message": u"oops"},
+        }) + b"\n")
+        reason = self.failureResultOf(self.protocol.done, KubernetesError)
+        self.expectThat(reason.value.code, Equals(500))
+
+
+
+@attr.s
+class _FakeKube(object):
+    """
+    A ``KubeClient`` stand-in where each list and watch is answered by the
+    test.
+    """
+    lists = attr.ib(default=attr.Factory(list))
+    watches = attr.ib(default=attr.Factory(list))
+
+    def select_versioned(self, kind, selector):
+        d = Deferred()
+        self.lists.append(d)
+        return d
+
+    def watch(self, kind, selector, resource_version, event_received, timeout=None):
+        d = Deferred()
+        self.watches.append((resource_version, event_received, d))
+        return d
+
+
+
+class ListWatchServiceTests(TestCase):
+    """
+    Tests for ``ListWatchService``.
+    """
+    def setUp(self):
+        super(ListWatchServiceTests, self).setUp()
+        self.clock = Clock()
+        self.kube = _FakeKube()
+        self.listed = []
+        self.changed = []
+        self.service = ListWatchService(
+            self.clock, 5.0, self.kube, model.v1.Pod, NullSelector(),
+            self.listed.append, self.changed.append,
+        )
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+
+
+    def test_list_then_watch(self):
+        """
+        The service starts with a full list and then watches from the list's
+        resource version, reporting each change.
+        """
+        pod = _pod(u"foo", u"11")
+        self.kube.lists.pop().callback(([], u"10"))
+        self.expectThat(self.listed, Equals([[]]))
+
+        [(version, event_received, d)] = self.kube.watches
+        self.expectThat(version, Equals(u"10"))
+        event_received(WatchEvent(type=u"ADDED", object=pod))
+        self.expectThat(self.changed, Equals([WatchEvent(type=u"ADDED", object=pod)]))
+
+        # When the server ends the watch, another one starts from the last
+        # observed version.
+        d.callback(None)
+        self.expectThat(self.kube.watches, HasLength(2))
+        self.expectThat(self.kube.watches[-1][0], Equals(u"11"))
+
+
+    def test_expired(self):
+        """
+        When the watch expires, the service lists everything again right away.
+        """
+        self.kube.lists.pop().callback(([], u"10"))
+        self.kube.watches[0][2].errback(WatchExpired())
+        self.expectThat(self.kube.lists, HasLength(1))
+
+
+    @capture_logging(None)
+    def test_retry(self, logger):
+        """
+        When a list fails, the failure is logged and the service tries again
+        after the retry interval.
+        """
+        self.kube.lists.pop().errback(CustomException())
+        self.expectThat(logger.flush_tracebacks(CustomException), HasLength(1))
+        self.expectThat(self.kube.lists, HasLength(0))
+        self.clock.advance(5.0)
+        self.expectThat(self.kube.lists, HasLength(1))
+
+
+    def test_stop(self):
+        """
+        Stopping the service cancels the outstanding operation.
+        """
+        self.service.stopService()
+        self.expectThat(self.kube.lists[0].called, Equals(True))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+    @capture_logging(None)
+    def test_staleness(self, logger):
+        """
+        ``ListWatchService.staleness`` is ``0`` from a successful list until
+        an error and then counts the time since the error.
+        """
+        self.clock.advance(3.0)
+        self.expectThat(self.service.staleness(), Equals(3.0))
+        self.kube.lists.pop().callback(([], u"10"))
+        self.expectThat(self.service.staleness(), Equals(0.0))
+
+        self.kube.watches[0][2].errback(CustomException())
+        logger.flush_tracebacks(CustomException)
+        self.clock.advance(2.0)
+        self.expectThat(self.service.staleness(), Equals(2.0))
+
+
+
+class ListWatchServiceResyncTests(TestCase):
+    """
+    Tests for ``ListWatchService`` with a resync interval.
+    """
+    def test_resync(self):
+        """
+        When a watch ends after the resync interval has passed since the last
+        list, the service lists again instead of watching.
+        """
+        clock = Clock()
+        kube = _FakeKube()
+        service = ListWatchService(
+            clock, 5.0, kube, model.v1.Pod, NullSelector(),
+            lambda objects: None, lambda event: None,
+            resync_interval=60.0,
+        )
+        service.startService()
+        self.addCleanup(service.stopService)
+
+        kube.lists.pop().callback(([], u"10"))
+        clock.advance(30.0)
+        kube.watches[-1][2].callback(None)
+        self.expectThat(kube.watches, HasLength(2))
+        self.expectThat(kube.lists, HasLength(0))
+
+        clock.advance(30.0)
+        kube.watches[-1][2].callback(None)
+        self.expectThat(kube.watches, HasLength(2))
+        self.expectThat(kube.lists, HasLength(1))
+
+
+
+class ObjectCacheTests(TestCase):
+    """
+    Tests for ``ObjectCache``.
+    """
+    def setUp(self):
+        super(ObjectCacheTests, self).setUp()
+        self.clock = Clock()
+        self.kube = _FakeKube()
+        self.cache = ObjectCache(
+            self.clock, 5.0, 60.0, self.kube, [model.v1.Pod], NullSelector(),
+        )
+        self.cache.startService()
+        self.addCleanup(self.cache.stopService)
+
+
+    def test_not_listed(self):
+        """
+        Before the first list, the cache is not current.
+        """
+        self.assertThat(self.cache.current(model.v1.Pod), Equals(False))
+
+
+    def test_listed_and_changed(self):
+        """
+        The cache holds the listed objects and applies watch events to them.
+        """
+        foo = _pod(u"foo", u"1")
+        bar = _pod(u"bar", u"2")
+        self.kube.lists.pop().callback(([foo, bar], u"2"))
+        self.expectThat(self.cache.current(model.v1.Pod), Equals(True))
+        self.expectThat(
+            self.cache.select(model.v1.Pod, NullSelector()),
+            Equals([bar, foo]),
+        )
+
+        [(_, event_received, _)] = self.kube.watches
+        baz = _pod(u"baz", u"3")
+        new_foo = _pod(u"foo", u"4")
+        event_received(WatchEvent(type=u"ADDED", object=baz))
+        event_received(WatchEvent(type=u"MODIFIED", object=new_foo))
+        event_received(WatchEvent(type=u"DELETED", object=bar))
+        self.expectThat(
+            self.cache.select(model.v1.Pod, NullSelector()),
+            Equals([baz, new_foo]),
+        )
+        self.expectThat(
+            self.cache.select(
+                model.v1.Pod, NamespaceSelector(u"elsewhere"),
+            ),
+            Equals([]),
+        )
+
+
+    @capture_logging(None)
+    def test_stale(self, logger):
+        """
+        After the watch fails, the cache is not current until it has listed
+        again.
+        """
+        self.kube.lists.pop().callback(([], u"1"))
+        self.kube.watches[0][2].errback(CustomException())
+        logger.flush_tracebacks(CustomException)
+        self.expectThat(self.cache.current(model.v1.Pod), Equals(False))
+        self.clock.advance(5.0)
+        self.kube.lists.pop().callback(([], u"2"))
+        self.expectThat(self.cache.current(model.v1.Pod), Equals(True))
+
+
+
+class KubeClientCacheTests(TestCase):
+    """
+    Tests for ``KubeClient`` with an ``ObjectCache``.
+    """
+    def setUp(self):
+        super(KubeClientCacheTests, self).setUp()
+        self.k8s = memory_kubernetes().client()
+        self.pod = _pod(u"foo", None)
+        self.successResultOf(self.k8s.create(self.pod))
+        self.cache = ObjectCache(
+            Clock(), 5.0, 60.0, _FakeKube(), [model.v1.Pod], NullSelector(),
+        )
+        self.cache.startService()
+        self.addCleanup(self.cache.stopService)
+        self.client = KubeClient(k8s=self.k8s, cache=self.cache)
+
+
+    def test_not_current(self):
+        """
+        While the cache is not current, selections go to the server.
+        """
+        [pod] = self.successResultOf(
+            self.client.get_pods(NamespaceSelector(u"testing")),
+        )
+        self.assertThat(pod.metadata.name, Equals(u"foo"))
+
+
+    def test_current(self):
+        """
+        While the cache is current, selections are answered from it.
+        """
+        cached = _pod(u"bar", u"1")
+        self.cache._services[model.v1.Pod]._kube.lists.pop().callback(
+            ([cached], u"1"),
+        )
+        self.assertThat(
+            self.successResultOf(
+                self.client.get_pods(NamespaceSelector(u"testing")),
+            ),
+            Equals([cached]),
+        )
+
+
+    def test_broader_selector(self):
+        """
+        Selections broader than the cache's selector go to the server even
+        while the cache is current.
+        """
+        cache = ObjectCache(
+            Clock(), 5.0, 60.0, _FakeKube(), [model.v1.Pod],
+            And([NamespaceSelector(u"elsewhere"), LabelSelector({u"a": u"b"})]),
+        )
+        cache.startService()
+        self.addCleanup(cache.stopService)
+        cache._services[model.v1.Pod]._kube.lists.pop().callback(([], u"1"))
+        client = KubeClient(k8s=self.k8s, cache=cache)
+
+        [pod] = self.successResultOf(client.get_pods())
+        self.expectThat(pod.metadata.name, Equals(u"foo"))
+        [pod] = self.successResultOf(
+            client.get_pods(NamespaceSelector(u"testing")),
+        )
+        self.expectThat(pod.metadata.name, Equals(u"foo"))
+        self.expectThat(
+            self.successResultOf(client.get_pods(And([
+                LabelSelector({u"a": u"b"}),
+                NamespaceSelector(u"elsewhere"),
+                NamespaceSelector(u"testing"),
+            ]))),
+            # Answered from the (empty) cache.
+            Equals([]),
+        )
+
+
+
+class ObjectCacheCoversTests(TestCase):
+    """
+    Tests for ``ObjectCache.covers``.
+    """
+    def test_covers(self):
+        """
+        A selector is covered if it includes every part of the cache's
+        selector.
+        """
+        namespace = NamespaceSelector(u"testing")
+        labels = LabelSelector({u"a": u"b"})
+        cache = ObjectCache(
+            Clock(), 5.0, 60.0, _FakeKube(), [], And([namespace, labels]),
+        )
+        self.expectThat(cache.covers(And([namespace, labels])), Equals(True))
+        self.expectThat(cache.covers(And([labels, namespace])), Equals(True))
+        self.expectThat(
+            cache.covers(And([And([namespace]), labels, NullSelector()])),
+            Equals(True),
+        )
+        self.expectThat(cache.covers(namespace), Equals(False))
+        self.expectThat(cache.covers(NullSelector()), Equals(False))
+
+
+
+class _PodListResource(Resource):
+    """
+    Answer every request with a fixed response code and list of pods and
+    remember the requested URIs.
+    """
+    isLeaf = True
+
+    def __init__(self, code, pods):
+        Resource.__init__(self)
+        self.code = code
+        self.pods = pods
+        self.uris = []
+
+
+    def render_GET(self, request):
+        self.uris.append(request.uri)
+        request.setResponseCode(self.code)
+        return dumps(model.iobject_to_raw(model.v1.PodList(items=self.pods)))
+
+
+
+class KubeClientSelectTests(TestCase):
+    """
+    Tests for ``KubeClient.select``.
+    """
+    def _client(self, resource):
+        return KubeClient(k8s=network_kubernetes(
+            base_url=URL.fromText(u"https://kubernetes.example.invalid./"),
+            agent=RequestTraversalAgent(resource),
+        ).client())
+
+
+    def test_server_side(self):
+        """
+        Namespace and label constraints are sent to the server.
+        """
+        matching = _pod(u"foo", None).transform(
+            [u"metadata", u"labels"], {u"app": u"s4"},
+        )
+        resource = _PodListResource(OK, [matching])
+        client = self._client(resource)
+        pods = self.successResultOf(client.get_pods(And([
+            NamespaceSelector(u"testing"),
+            LabelSelector({u"app": u"s4"}),
+        ])))
+        self.expectThat(pods, Equals([matching]))
+        self.expectThat(
+            resource.uris,
+            Equals([b"/api/v1/namespaces/testing/pods?labelSelector=app%3Ds4"]),
+        )
+
+
+    def test_matched_locally(self):
+        """
+        Objects the server returns which do not match the selector are left
+        out.
+        """
+        unlabeled = _pod(u"foo", None)
+        client = self._client(_PodListResource(OK, [unlabeled]))
+        pods = self.successResultOf(
+            client.get_pods(LabelSelector({u"app": u"s4"})),
+        )
+        self.expectThat(pods, Equals([]))
+
+
+    def test_unrestricted(self):
+        """
+        A selector with no constraints retrieves the whole collection.
+        """
+        resource = _PodListResource(OK, [])
+        client = self._client(resource)
+        self.successResultOf(client.get_pods())
+        self.expectThat(resource.uris, Equals([b"/api/v1/pods"]))
+
+
+    def test_fallback(self):
+        """
+        If the server cannot list the restricted collection, the whole
+        collection is retrieved and matched locally.
+        """
+        k8s = memory_kubernetes().client()
+        self.successResultOf(k8s.create(_pod(u"foo", None)))
+        self.successResultOf(k8s.create(_pod(u"bar", None).transform(
+            [u"metadata", u"namespace"], u"default",
+        )))
+        client = KubeClient(k8s=k8s)
+        [pod] = self.successResultOf(
+            client.get_pods(NamespaceSelector(u"testing")),
+        )
+        self.expectThat(pod.metadata.name, Equals(u"foo"))
+
+
+
+def _status(code):
+    return dumps({
+        u"kind": u"Status",
+        u"apiVersion": u"v1",
+        u"metadata": {},
+        u"status": u"Failure",
+        u"code": code,
+    })
+
+
+
+class _ListWatchResource(Resource):
+    """
+    Answer list requests with an empty list of pods and watch requests with a
+    fixed error response code, remembering each kind of request.
+    """
+    isLeaf = True
+
+    def __init__(self, watch_code):
+        Resource.__init__(self)
+        self.watch_code = watch_code
+        self.lists = []
+        self.watches = []
+
+
+    def render_GET(self, request):
+        if b"watch" in request.args:
+            self.watches.append(request.uri)
+            request.setResponseCode(self.watch_code)
+            return _status(self.watch_code)
+        self.lists.append(request.uri)
+        return dumps(model.iobject_to_raw(model.v1.PodList(
+            metadata=model.v1.ListMeta(resourceVersion=u"10"),
+            items=[],
+        )))
+
+
+
+class KubeClientWatchTests(TestCase):
+    """
+    Tests for ``KubeClient.watch``.
+    """
+    def _client(self, resource):
+        return KubeClient(k8s=network_kubernetes(
+            base_url=URL.fromText(u"https://kubernetes.example.invalid./"),
+            agent=RequestTraversalAgent(resource),
+        ).client())
+
+
+    def test_gone(self):
+        """
+        A watch rejected with 410 Gone fails with ``WatchExpired``.
+        """
+        client = self._client(_ListWatchResource(GONE))
+        self.failureResultOf(
+            client.watch(model.v1.Pod, NullSelector(), u"10", lambda event: None),
+            WatchExpired,
+        )
+
+
+    def test_forbidden(self):
+        """
+        A watch rejected with some other code fails with ``KubernetesError``.
+        """
+        client = self._client(_ListWatchResource(FORBIDDEN))
+        reason = self.failureResultOf(
+            client.watch(model.v1.Pod, NullSelector(), u"10", lambda event: None),
+            KubernetesError,
+        )
+        self.expectThat(reason.value.code, Equals(FORBIDDEN))
+
+
+    @capture_logging(None)
+    def test_forbidden_not_relisted(self, logger):
+        """
+        When the watch is forbidden, ``ListWatchService`` lists again only
+        after the retry interval.
+        """
+        resource = _ListWatchResource(FORBIDDEN)
+        clock = Clock()
+        service = ListWatchService(
+            clock, 5.0, self._client(resource), model.v1.Pod, NullSelector(),
+            lambda objects: None, lambda event: None,
+        )
+        service.startService()
+        self.addCleanup(service.stopService)
+
+        self.expectThat(resource.lists, HasLength(1))
+        self.expectThat(resource.watches, HasLength(1))
+        self.expectThat(logger.flush_tracebacks(KubernetesError), HasLength(1))
+        clock.advance(4.0)
+        self.expectThat(resource.lists, HasLength(1))
+        clock.advance(1.0)
+        self.expectThat(resource.lists, HasLength(2))
+        logger.flush_tracebacks(KubernetesError)
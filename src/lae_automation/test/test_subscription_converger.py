@@ -5,6 +5,7 @@
 Tests for ``lae_automation.subscription_converger``.
 """
 
+from signal import SIGUSR1, getsignal, signal
 from json import dumps, loads
 from tempfile import mkdtemp
 
@@ -34,6 +35,7 @@ from eliot.testing import capture_logging
 from hyperlink import URL
 
 from testtools.assertions import assert_that
+from testtools.twistedsupport import has_no_result
 from testtools.matchers import (
     AfterPreprocessing, Equals, Is, Not, MatchesPredicate, LessThan,
     GreaterThan, MatchesAll, MatchesRegex, Contains, HasLength,
@@ -43,11 +45,15 @@ from testtools.matchers import (
 from twisted.python.filepath import FilePath
 from twisted.application.service import IService
 from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.internet.task import Clock
 from twisted.test.proto_helpers import MemoryReactorClock
 
 from txaws.testing.service import FakeAWSServiceRegion
-from txaws.route53.model import RRSetKey, RRSet, HostedZone
-from txaws.route53.client import Name, CNAME
+from txaws.route53.model import (
+    RRSetKey, RRSet, HostedZone, create_rrset, upsert_rrset,
+)
+from txaws.route53.client import Name, CNAME, Route53Error
 
 from lae_util.k8s import (
     derive_pod, derive_replicaset, get_replicasets, get_pods,
@@ -59,6 +65,7 @@ from lae_automation.test.matchers import GoodEquals
 from lae_automation.subscription_manager import (
     SubscriptionDatabase,
     memory_client,
+    broken_client,
 )
 from lae_automation.subscription_converger import (
     _introducer_name_for_subscription,
@@ -67,6 +74,11 @@ from lae_automation.subscription_converger import (
     converge, get_hosted_zone_by_name,
     divert_errors_to_log,
     _convergence_service,
+    _execute_converge_outputs, _Job,
+    _route53_batches, submit_route53_changes, _ZoneCache,
+    _ChangeableConfigMaps, _ChangeableDeployments,
+    _State, _ZoneState, _converge_configmaps, _converge_deployments,
+    _AdaptiveTimerService, _Iteration, _SubscriptionCache,
 )
 from lae_automation.containers import (
     S4_CUSTOMER_GRID_NAME,
@@ -75,6 +87,9 @@ from lae_automation.containers import (
     create_deployment,
     configmap_name,
     deployment_name,
+    SPEC_HASH_ANNOTATION,
+    configuration_spec_hash,
+    deployment_spec_hash,
 )
 from lae_automation.model import DeploymentConfiguration
 
@@ -278,7 +293,7 @@ class SubscriptionConvergence(RuleBasedStateMachine):
         self.has_replicaset = set()
         self.has_pod = set()
 
-        self.subscription_client = memory_client(self.database.path, self.domain)
+        self.subscription_client = memory_client(self.path, self.domain)
         self.kubernetes = memory_kubernetes()
         self.kube_model = self.kubernetes.model
         self.kube_client = KubeClient(k8s=self.kubernetes.client())
@@ -286,6 +301,10 @@ class SubscriptionConvergence(RuleBasedStateMachine):
             access_key="access_key_id",
             secret_key="secret_access_key",
         )
+        # Remember the zone and the subscriptions between iterations as the
+        # real service does.
+        self.zones = _ZoneCache(Clock(), 3600.0)
+        self.subscription_cache = _SubscriptionCache()
         self.action = start_action(action_type=u"convergence-test")
 
     def execute_step(self, step):
@@ -504,6 +523,9 @@ class SubscriptionConvergence(RuleBasedStateMachine):
             self.subscription_client,
             self.kube_client,
             self.aws_region,
+            parallelism=4,
+            zones=self.zones,
+            subscription_cache=self.subscription_cache,
         )
         self.case.successResultOf(d)
         self.check_convergence(
@@ -736,20 +758,676 @@ class DivertErrorsToLogTests(TestCase):
 
 
 
-class ConvergenceLoopMetricsTests(TestCase):
+class ExecuteConvergeOutputsTests(TestCase):
     """
-    Tests for metrics gathered about the convergence loop.
+    Tests for ``_execute_converge_outputs``.
     """
-    def test_converge_complete(self):
+    def setUp(self):
+        super(ExecuteConvergeOutputsTests, self).setUp()
+        self.started = []
+        self.running = {}
+
+
+    def job(self, key, name):
+        def run():
+            self.started.append(name)
+            d = self.running[name] = Deferred()
+            return d
+        return _Job(key=key, run=run)
+
+
+    def test_parallelism(self):
         """
-        At the end of a convergence iteration, ``_CONVERGE_COMPLETE`` is updated
-        to the current time.
+        No more than ``parallelism`` jobs run at once.  As jobs finish, more
+        are started.
         """
-        interval = 45
+        jobs = list(self.job(key, key) for key in [u"a", u"b", u"c"])
+        d = _execute_converge_outputs(jobs, 2)
+        self.expectThat(self.started, Equals([u"a", u"b"]))
+        self.running[u"b"].callback(None)
+        self.expectThat(self.started, Equals([u"a", u"b", u"c"]))
+        self.running[u"a"].callback(None)
+        self.running[u"c"].callback(None)
+        self.expectThat(self.successResultOf(d), Equals([]))
+
+
+    def test_same_key_in_order(self):
+        """
+        Jobs with the same key run one after another in the order given.
+        """
+        jobs = [
+            self.job(u"a", u"delete-a"),
+            self.job(u"b", u"create-b"),
+            self.job(u"a", u"create-a"),
+        ]
+        d = _execute_converge_outputs(jobs, 10)
+        self.expectThat(self.started, Equals([u"delete-a", u"create-b"]))
+        self.running[u"delete-a"].callback(None)
+        self.expectThat(
+            self.started,
+            Equals([u"delete-a", u"create-b", u"create-a"]),
+        )
+        self.running[u"create-b"].callback(None)
+        self.running[u"create-a"].callback(None)
+        self.successResultOf(d)
+
+
+    @capture_logging(None)
+    def test_failure_isolated(self, logger):
+        """
+        A failed job is logged and the jobs after it, with the same key or
+        not, still run.
+        """
+        def broken():
+            raise CustomException()
+        broken_job = _Job(key=u"a", run=broken)
+        jobs = [
+            broken_job,
+            self.job(u"a", u"create-a"),
+            self.job(u"b", u"create-b"),
+        ]
+        d = _execute_converge_outputs(jobs, 1)
+        self.expectThat(self.started, Equals([u"create-a"]))
+        self.running[u"create-a"].callback(None)
+        self.expectThat(self.started, Equals([u"create-a", u"create-b"]))
+        self.running[u"create-b"].callback(None)
+        self.expectThat(self.successResultOf(d), Equals([broken_job]))
+        self.expectThat(logger.flush_tracebacks(CustomException), HasLength(1))
+
+
+    @capture_logging(None)
+    def test_outcomes_counted(self, logger):
+        """
+        Jobs which succeed and jobs which fail are counted by converger and
+        operation.
+        """
+        def broken():
+            raise CustomException()
+        labels = dict(converger=u"_converge_testing", operation=u"delete")
+        succeeded = sample(u"s4_convergence_jobs_succeeded", **labels)
+        failed = sample(u"s4_convergence_jobs_failed", **labels)
+        jobs = list(
+            _Job(key=key, run=run, **labels)
+            for (key, run) in [(u"a", broken), (u"b", lambda: None), (u"c", broken)]
+        )
+        self.successResultOf(_execute_converge_outputs(jobs, 1))
+        self.expectThat(
+            sample(u"s4_convergence_jobs_succeeded", **labels) - succeeded,
+            Equals(1.0),
+        )
+        self.expectThat(
+            sample(u"s4_convergence_jobs_failed", **labels) - failed,
+            Equals(2.0),
+        )
+        logger.flush_tracebacks(CustomException)
+
+
+
+def _cname_change(index, target=u"introducer.example.com", change=create_rrset):
+    return change(RRSet(
+        label=Name(u"{}.example.com".format(index)),
+        type=u"CNAME",
+        ttl=60,
+        records={CNAME(canonical_name=Name(target))},
+    ))
+
+
+
+def _route53_error(code):
+    return Route53Error(
+        u"<ErrorResponse>"
+        u"<Error><Type>Sender</Type><Code>{}</Code><Message>x</Message></Error>"
+        u"<RequestId>x</RequestId>"
+        u"</ErrorResponse>".format(code).encode("ascii"),
+        b"400",
+    )
+
+
+
+@attr.s
+class _ScriptedRoute53(object):
+    """
+    A Route53 client which rejects change batches as directed by a test.
+
+    :ivar reject: A one-argument callable which takes a list of changes and
+        returns an exception to fail the request with or ``None`` to accept
+        it.
+    """
+    reject = attr.ib()
+    submitted = attr.ib(default=attr.Factory(list))
+    accepted = attr.ib(default=attr.Factory(list))
+
+    def change_resource_record_sets(self, zone_id, changes):
+        self.submitted.append(changes)
+        error = self.reject(changes)
+        if error is None:
+            self.accepted.extend(changes)
+            return succeed(None)
+        return fail(error)
+
+
+
+class Route53BatchTests(TestCase):
+    """
+    Tests for ``_route53_batches`` and ``submit_route53_changes``.
+    """
+    zone = HostedZone(
+        name=u"example.com", identifier=u"ABCDEF",
+        rrset_count=0, reference=u"foo",
+    )
+
+    def test_record_limit(self):
+        """
+        Batches hold no more than 1000 records.
+        """
+        changes = list(_cname_change(i) for i in range(2500))
+        self.assertThat(
+            list(len(batch) for batch in _route53_batches(changes)),
+            Equals([1000, 1000, 500]),
+        )
+
+
+    def test_upsert_counts_double(self):
+        """
+        UPSERT changes count twice towards the limits.
+        """
+        changes = list(_cname_change(i, change=upsert_rrset) for i in range(600))
+        self.assertThat(
+            list(len(batch) for batch in _route53_batches(changes)),
+            Equals([500, 100]),
+        )
+
+
+    def test_value_limit(self):
+        """
+        Batches hold no more than 32000 characters of record values.
+        """
+        # 101 characters, counting the trailing dot.
+        target = u"a" * 60 + u"." + u"b" * 27 + u".example.com"
+        changes = list(_cname_change(i, target) for i in range(500))
+        batches = _route53_batches(changes)
+        self.expectThat(
+            list(len(batch) for batch in batches),
+            Equals([316, 184]),
+        )
+        self.expectThat(sum(batches, []), Equals(changes))
+
+
+    def test_throttled(self):
+        """
+        A throttled request is retried after a delay.
+        """
+        errors = [_route53_error(u"Throttling")]
+        route53 = _ScriptedRoute53(lambda changes: errors.pop() if errors else None)
+        clock = Clock()
+        changes = [_cname_change(1)]
+        d = submit_route53_changes(route53, self.zone, changes, clock, [3.0])
+        self.expectThat(route53.accepted, Equals([]))
+        self.expectThat(d, has_no_result())
+        clock.advance(3.0)
+        self.expectThat(route53.accepted, Equals(changes))
+        self.successResultOf(d)
+
+
+    @capture_logging(None)
+    def test_rejected_change_isolated(self, logger):
+        """
+        If Route53 rejects a batch for some reason other than throttling, the
+        batch is split so that the other changes can still be made.
+        """
+        bad = _cname_change(3)
+        def reject(changes):
+            if bad in changes:
+                return _route53_error(u"InvalidChangeBatch")
+            return None
+        route53 = _ScriptedRoute53(reject)
+        changes = list(_cname_change(i) for i in range(8))
+        d = submit_route53_changes(route53, self.zone, changes, Clock(), [])
+        self.failureResultOf(d, Route53Error)
+        self.assertThat(
+            route53.accepted,
+            Equals(list(c for c in changes if c != bad)),
+        )
+
+
+
+@attr.s
+class _CountingRoute53(object):
+    """
+    Count the requests made of a Route53 client.
+    """
+    route53 = attr.ib()
+    calls = attr.ib(default=attr.Factory(list))
+
+    def __getattr__(self, name):
+        method = getattr(self.route53, name)
+        def counted(*a, **kw):
+            self.calls.append(name)
+            return method(*a, **kw)
+        return counted
+
+
+
+class ZoneCacheTests(TestCase):
+    """
+    Tests for ``_ZoneCache``.
+    """
+    def setUp(self):
+        super(ZoneCacheTests, self).setUp()
+        region = FakeAWSServiceRegion(
+            access_key="access key id",
+            secret_key="secret access key",
+        )
+        self.route53 = _CountingRoute53(region.get_route53_client())
+        self.successResultOf(
+            self.route53.create_hosted_zone(u"foo", u"example.com"),
+        )
+        self.clock = Clock()
+        self.zones = _ZoneCache(self.clock, 60.0)
+        self.name = Name(u"example.com")
+        self.state = self.successResultOf(self.zones.get(self.route53, self.name))
+        del self.route53.calls[:]
+
+
+    def test_cached(self):
+        """
+        Until the rescan interval has passed, the zone is not loaded again.
+        """
+        state = self.successResultOf(self.zones.get(self.route53, self.name))
+        self.expectThat(state.zone, Equals(self.state.zone))
+        self.expectThat(self.route53.calls, Equals([]))
+
+
+    def test_rescan(self):
+        """
+        After the rescan interval, the rrsets are loaded again but the zone is
+        not looked up again.
+        """
+        self.clock.advance(60.0)
+        self.successResultOf(self.zones.get(self.route53, self.name))
+        self.assertThat(
+            self.route53.calls,
+            Equals([u"list_resource_record_sets"]),
+        )
+
+
+    def test_changes_applied(self):
+        """
+        Changes which are made are reflected in the cached rrsets.
+        """
+        change = _cname_change(1)
+        self.state.track(
+            [change],
+            self.route53.change_resource_record_sets(
+                self.state.zone.identifier, [change],
+            ),
+        )
+        state = self.successResultOf(self.zones.get(self.route53, self.name))
+        key = RRSetKey(label=change.rrset.label, type=change.rrset.type)
+        self.expectThat(state.rrsets.get(key), Equals(change.rrset))
+        self.expectThat(self.route53.calls, Equals([u"change_resource_record_sets"]))
+
+
+    def test_rejected(self):
+        """
+        If a change is rejected, the rrsets are loaded again at the next
+        iteration.
+        """
+        self.failureResultOf(self.state.track([], fail(CustomException())))
+        self.successResultOf(self.zones.get(self.route53, self.name))
+        self.assertThat(
+            self.route53.calls,
+            Equals([u"list_resource_record_sets"]),
+        )
+
+
+
+@attr.s
+class _RecordingSubscriptions(object):
+    """
+    Record the changes retrieved by a subscription manager client.
+    """
+    client = attr.ib()
+    retrieved = attr.ib(default=attr.Factory(list))
+
+    def changes(self, since=None, timeout=None):
+        d = self.client.changes(since, timeout)
+        def record(changes):
+            self.retrieved.append(changes)
+            return changes
+        d.addCallback(record)
+        return d
+
+
+
+class SubscriptionCacheTests(TestCase):
+    """
+    Tests for ``_SubscriptionCache``.
+    """
+    def setup_example(self):
+        """
+        Make an empty subscription database, a client for it and an empty
+        cache.
+        """
+        super(SubscriptionCacheTests, self).setup_example()
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        self.database = SubscriptionDatabase.from_directory(
+            path, u"s4.example.com", u"s4",
+        )
+        self.subscriptions = _RecordingSubscriptions(
+            memory_client(path, u"s4.example.com"),
+        )
+        self.cache = _SubscriptionCache()
 
-        reactor = MemoryReactorClock()
 
-        deploy_config = DeploymentConfiguration(
+    @given(subscription_details())
+    def test_loaded(self, details):
+        """
+        The first time, all active subscriptions are loaded.
+        """
+        expected = self.database.load_subscription(details)
+        self.expectThat(
+            self.successResultOf(self.cache.get(self.subscriptions)),
+            Equals([expected]),
+        )
+        [changes] = self.subscriptions.retrieved
+        self.expectThat(changes.reset, Equals(True))
+
+
+    @given(subscription_details(), subscription_details())
+    def test_changes_applied(self, details_a, details_b):
+        """
+        After the first time, only changes are retrieved and they are applied
+        to the subscriptions loaded before.
+        """
+        assume(details_a.subscription_id != details_b.subscription_id)
+        self.database.load_subscription(details_a)
+        self.successResultOf(self.cache.get(self.subscriptions))
+
+        expected = self.database.load_subscription(details_b)
+        self.database.deactivate_subscription(details_a.subscription_id)
+        self.expectThat(
+            self.successResultOf(self.cache.get(self.subscriptions)),
+            Equals([expected]),
+        )
+        [loaded, changes] = self.subscriptions.retrieved
+        self.expectThat(changes.reset, Equals(False))
+        self.expectThat(changes.subscriptions, Equals([expected]))
+        self.expectThat(changes.deactivated, Equals([details_a.subscription_id]))
+
+
+    @given(subscription_details())
+    def test_failure(self, details):
+        """
+        If retrieving changes fails, all active subscriptions are loaded the
+        next time.
+        """
+        expected = self.database.load_subscription(details)
+        self.successResultOf(self.cache.get(self.subscriptions))
+        self.failureResultOf(self.cache.get(broken_client()))
+        self.expectThat(
+            self.successResultOf(self.cache.get(self.subscriptions)),
+            Equals([expected]),
+        )
+        [loaded, reloaded] = self.subscriptions.retrieved
+        self.expectThat(reloaded.reset, Equals(True))
+
+
+
+class SpecHashDriftTests(TestCase):
+    """
+    Tests for the use of spec hashes by ``_ChangeableConfigMaps`` and
+    ``_ChangeableDeployments``.
+    """
+    def _changeables(self, deploy_config, created_from, details, hash):
+        """
+        Create ``_ChangeableConfigMaps`` and ``_ChangeableDeployments`` which
+        know about a ConfigMap and a Deployment for a subscription.
+
+        :param DeploymentConfiguration deploy_config: The desired
+            configuration.
+
+        :param DeploymentConfiguration created_from: The configuration from
+            which to create the existing objects.
+
+        :param SubscriptionDetails details: The subscription.
+
+        :param hash: The spec hash with which to annotate the existing objects
+            or ``None`` to leave the annotation off.
+        """
+        k8s_model = memory_kubernetes().model
+        if hash is None:
+            annotate = [[u"metadata", u"annotations", SPEC_HASH_ANNOTATION], discard]
+        else:
+            annotate = [[u"metadata", u"annotations", SPEC_HASH_ANNOTATION], hash]
+        configmap = create_configuration(created_from, details, k8s_model)
+        deployment = create_deployment(created_from, details, k8s_model)
+        return [
+            _ChangeableConfigMaps(
+                deploy_config=deploy_config,
+                k8s_model=k8s_model,
+                configmaps=[configmap.transform(*annotate)],
+            ),
+            _ChangeableDeployments(
+                deploy_config=deploy_config,
+                deployments=[deployment.transform(*annotate)],
+            ),
+        ]
+
+
+    @given(deployment_configuration(), subscription_details())
+    def test_unannotated(self, deploy_config, details):
+        """
+        Objects without a spec hash are compared with the desired subscription.
+        """
+        other_config = attr.assoc(
+            deploy_config,
+            introducer_image=u"tahoe-introducer:other",
+            s3_secret_key=deploy_config.s3_secret_key + u"other",
+        )
+        for changeable in self._changeables(deploy_config, deploy_config, details, None):
+            self.expectThat(changeable.needs_update(details), Equals(False))
+        for changeable in self._changeables(deploy_config, other_config, details, None):
+            self.expectThat(changeable.needs_update(details), Equals(True))
+
+
+    @given(deployment_configuration(), subscription_details())
+    def test_matching_hash(self, deploy_config, details):
+        """
+        An object with a spec hash matching the desired subscription does not
+        need an update, whatever else it contains.
+        """
+        other_config = attr.assoc(
+            deploy_config,
+            introducer_image=u"tahoe-introducer:other",
+            s3_secret_key=deploy_config.s3_secret_key + u"other",
+        )
+        configmaps, deployments = self._changeables(
+            deploy_config, other_config, details,
+            configuration_spec_hash(deploy_config, details),
+        )
+        self.expectThat(configmaps.needs_update(details), Equals(False))
+        configmaps, deployments = self._changeables(
+            deploy_config, other_config, details,
+            deployment_spec_hash(deploy_config, details),
+        )
+        self.expectThat(deployments.needs_update(details), Equals(False))
+
+
+    @given(deployment_configuration(), subscription_details())
+    def test_mismatched_hash(self, deploy_config, details):
+        """
+        An object with a spec hash which does not match the desired
+        subscription needs an update, even if it is otherwise the same.
+        """
+        for changeable in self._changeables(deploy_config, deploy_config, details, u"stale"):
+            self.expectThat(changeable.needs_update(details), Equals(True))
+
+
+    @given(deployment_configuration(), subscription_details())
+    def test_needs_annotation(self, deploy_config, details):
+        """
+        Only objects without a spec hash need to be annotated with one.
+        """
+        for changeable in self._changeables(deploy_config, deploy_config, details, None):
+            self.expectThat(changeable.needs_annotation(details), Equals(True))
+        for changeable in self._changeables(deploy_config, deploy_config, details, u"stale"):
+            self.expectThat(changeable.needs_annotation(details), Equals(False))
+
+
+
+@attr.s
+class _RecordingKube(object):
+    """
+    A ``KubeClient`` stand-in which remembers the changes made through it
+    and passes them on to a real client.
+    """
+    k8s = attr.ib()
+    calls = attr.ib(default=attr.Factory(list))
+
+    def create(self, obj):
+        self.calls.append((u"create", obj.metadata.name))
+        return self.k8s.create(obj)
+
+    def replace(self, obj):
+        self.calls.append((u"replace", obj.metadata.name))
+        return self.k8s.replace(obj)
+
+    def delete(self, obj):
+        self.calls.append((u"delete", obj.metadata.name))
+        return self.k8s.delete(obj)
+
+
+
+class InPlaceUpdateTests(TestCase):
+    """
+    Tests for updating drifted ConfigMaps and Deployments.
+    """
+    @given(deployment_configuration(), subscription_details())
+    def test_replaced(self, deploy_config, details):
+        """
+        A ConfigMap or Deployment which does not agree with the desired
+        subscription is replaced rather than deleted and created again.
+        """
+        k8s = memory_kubernetes().client()
+        old_config = attr.assoc(
+            deploy_config,
+            introducer_image=u"tahoe-introducer:old",
+            s3_secret_key=deploy_config.s3_secret_key + u"old",
+        )
+        self.successResultOf(
+            k8s.create(create_configuration(old_config, details, k8s.model)),
+        )
+        self.successResultOf(
+            k8s.create(create_deployment(old_config, details, k8s.model)),
+        )
+        actual = _State(
+            subscriptions={details.subscription_id: details},
+            configmaps=self.successResultOf(
+                k8s.list(k8s.model.v1.ConfigMap),
+            ).items,
+            deployments=self.successResultOf(
+                k8s.list(k8s.model.v1beta1.Deployment),
+            ).items,
+            replicasets=[],
+            pods=[],
+            service=None,
+            zone=_ZoneState(zone=None, rrsets=None),
+        )
+        recording = _RecordingKube(k8s=k8s)
+        for converger in [_converge_configmaps, _converge_deployments]:
+            for job in converger(actual, deploy_config, None, recording, None):
+                self.successResultOf(job.run())
+
+        self.expectThat(
+            recording.calls,
+            Equals([
+                (u"replace", configmap_name(details.subscription_id)),
+                (u"replace", deployment_name(details.subscription_id)),
+            ]),
+        )
+        [deployment] = self.successResultOf(
+            k8s.list(k8s.model.v1beta1.Deployment),
+        ).items
+        self.expectThat(
+            list(c.image for c in deployment.spec.template.spec.containers),
+            Contains(deploy_config.introducer_image),
+        )
+
+
+    @given(deployment_configuration(), subscription_details())
+    def test_annotated(self, deploy_config, details):
+        """
+        A ConfigMap or Deployment which agrees with the desired subscription but
+        has no spec hash is replaced once, with only the spec hash added, and
+        then left alone.
+        """
+        k8s = memory_kubernetes().client()
+        unannotate = [[u"metadata", u"annotations", SPEC_HASH_ANNOTATION], discard]
+        configmap = create_configuration(
+            deploy_config, details, k8s.model,
+        ).transform(*unannotate)
+        deployment = create_deployment(
+            deploy_config, details, k8s.model,
+        ).transform(*unannotate)
+        self.successResultOf(k8s.create(configmap))
+        self.successResultOf(k8s.create(deployment))
+
+        def actual():
+            return _State(
+                subscriptions={details.subscription_id: details},
+                configmaps=self.successResultOf(
+                    k8s.list(k8s.model.v1.ConfigMap),
+                ).items,
+                deployments=self.successResultOf(
+                    k8s.list(k8s.model.v1beta1.Deployment),
+                ).items,
+                replicasets=[],
+                pods=[],
+                service=None,
+                zone=_ZoneState(zone=None, rrsets=None),
+            )
+        def converge_once():
+            recording = _RecordingKube(k8s=k8s)
+            state = actual()
+            for converger in [_converge_configmaps, _converge_deployments]:
+                for job in converger(state, deploy_config, None, recording, None):
+                    self.successResultOf(job.run())
+            return recording.calls
+
+        self.expectThat(
+            converge_once(),
+            Equals([
+                (u"replace", configmap_name(details.subscription_id)),
+                (u"replace", deployment_name(details.subscription_id)),
+            ]),
+        )
+        [configmap] = actual().configmaps
+        [deployment] = actual().deployments
+        self.expectThat(
+            configmap.metadata.annotations[SPEC_HASH_ANNOTATION],
+            Equals(configuration_spec_hash(deploy_config, details)),
+        )
+        self.expectThat(
+            deployment.metadata.annotations[SPEC_HASH_ANNOTATION],
+            Equals(deployment_spec_hash(deploy_config, details)),
+        )
+        self.expectThat(
+            deployment.spec,
+            Equals(create_deployment(deploy_config, details, k8s.model).spec),
+        )
+        self.expectThat(converge_once(), Equals([]))
+
+
+
+class ConvergenceLoopMetricsTests(TestCase):
+    """
+    Tests for metrics gathered about the convergence loop.
+    """
+    def setUp(self):
+        super(ConvergenceLoopMetricsTests, self).setUp()
+        self.deploy_config = DeploymentConfiguration(
             domain=u"s4.example.com",
             kubernetes_namespace=u"testing",
             subscription_manager_endpoint=URL.from_text(u"http://localhost:8000"),
@@ -761,27 +1439,37 @@ class ConvergenceLoopMetricsTests(TestCase):
 
         state_path = FilePath(self.mktemp().decode("ascii"))
         state_path.makedirs()
-        subscription_client = memory_client(
+        self.subscription_client = memory_client(
             state_path,
-            deploy_config.domain,
+            self.deploy_config.domain,
         )
-        k8s_client = KubeClient(k8s=memory_kubernetes().client())
-        aws_region = FakeAWSServiceRegion(
-            access_key=deploy_config.s3_access_key_id,
-            secret_key=deploy_config.s3_secret_key,
+        self.k8s_client = KubeClient(k8s=memory_kubernetes().client())
+        self.aws_region = FakeAWSServiceRegion(
+            access_key=self.deploy_config.s3_access_key_id,
+            secret_key=self.deploy_config.s3_secret_key,
         )
-        d = aws_region.get_route53_client().create_hosted_zone(
-            u"foo", deploy_config.domain,
+        d = self.aws_region.get_route53_client().create_hosted_zone(
+            u"foo", self.deploy_config.domain,
         )
         self.successResultOf(d)
 
+
+    def test_converge_complete(self):
+        """
+        At the end of a convergence iteration, ``_CONVERGE_COMPLETE`` is updated
+        to the current time.
+        """
+        interval = 45
+
+        reactor = MemoryReactorClock()
+
         service = _convergence_service(
             reactor,
             interval,
-            deploy_config,
-            subscription_client,
-            k8s_client,
-            aws_region,
+            self.deploy_config,
+            self.subscription_client,
+            self.k8s_client,
+            self.aws_region,
         )
         service.startService()
         reactor.advance(interval)
@@ -792,3 +1480,211 @@ class ConvergenceLoopMetricsTests(TestCase):
             if metric.name == u"s4_last_convergence_succeeded"
         )))
         self.assertThat(reactor.seconds(), Equals(last_completed))
+
+
+    def test_phases_timed(self):
+        """
+        A convergence iteration observes the time taken to load each input,
+        by each converger, and to execute the resulting jobs.  The jobs
+        created are counted by converger and operation.
+        """
+        observations = [
+            (u"s4_convergence_input_seconds_count", dict(source=source))
+            for source in [
+                u"subscriptions", u"configmaps", u"deployments",
+                u"replicasets", u"pods", u"service", u"zone",
+            ]
+        ] + [
+            (u"s4_convergence_logic_seconds_count", dict(converger=converger))
+            for converger in [
+                u"_converge_service", u"_converge_configmaps",
+                u"_converge_deployments", u"_converge_replicasets",
+                u"_converge_pods", u"_converge_route53_customer",
+                u"_converge_route53_infrastructure",
+            ]
+        ] + [
+            (u"s4_convergence_execute_seconds_count", {}),
+            # There is no Service yet so one is created.
+            (
+                u"s4_convergence_jobs_created",
+                dict(converger=u"_converge_service", operation=u"create"),
+            ),
+            (
+                u"s4_convergence_jobs_succeeded",
+                dict(converger=u"_converge_service", operation=u"create"),
+            ),
+        ]
+        before = list(
+            sample(name, **labels)
+            for (name, labels) in observations
+        )
+        self.successResultOf(converge(
+            self.deploy_config,
+            self.subscription_client,
+            self.k8s_client,
+            self.aws_region,
+        ))
+        after = list(
+            sample(name, **labels)
+            for (name, labels) in observations
+        )
+        self.assertThat(
+            list(b - a for (a, b) in zip(before, after)),
+            Equals([1.0] * len(observations)),
+        )
+
+
+    def test_iteration_result(self):
+        """
+        ``converge`` reports how many changes it tried to make and how many of
+        them failed.
+        """
+        def iterate():
+            return self.successResultOf(converge(
+                self.deploy_config,
+                self.subscription_client,
+                self.k8s_client,
+                self.aws_region,
+            ))
+        # There is no Service yet so one is created.
+        self.expectThat(iterate(), Equals(_Iteration(jobs=1, failed=0)))
+        # Then there is nothing to do.
+        self.expectThat(iterate(), Equals(_Iteration(jobs=0, failed=0)))
+
+
+
+class AdaptiveTimerServiceTests(TestCase):
+    """
+    Tests for ``_AdaptiveTimerService``.
+    """
+    def setUp(self):
+        super(AdaptiveTimerServiceTests, self).setUp()
+        self.clock = Clock()
+        self.calls = []
+        self.results = []
+        self.service = _AdaptiveTimerService(
+            self.clock, 10.0, 60.0, lambda busy: busy, self.call,
+        )
+
+
+    def call(self):
+        self.calls.append(self.clock.seconds())
+        if self.results:
+            return self.results.pop(0)
+        return False
+
+
+    def advance(self, seconds):
+        self.clock.advance(0)
+        for i in range(int(seconds)):
+            self.clock.advance(1)
+
+
+    def test_busy(self):
+        """
+        The function is called when the service starts and again after the
+        minimum interval while it reports work.
+        """
+        self.results = [True, True]
+        self.service.startService()
+        self.advance(20)
+        self.assertThat(self.calls, Equals([0, 10, 20]))
+
+
+    def test_idle(self):
+        """
+        While the function reports no work the interval doubles up to the
+        maximum.  As soon as it reports work again, the interval is back to
+        the minimum.
+        """
+        self.results = [False, False, False, False, True]
+        self.service.startService()
+        self.advance(20 + 40 + 60 + 60 + 10)
+        self.assertThat(self.calls, Equals([0, 20, 60, 120, 180, 190]))
+
+
+    @capture_logging(None)
+    def test_failure(self, logger):
+        """
+        A call which fails is treated like one which had work.
+        """
+        self.results = [fail(CustomException())]
+        self.service.startService()
+        self.advance(10)
+        self.expectThat(self.calls, Equals([0, 10]))
+        self.expectThat(logger.flush_tracebacks(CustomException), HasLength(1))
+
+
+    def test_trigger(self):
+        """
+        ``trigger`` makes the next call happen right away.
+        """
+        self.service.startService()
+        self.advance(5)
+        self.service.trigger()
+        self.clock.advance(0)
+        self.assertThat(self.calls, Equals([0, 5]))
+
+
+    def test_trigger_while_running(self):
+        """
+        ``trigger`` while a call is running makes the next call happen as soon
+        as it finishes.
+        """
+        running = Deferred()
+        self.results = [running]
+        self.service.startService()
+        self.clock.advance(0)
+        self.service.trigger()
+        running.callback(False)
+        self.clock.advance(0)
+        self.assertThat(self.calls, Equals([0, 0]))
+
+
+    def test_stop(self):
+        """
+        Stopping the service waits for the running call and cancels the next
+        one.
+        """
+        running = Deferred()
+        self.results = [running]
+        self.service.startService()
+        self.clock.advance(0)
+        d = self.service.stopService()
+        self.expectThat(d, has_no_result())
+        running.callback(True)
+        self.expectThat(self.successResultOf(d), Is(None))
+        self.advance(60)
+        self.expectThat(self.calls, Equals([0]))
+
+
+    def test_trigger_signal(self):
+        """
+        While the service is running, ``trigger_signal`` triggers a call.  The
+        previous handler is restored when the service stops.
+        """
+        def previous(signum, frame):
+            pass
+        original = signal(SIGUSR1, previous)
+        self.addCleanup(signal, SIGUSR1, original)
+
+        self.clock.callFromThread = lambda f, *a, **kw: f(*a, **kw)
+        self.service.trigger_signal = SIGUSR1
+        self.service.startService()
+        self.advance(5)
+        handler = getsignal(SIGUSR1)
+        self.expectThat(handler, Not(Is(previous)))
+        handler(SIGUSR1, None)
+        self.clock.advance(0)
+        self.expectThat(self.calls, Equals([0, 5]))
+
+        self.successResultOf(self.service.stopService())
+        self.expectThat(getsignal(SIGUSR1), Is(previous))
+
+
+
+def sample(name, **labels):
+    """
+    :return float: The current value of a Prometheus sample.
+    """
+    return REGISTRY.get_sample_value(name, labels) or 0.0
@@ -6,7 +6,7 @@ Tests for ``lae_automation.subscription_manager``.
 """
 
 from tempfile import mkdtemp
-from json import dumps
+from json import dumps, loads
 from base64 import b32encode
 
 import attr
@@ -15,17 +15,30 @@ from zope.interface.verify import verifyObject
 
 from twisted.python.filepath import FilePath
 from twisted.application.service import IService
+from twisted.python.usage import UsageError
+from twisted.internet.task import Clock, Cooperator
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from twisted.web.client import readBody
+from twisted.web.http import BAD_REQUEST, HTTPChannel, Request
+from twisted.web.server import NOT_DONE_YET
 
 from testtools.matchers import (
-    Equals, Is, Not, HasLength,
+    Equals, Is, Not, HasLength, IsInstance,
 )
 
 from eliot.testing import capture_logging
 
 from hypothesis import given, assume
 
+from prometheus_client import REGISTRY
+
 from lae_automation.subscription_manager import (
-    Options, makeService, memory_client,
+    Options, makeService, memory_client, UnexpectedResponseCode,
+    SubscriptionDatabase, _DetailsCache, _write_subscriptions,
+    marshal_subscription, Changes,
 )
 
 from lae_util.testtools import TestCase
@@ -52,7 +65,8 @@ class SubscriptionManagerTestMixin(object):
 
     Subclasses will mix this in to define tests against the subscription
     manager client interface.  They must override ``get_client`` to create a
-    client to subject to the tests.
+    client to subject to the tests.  The client's server must use
+    ``self.clock`` to time out requests.
     """
     def get_client(self):
         raise NotImplementedError()
@@ -180,6 +194,50 @@ class SubscriptionManagerTestMixin(object):
         self.assertThat(ids[0], Equals(target.subscription_id))
 
 
+    @given(subscription_details(), subscription_details())
+    def test_search_by_ids(self, target, bystander):
+        """
+        ``search`` finds a list of subscription identifiers with a customer
+        identifier and Stripe subscription identifier matching the given ones.
+        """
+        assume(target.subscription_id != bystander.subscription_id)
+        assume(target.customer_id != bystander.customer_id)
+        assume(target.stripe_subscription_id != bystander.stripe_subscription_id)
+
+        client = self.get_client()
+        self.successResultOf(client.load(target))
+        self.successResultOf(client.load(bystander))
+
+        self.expectThat(
+            self.successResultOf(client.search(customer_id=target.customer_id)),
+            Equals([target.subscription_id]),
+        )
+        self.expectThat(
+            self.successResultOf(client.search(
+                stripe_subscription_id=target.stripe_subscription_id,
+            )),
+            Equals([target.subscription_id]),
+        )
+        self.expectThat(
+            self.successResultOf(client.search(
+                customer_id=target.customer_id,
+                stripe_subscription_id=bystander.stripe_subscription_id,
+            )),
+            Equals([]),
+        )
+
+
+    def test_search_without_criteria(self):
+        """
+        ``search`` fails if it is given nothing to search for.
+        """
+        client = self.get_client()
+        self.assertThat(
+            self.failureResultOf(client.search()).value,
+            IsInstance(UnexpectedResponseCode),
+        )
+
+
     @given(subscription_details(), subscription_id())
     def test_change_stripe_subscription_id(self, details, new_stripe_id):
         """
@@ -201,6 +259,25 @@ class SubscriptionManagerTestMixin(object):
             )),
         )
 
+    @given(subscription_details(), subscription_id())
+    def test_change_then_get(self, details, new_stripe_id):
+        """
+        A subscription changed using ``change`` can be retrieved with ``get``.
+        """
+        client = self.get_client()
+        expected = self.successResultOf(client.load(details))
+        self.successResultOf(client.change(
+            details.subscription_id,
+            stripe_subscription_id=new_stripe_id,
+        ))
+        self.assertThat(
+            self.successResultOf(client.get(details.subscription_id)),
+            AttrsEquals(attr.assoc(
+                expected,
+                stripe_subscription_id=new_stripe_id,
+            )),
+        )
+
     @given(subscription_details(), subscription_id())
     def test_change_does_not_reactivate(self, details, new_stripe_id):
         """
@@ -220,15 +297,226 @@ class SubscriptionManagerTestMixin(object):
         )
 
 
+    @given(subscription_details(), subscription_details(), subscription_details())
+    def test_list_pages(self, details_a, details_b, details_c):
+        """
+        ``list`` gets all of the active subscriptions, a page at a time, in
+        order of their identifiers.
+        """
+        subscription_ids = {
+            details.subscription_id
+            for details in (details_a, details_b, details_c)
+        }
+        assume(len(subscription_ids) == 3)
+        client = self.get_client()
+        expected = sorted(
+            (
+                self.successResultOf(client.load(details))
+                for details in (details_a, details_b, details_c)
+            ),
+            key=lambda details: details.subscription_id,
+        )
+        for page_size in (1, 2, 3, 4):
+            self.expectThat(
+                self.successResultOf(client.list(page_size=page_size)),
+                Equals(expected),
+            )
+        self.expectThat(
+            self.successResultOf(client.list_if_changed(page_size=2)).subscriptions,
+            Equals(expected),
+        )
+
+
+    @given(subscription_details(), subscription_details())
+    def test_list_page(self, details_a, details_b):
+        """
+        A page of the listing includes no more than ``limit`` subscriptions
+        with identifiers after ``after`` and the identifier to give as
+        ``after`` for the next page, if there is one.
+        """
+        assume(details_a.subscription_id < details_b.subscription_id)
+        client = self.get_client()
+        self.successResultOf(client.load(details_a))
+        self.successResultOf(client.load(details_b))
+
+        def page(**query):
+            response = self.successResultOf(client.agent.request(
+                b"GET", client._url(u"v1", u"subscriptions", **query),
+            ))
+            page = loads(self.successResultOf(readBody(response)))
+            return (
+                list(s["subscription_id"] for s in page["subscriptions"]),
+                page["next"],
+            )
+
+        self.expectThat(
+            page(limit=u"1"),
+            Equals(([details_a.subscription_id], details_a.subscription_id)),
+        )
+        self.expectThat(
+            page(limit=u"1", after=details_a.subscription_id),
+            Equals(([details_b.subscription_id], None)),
+        )
+        self.expectThat(
+            page(limit=u"2"),
+            Equals(([details_a.subscription_id, details_b.subscription_id], None)),
+        )
+        self.expectThat(
+            page(after=details_b.subscription_id),
+            Equals(([], None)),
+        )
+
+
+    def test_list_bad_limit(self):
+        """
+        A request for a page of the listing with a ``limit`` which is not a
+        positive integer is rejected.
+        """
+        client = self.get_client()
+        for limit in (u"0", u"-1", u"many"):
+            response = self.successResultOf(client.agent.request(
+                b"GET", client._url(u"v1", u"subscriptions", limit=limit),
+            ))
+            self.expectThat(response.code, Equals(BAD_REQUEST))
+
+
+    @given(subscription_details(), subscription_id())
+    def test_list_if_changed(self, details, new_stripe_id):
+        """
+        ``list_if_changed`` gets the active subscriptions only if they have
+        changed since the listing with the given entity tag.
+        """
+        client = self.get_client()
+        expected = self.successResultOf(client.load(details))
+
+        first = self.successResultOf(client.list_if_changed())
+        self.expectThat(first.etag, Not(Is(None)))
+        self.expectThat(first.subscriptions, Equals([expected]))
+
+        unchanged = self.successResultOf(client.list_if_changed(first.etag))
+        self.expectThat(unchanged.etag, Equals(first.etag))
+        self.expectThat(unchanged.subscriptions, Is(None))
+
+        self.successResultOf(client.change(
+            details.subscription_id,
+            stripe_subscription_id=new_stripe_id,
+        ))
+        changed = self.successResultOf(client.list_if_changed(first.etag))
+        self.expectThat(changed.etag, Not(Equals(first.etag)))
+        self.expectThat(
+            changed.subscriptions,
+            Equals([
+                attr.assoc(expected, stripe_subscription_id=new_stripe_id),
+            ]),
+        )
+
+
+    @given(subscription_details(), subscription_details(), subscription_id())
+    def test_changes(self, details_a, details_b, new_stripe_id):
+        """
+        ``changes`` gets the subscriptions created, changed and deactivated
+        since the given revision.
+        """
+        assume(details_a.subscription_id != details_b.subscription_id)
+        client = self.get_client()
+
+        empty = self.successResultOf(client.changes())
+        self.expectThat(empty.reset, Equals(True))
+        self.expectThat(empty.subscriptions, Equals([]))
+
+        expected_a = self.successResultOf(client.load(details_a))
+        expected_b = self.successResultOf(client.load(details_b))
+        created = self.successResultOf(client.changes(empty.revision))
+        self.expectThat(created.reset, Equals(False))
+        self.expectThat(created.revision, Not(Equals(empty.revision)))
+        self.expectThat(
+            sorted(created.subscriptions, key=lambda d: d.subscription_id),
+            Equals(sorted(
+                [expected_a, expected_b], key=lambda d: d.subscription_id,
+            )),
+        )
+        self.expectThat(created.deactivated, Equals([]))
+
+        self.successResultOf(client.delete(details_a.subscription_id))
+        self.successResultOf(client.change(
+            details_b.subscription_id,
+            stripe_subscription_id=new_stripe_id,
+        ))
+        changed = self.successResultOf(client.changes(created.revision))
+        self.expectThat(changed.reset, Equals(False))
+        self.expectThat(
+            changed.subscriptions,
+            Equals([
+                attr.assoc(expected_b, stripe_subscription_id=new_stripe_id),
+            ]),
+        )
+        self.expectThat(changed.deactivated, Equals([details_a.subscription_id]))
+
+        unchanged = self.successResultOf(client.changes(changed.revision))
+        self.expectThat(unchanged.revision, Equals(changed.revision))
+        self.expectThat(unchanged.subscriptions, Equals([]))
+        self.expectThat(unchanged.deactivated, Equals([]))
+
+
+    @given(subscription_details())
+    def test_changes_reset(self, details):
+        """
+        ``changes`` gets all active subscriptions if it is given a revision the
+        subscription manager has not reached.
+        """
+        client = self.get_client()
+        expected = self.successResultOf(client.load(details))
+        revision = self.successResultOf(client.changes()).revision
+        changes = self.successResultOf(client.changes(revision + 1))
+        self.expectThat(changes.reset, Equals(True))
+        self.expectThat(changes.revision, Equals(revision))
+        self.expectThat(changes.subscriptions, Equals([expected]))
+
+
+    @given(subscription_details())
+    def test_changes_wait(self, details):
+        """
+        ``changes`` with a timeout waits for a change if there are none yet.
+        """
+        client = self.get_client()
+        revision = self.successResultOf(client.changes()).revision
+        d = client.changes(revision, timeout=30.0)
+        self.assertNoResult(d)
+        expected = self.successResultOf(client.load(details))
+        changes = self.successResultOf(d)
+        self.expectThat(changes.subscriptions, Equals([expected]))
+
+
+    def test_changes_timeout(self):
+        """
+        ``changes`` with a timeout gets no changes if none are made before the
+        timeout.
+        """
+        client = self.get_client()
+        revision = self.successResultOf(client.changes()).revision
+        d = client.changes(revision, timeout=30.0)
+        self.clock.advance(29.0)
+        self.assertNoResult(d)
+        self.clock.advance(1.0)
+        changes = self.successResultOf(d)
+        self.expectThat(changes.revision, Equals(revision))
+        self.expectThat(changes.reset, Equals(False))
+        self.expectThat(changes.subscriptions, Equals([]))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+
 class SubscriptionManagerTests(SubscriptionManagerTestMixin, TestCase):
     def get_client(self):
         return self._get_client_for_path(FilePath(mkdtemp().decode("utf-8")))
 
 
     def _get_client_for_path(self, path):
+        self.clock = Clock()
         return memory_client(
             path,
             u"s4.example.com",
+            clock=self.clock,
         )
 
 
@@ -296,6 +584,403 @@ class SubscriptionManagerTests(SubscriptionManagerTestMixin, TestCase):
         self.assertThat(details, AttrsEquals(retrieved))
 
 
+    @given(subscription_details())
+    def test_changes_current(self, details):
+        """
+        ``changes`` given the current revision gets no changes without looking
+        at the stored subscriptions.
+        """
+        path = FilePath(mkdtemp().decode("utf-8"))
+        client = self._get_client_for_path(path)
+        self.successResultOf(client.load(details))
+        revision = self.successResultOf(client.changes()).revision
+        path.child(
+            b32encode(details.subscription_id) + u".json",
+        ).setContent(b"not json")
+        changes = self.successResultOf(client.changes(revision))
+        self.expectThat(changes.revision, Equals(revision))
+        self.expectThat(changes.reset, Equals(False))
+        self.expectThat(changes.subscriptions, Equals([]))
+        self.expectThat(changes.deactivated, Equals([]))
+
+
+
+class SQLiteSubscriptionManagerTests(SubscriptionManagerTestMixin, TestCase):
+    def get_client(self):
+        self.clock = Clock()
+        return memory_client(
+            FilePath(mkdtemp().decode("utf-8")),
+            u"s4.example.com",
+            u"sqlite",
+            self.clock,
+        )
+
+
+
+class DetailsCacheTests(TestCase):
+    """
+    Tests for ``_DetailsCache``.
+    """
+    def test_hit(self):
+        """
+        ``_DetailsCache.get`` returns what was ``put`` with the same stamp and
+        counts a hit.
+        """
+        cache = _DetailsCache(2)
+        cache.put(u"a", 1, u"details-a")
+        before = sample("s4_subscription_cache_hits")
+        self.expectThat(cache.get(u"a", 1), Equals(u"details-a"))
+        self.expectThat(sample("s4_subscription_cache_hits") - before, Equals(1))
+
+
+    def test_miss(self):
+        """
+        ``_DetailsCache.get`` returns ``None`` and counts a miss for a
+        subscription which was not ``put``, was ``put`` with a different stamp,
+        or was invalidated.
+        """
+        cache = _DetailsCache(2)
+        cache.put(u"a", 1, u"details-a")
+        cache.put(u"b", 1, u"details-b")
+        cache.invalidate(u"b")
+        before = sample("s4_subscription_cache_misses")
+        self.expectThat(cache.get(u"a", 2), Is(None))
+        self.expectThat(cache.get(u"b", 1), Is(None))
+        self.expectThat(cache.get(u"c", 1), Is(None))
+        self.expectThat(sample("s4_subscription_cache_misses") - before, Equals(3))
+
+
+    def test_least_recently_used_discarded(self):
+        """
+        When the cache is full, ``_DetailsCache.put`` discards the least
+        recently used entry.
+        """
+        cache = _DetailsCache(2)
+        cache.put(u"a", None, u"details-a")
+        cache.put(u"b", None, u"details-b")
+        cache.get(u"a", None)
+        cache.put(u"c", None, u"details-c")
+        self.expectThat(cache.get(u"a", None), Equals(u"details-a"))
+        self.expectThat(cache.get(u"b", None), Is(None))
+        self.expectThat(cache.get(u"c", None), Equals(u"details-c"))
+
+
+    def test_disabled(self):
+        """
+        A ``_DetailsCache`` with no capacity keeps nothing.
+        """
+        cache = _DetailsCache(0)
+        cache.put(u"a", None, u"details-a")
+        self.assertThat(cache.get(u"a", None), Is(None))
+
+
+
+@attr.s
+class _StreamingRequest(object):
+    """
+    Just enough of a request to have a response streamed to it.
+    """
+    written = attr.ib(default=attr.Factory(list))
+    producer = attr.ib(default=None)
+    finished = attr.ib(default=False)
+    lost = attr.ib(default=False)
+    finishing = attr.ib(default=attr.Factory(Deferred))
+
+    def write(self, data):
+        self.written.append(data)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def finish(self):
+        self.finished = True
+
+    def notifyFinish(self):
+        return self.finishing
+
+    def loseConnection(self):
+        self.lost = True
+
+
+
+class _NotifyingRequest(Request):
+    """
+    A ``Request`` which remembers the ``Deferred`` instances it hands out
+    from ``notifyFinish``.
+    """
+    def __init__(self, *a, **kw):
+        Request.__init__(self, *a, **kw)
+        self.finish_notifications = []
+
+
+    def notifyFinish(self):
+        d = Request.notifyFinish(self)
+        self.finish_notifications.append(d)
+        return d
+
+
+
+class WriteSubscriptionsTests(TestCase):
+    """
+    Tests for ``_write_subscriptions``.
+    """
+    def write(self, request, *details):
+        """
+        Start writing some subscriptions to a request using a cooperator which
+        does one piece of work each time its clock is advanced by a second.
+
+        :param request: The request to write to.
+
+        :return: A three-tuple of the request, the clock and the database the
+            subscriptions were loaded into.
+        """
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        database = SubscriptionDatabase.from_directory(
+            path, u"s4.example.com", u"s4",
+        )
+        for each in details:
+            database.load_subscription(each)
+        clock = Clock()
+        cooperator = Cooperator(
+            terminationPredicateFactory=lambda: lambda: True,
+            scheduler=lambda f: clock.callLater(1, f),
+        )
+        self.assertThat(
+            _write_subscriptions(
+                request, cooperator, database,
+                list(each.subscription_id for each in details),
+                next=None,
+            ),
+            Is(NOT_DONE_YET),
+        )
+        return request, clock, database
+
+
+    @given(subscription_details(), subscription_details())
+    def test_incremental(self, details_a, details_b):
+        """
+        The subscriptions are written one at a time, nothing is written while
+        the request has the writing paused and the request is finished once
+        everything has been written.
+        """
+        assume(details_a.subscription_id != details_b.subscription_id)
+        request, clock, database = self.write(
+            _StreamingRequest(), details_a, details_b,
+        )
+
+        clock.advance(1)
+        self.expectThat(request.written, HasLength(2))
+        request.producer.pauseProducing()
+        clock.advance(1)
+        self.expectThat(request.written, HasLength(2))
+
+        request.producer.resumeProducing()
+        clock.advance(1)
+        clock.advance(1)
+        self.expectThat(request.finished, Equals(True))
+        self.expectThat(request.producer, Is(None))
+        self.expectThat(
+            loads(b"".join(request.written)),
+            Equals(dict(
+                subscriptions=list(
+                    loads(dumps(marshal_subscription(
+                        database.get_subscription(details.subscription_id),
+                    )))
+                    for details in (details_a, details_b)
+                ),
+                next=None,
+            )),
+        )
+
+
+    @given(subscription_details(), subscription_details())
+    def test_disconnected(self, details_a, details_b):
+        """
+        If the request is interrupted, nothing more is written.
+        """
+        assume(details_a.subscription_id != details_b.subscription_id)
+        request, clock, database = self.write(
+            _StreamingRequest(), details_a, details_b,
+        )
+
+        clock.advance(1)
+        request.finishing.errback(Exception("Connection lost"))
+        clock.advance(1)
+        clock.advance(1)
+        self.expectThat(request.written, HasLength(2))
+        self.expectThat(request.finished, Equals(False))
+        self.expectThat(request.producer, Is(None))
+        self.expectThat(request.lost, Equals(False))
+
+
+    @given(subscription_details(), subscription_details())
+    def test_channel_disconnected(self, details_a, details_b):
+        """
+        If the connection under a real request is lost, the channel stopping
+        the producer and then telling the request the connection is gone does
+        not cause an error and nothing more is written.
+        """
+        assume(details_a.subscription_id != details_b.subscription_id)
+        transport = StringTransport()
+        channel = HTTPChannel()
+        channel.makeConnection(transport)
+        request = _NotifyingRequest(channel, False)
+        request.method = b"GET"
+        request.clientproto = b"HTTP/1.1"
+        channel.requests.append(request)
+        request, clock, database = self.write(request, details_a, details_b)
+
+        clock.advance(1)
+        written = transport.value()
+        channel.stopProducing()
+        channel.connectionLost(Exception("Connection lost"))
+        clock.advance(1)
+        clock.advance(1)
+        self.expectThat(transport.value(), Equals(written))
+        self.expectThat(request.finished, Equals(False))
+        [finishing] = request.finish_notifications
+        self.expectThat(self.successResultOf(finishing), Is(None))
+
+
+
+class ChangesTests(TestCase):
+    """
+    Tests for waiting for changes with ``Changes``.
+    """
+    def setUp(self):
+        super(ChangesTests, self).setUp()
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        self.database = SubscriptionDatabase.from_directory(
+            path, u"s4.example.com", u"s4",
+        )
+        self.clock = Clock()
+        self.resource = Changes(self.database, self.clock)
+
+
+    def wait(self):
+        """
+        Start a request which waits up to 30 seconds for a change.
+
+        :return: A two-tuple of the request and its channel.
+        """
+        channel = HTTPChannel()
+        channel.makeConnection(StringTransport())
+        request = Request(channel, False)
+        request.method = b"GET"
+        request.clientproto = b"HTTP/1.1"
+        request.args = {
+            b"since": [b"%d" % (self.database.revision(),)],
+            b"timeout": [b"30"],
+        }
+        channel.requests.append(request)
+        self.assertThat(self.resource.render_GET(request), Is(NOT_DONE_YET))
+        return request, channel
+
+
+    def test_timeouts_forgotten(self):
+        """
+        A request which times out stops waiting for changes, however many
+        there are without a change.
+        """
+        for i in range(3):
+            request, channel = self.wait()
+            self.clock.advance(30)
+            self.expectThat(bool(request.finished), Equals(True))
+        self.expectThat(self.database._changed._subscriptions, Equals([]))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+    def test_disconnects_forgotten(self):
+        """
+        A request whose client goes away stops waiting for changes.
+        """
+        for i in range(3):
+            request, channel = self.wait()
+            channel.connectionLost(Failure(ConnectionDone()))
+        self.expectThat(self.database._changed._subscriptions, Equals([]))
+        self.expectThat(self.clock.getDelayedCalls(), Equals([]))
+
+
+
+class SubscriptionDatabaseCacheTests(TestCase):
+    """
+    Tests for ``SubscriptionDatabase``'s cache of subscription details.
+    """
+    def database(self, validate_cache=False):
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        return SubscriptionDatabase.from_directory(
+            path, u"s4.example.com", u"s4", validate_cache=validate_cache,
+        )
+
+
+    @given(subscription_details())
+    def test_read_through(self, details):
+        """
+        ``get_subscription`` and ``list_active_subscriptions`` only read a
+        subscription from the store when it is not cached.
+        """
+        database = self.database()
+        loaded = database.load_subscription(details)
+        before = sample("s4_subscription_cache_hits"), sample("s4_subscription_cache_misses")
+        self.expectThat(database.get_subscription(details.subscription_id), GoodEquals(loaded))
+        self.expectThat(database.get_subscription(details.subscription_id), GoodEquals(loaded))
+        self.expectThat(database.list_active_subscriptions(), GoodEquals([loaded]))
+        after = sample("s4_subscription_cache_hits"), sample("s4_subscription_cache_misses")
+        self.expectThat(
+            list(b - a for (a, b) in zip(before, after)),
+            Equals([2, 1]),
+        )
+
+
+    @given(subscription_details(), subscription_id())
+    def test_invalidated(self, details, new_stripe_id):
+        """
+        Changes made with ``change_subscription`` and
+        ``deactivate_subscription`` are reflected in the results of
+        ``get_subscription`` and ``list_active_subscriptions``.
+        """
+        database = self.database()
+        loaded = database.load_subscription(details)
+        database.get_subscription(details.subscription_id)
+        changed = database.change_subscription(attr.assoc(
+            loaded, stripe_subscription_id=new_stripe_id,
+        ))
+        self.expectThat(
+            database.get_subscription(details.subscription_id),
+            GoodEquals(changed),
+        )
+        database.deactivate_subscription(details.subscription_id)
+        self.expectThat(database.list_active_subscriptions(), Equals([]))
+
+
+    @given(subscription_details(), subscription_id())
+    def test_validated(self, details, new_stripe_id):
+        """
+        With ``validate_cache``, changes made to the store by something else
+        are reflected in the results of ``get_subscription``.
+        """
+        database = self.database(validate_cache=True)
+        loaded = database.load_subscription(details)
+        database.get_subscription(details.subscription_id)
+
+        # Change the stored state without involving the database.
+        other = attr.assoc(database, _cache=_DetailsCache(0))
+        changed = other.change_subscription(attr.assoc(
+            loaded,
+            stripe_subscription_id=new_stripe_id + u"-with-another-length",
+        ))
+        self.expectThat(
+            database.get_subscription(details.subscription_id),
+            GoodEquals(changed),
+        )
+
+
 
 # TODO: A more integration-y test using network_client.
 
@@ -314,3 +999,29 @@ class MakeServiceTests(TestCase):
         ])
         service = makeService(options)
         verifyObject(IService, service)
+
+
+    def test_unknown_storage(self):
+        """
+        ``Options`` rejects a ``--storage`` value which is not the name of a
+        kind of store.
+        """
+        options = Options()
+        self.assertRaises(
+            UsageError,
+            options.parseOptions, [
+                b"--domain", b"s4.example.com",
+                b"--bucket-name", b"s4-bucket",
+                b"--state-path", self.mktemp(),
+                b"--listen-address", b"tcp:12345",
+                b"--storage", b"mongodb",
+            ],
+        )
+
+
+
+def sample(name, **labels):
+    """
+    Get the current value of a metric from the default registry.
+    """
+    return REGISTRY.get_sample_value(name, labels)
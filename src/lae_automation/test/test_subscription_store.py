@@ -0,0 +1,584 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+Tests for ``lae_automation.subscription_store``.
+"""
+
+from json import dumps
+from base64 import b32encode
+from sqlite3 import connect
+
+from zope.interface.verify import verifyObject
+
+from twisted.python.filepath import FilePath
+
+from testtools.matchers import (
+    Equals, Not, Raises, MatchesException, GreaterThan, HasLength,
+)
+
+from hypothesis import given, assume
+
+from lae_automation.subscription_store import (
+    SQLITE_DATABASE, ISubscriptionStore, DirectoryStore, SQLiteStore, migrate,
+)
+
+from lae_util.testtools import TestCase
+
+from .strategies import subscription_id, customer_id, emails
+
+
+def subscription_state(subscription_id, email, customer_id, version=3):
+    """
+    Make a minimal subscription state with the fields stores care about.
+    """
+    return dict(
+        version=version,
+        details=dict(
+            active=True,
+            id=subscription_id,
+            email=email,
+            customer_id=customer_id,
+            subscription_id=subscription_id,
+        ),
+    )
+
+
+
+def deactivate(state):
+    state["details"]["active"] = False
+    return state
+
+
+
+class SubscriptionStoreTestMixin(object):
+    """
+    Tests for ``ISubscriptionStore`` providers.
+
+    Subclasses will mix this in and override ``get_store`` to create an empty
+    store to subject to the tests and ``reopen`` to create another store
+    using the same persistent state as a given one.
+    """
+    def get_store(self):
+        raise NotImplementedError()
+
+
+    def reopen(self, store):
+        raise NotImplementedError()
+
+
+    def test_interface(self):
+        """
+        The store provides ``ISubscriptionStore``.
+        """
+        verifyObject(ISubscriptionStore, self.get_store())
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_round_trip(self, sid, email, cid):
+        """
+        A state added with ``create`` can be retrieved with ``get`` and is
+        included in the results of ``list_identifiers`` and ``list_states``.
+        """
+        store = self.get_store()
+        state = subscription_state(sid, email, cid)
+        store.create(sid, state)
+        self.expectThat(store.get(sid), Equals(state))
+        self.expectThat(store.list_identifiers(), Equals([sid]))
+        self.expectThat(store.list_identifiers(active_only=True), Equals([sid]))
+        self.expectThat(store.list_states(active_only=True), Equals([state]))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id())
+    def test_update(self, sid_a, sid_b, email, cid):
+        """
+        ``update`` replaces the state of only the given subscription with the
+        result of the given function.  Deactivated subscriptions are excluded
+        from the active listings and searches.
+        """
+        assume(sid_a != sid_b)
+        store = self.get_store()
+        store.create(sid_a, subscription_state(sid_a, email, cid))
+        store.create(sid_b, subscription_state(sid_b, email, cid))
+        expected = deactivate(subscription_state(sid_a, email, cid))
+
+        self.expectThat(store.update(sid_a, deactivate), Equals(expected))
+        self.expectThat(store.get(sid_a), Equals(expected))
+        self.expectThat(
+            sorted(store.list_identifiers()), Equals(sorted([sid_a, sid_b])),
+        )
+        self.expectThat(
+            store.list_identifiers(active_only=True), Equals([sid_b]),
+        )
+        self.expectThat(
+            store.list_states(active_only=True),
+            Equals([subscription_state(sid_b, email, cid)]),
+        )
+        self.expectThat(store.search(email=email), Equals([sid_b]))
+
+
+    @given(subscription_id(), subscription_id(), emails(), emails(), customer_id())
+    def test_search(self, sid_a, sid_b, email_a, email_b, cid):
+        """
+        ``search`` finds the active subscriptions with the given email address.
+        """
+        assume(sid_a != sid_b)
+        assume(email_a != email_b)
+        store = self.get_store()
+        store.create(sid_a, subscription_state(sid_a, email_a, cid))
+        store.create(sid_b, subscription_state(sid_b, email_b, cid))
+        self.expectThat(store.search(email=email_a), Equals([sid_a]))
+        self.expectThat(store.search(email=email_b), Equals([sid_b]))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id(), customer_id())
+    def test_search_fields(self, sid_a, sid_b, email, cid_a, cid_b):
+        """
+        ``search`` finds the active subscriptions matching all of the given
+        customer identifier, Stripe subscription identifier and email address.
+        """
+        assume(sid_a != sid_b)
+        assume(cid_a != cid_b)
+        store = self.get_store()
+        state_a = subscription_state(sid_a, email, cid_a)
+        state_a["details"]["stripe_subscription_id"] = sid_b
+        store.create(sid_a, state_a)
+        store.create(sid_b, subscription_state(sid_b, email, cid_b))
+
+        self.expectThat(store.search(customer_id=cid_a), Equals([sid_a]))
+        self.expectThat(store.search(customer_id=cid_b), Equals([sid_b]))
+        self.expectThat(
+            store.search(stripe_subscription_id=sid_b),
+            Equals(sorted([sid_a, sid_b])),
+        )
+        self.expectThat(
+            store.search(stripe_subscription_id=sid_b, customer_id=cid_b),
+            Equals([sid_b]),
+        )
+        self.expectThat(
+            store.search(email=email, customer_id=cid_a),
+            Equals([sid_a]),
+        )
+        self.expectThat(store.search(stripe_subscription_id=sid_a), Equals([]))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id(), customer_id())
+    def test_search_after_update(self, sid, stripe_id, email, cid_a, cid_b):
+        """
+        ``search`` finds subscriptions by the values of their fields after
+        ``update``, not before.
+        """
+        assume(cid_a != cid_b)
+        store = self.get_store()
+        store.create(sid, subscription_state(sid, email, cid_a))
+        self.expectThat(store.search(customer_id=cid_a), Equals([sid]))
+        def change(state):
+            state["details"]["customer_id"] = cid_b
+            state["details"]["stripe_subscription_id"] = stripe_id
+            return state
+        store.update(sid, change)
+        self.expectThat(store.search(customer_id=cid_a), Equals([]))
+        self.expectThat(store.search(customer_id=cid_b), Equals([sid]))
+        self.expectThat(store.search(stripe_subscription_id=stripe_id), Equals([sid]))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_list_identifiers_page(self, sid, email, cid):
+        """
+        ``list_identifiers`` includes only identifiers which sort after
+        ``after`` and no more than ``limit`` of them, in order.
+        """
+        store = self.get_store()
+        sids = list(sid + suffix for suffix in (u"d", u"b", u"c", u"a"))
+        for each in sids:
+            store.create(each, subscription_state(each, email, cid))
+        store.update(sid + u"b", deactivate)
+
+        self.expectThat(store.list_identifiers(), Equals(sorted(sids)))
+        self.expectThat(
+            store.list_identifiers(limit=2),
+            Equals([sid + u"a", sid + u"b"]),
+        )
+        self.expectThat(
+            store.list_identifiers(after=sid + u"b"),
+            Equals([sid + u"c", sid + u"d"]),
+        )
+        self.expectThat(
+            store.list_identifiers(active_only=True, after=sid + u"a", limit=2),
+            Equals([sid + u"c", sid + u"d"]),
+        )
+        self.expectThat(
+            store.list_identifiers(active_only=True, after=sid + u"d"),
+            Equals([]),
+        )
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id())
+    def test_list_active_other_writer(self, sid_a, sid_b, email, cid):
+        """
+        ``list_identifiers`` with ``active_only`` reflects writes made by
+        another store using the same persistent state.
+        """
+        assume(sid_a != sid_b)
+        store = self.get_store()
+        other = self.reopen(store)
+        store.create(sid_a, subscription_state(sid_a, email, cid))
+        self.expectThat(store.list_identifiers(active_only=True), Equals([sid_a]))
+        other.create(sid_b, subscription_state(sid_b, email, cid))
+        other.update(sid_a, deactivate)
+        self.expectThat(store.list_identifiers(active_only=True), Equals([sid_b]))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_stamp(self, sid, email, cid):
+        """
+        ``stamp`` returns a different value after the subscription is changed by
+        another store using the same persistent state.
+        """
+        store = self.get_store()
+        store.create(sid, subscription_state(sid, email, cid))
+        before = store.stamp(sid)
+        self.expectThat(store.stamp(sid), Equals(before))
+        self.reopen(store).update(sid, deactivate)
+        self.expectThat(store.stamp(sid), Not(Equals(before)))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_revision(self, sid, email, cid):
+        """
+        ``revision`` is ``0`` for an empty store and increases with each write,
+        including writes made by another store using the same persistent
+        state.
+        """
+        store = self.get_store()
+        self.expectThat(store.revision(), Equals(0))
+        store.create(sid, subscription_state(sid, email, cid))
+        created = store.revision()
+        self.expectThat(created, GreaterThan(0))
+        self.reopen(store).update(sid, deactivate)
+        self.expectThat(store.revision(), GreaterThan(created))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id())
+    def test_changes(self, sid_a, sid_b, email, cid):
+        """
+        ``changes`` returns the current revision and the states of the
+        subscriptions, active or not, written after the given revision.
+        """
+        assume(sid_a != sid_b)
+        store = self.get_store()
+        self.expectThat(store.changes(0), Equals((0, [])))
+
+        state_a = subscription_state(sid_a, email, cid)
+        store.create(sid_a, state_a)
+        first = store.revision()
+        self.expectThat(store.changes(0), Equals((first, [(sid_a, state_a)])))
+        self.expectThat(store.changes(first), Equals((first, [])))
+
+        state_b = subscription_state(sid_b, email, cid)
+        store.create(sid_b, state_b)
+        store.update(sid_a, deactivate)
+        current = store.revision()
+        revision, changes = store.changes(first)
+        self.expectThat(revision, Equals(current))
+        self.expectThat(
+            sorted(changes),
+            Equals(sorted([(sid_a, deactivate(state_a)), (sid_b, state_b)])),
+        )
+        self.expectThat(store.changes(current), Equals((current, [])))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id())
+    def test_changes_other_writer(self, sid_a, sid_b, email, cid):
+        """
+        ``changes`` includes writes made by another store using the same
+        persistent state, interleaved with writes made by this one.
+        """
+        assume(sid_a != sid_b)
+        store = self.get_store()
+        other = self.reopen(store)
+        state_a = subscription_state(sid_a, email, cid)
+        store.create(sid_a, state_a)
+        first = store.revision()
+        self.expectThat(store.changes(0), Equals((first, [(sid_a, state_a)])))
+
+        state_b = subscription_state(sid_b, email, cid)
+        other.create(sid_b, state_b)
+        second = store.revision()
+        self.expectThat(store.changes(first), Equals((second, [(sid_b, state_b)])))
+
+        store.update(sid_a, deactivate)
+        other.update(sid_b, deactivate)
+        current = store.revision()
+        revision, changes = store.changes(second)
+        self.expectThat(revision, Equals(current))
+        self.expectThat(
+            sorted(changes),
+            Equals(sorted([
+                (sid_a, deactivate(state_a)),
+                (sid_b, deactivate(state_b)),
+            ])),
+        )
+
+
+    def test_search_requires_known_criteria(self):
+        """
+        ``search`` raises ``ValueError`` if it is given no criteria or criteria
+        for fields it cannot search.
+        """
+        store = self.get_store()
+        self.expectThat(lambda: store.search(), Raises(MatchesException(ValueError)))
+        self.expectThat(
+            lambda: store.search(bucketname=u"s4"),
+            Raises(MatchesException(ValueError)),
+        )
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_search_pre_version_3(self, sid, email, cid):
+        """
+        Subscriptions with states from before version 3 are found by their
+        subscription identifier as their Stripe subscription identifier.
+        """
+        store = self.get_store()
+        store.create(sid, subscription_state(sid, email, cid, version=2))
+        self.assertThat(store.search(stripe_subscription_id=sid), Equals([sid]))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_import_states(self, sid, email, cid):
+        """
+        ``import_states`` adds all of the given subscriptions.
+        """
+        store = self.get_store()
+        states = list(
+            (sid + suffix, subscription_state(sid + suffix, email, cid))
+            for suffix in (u"a", u"b", u"c")
+        )
+        store.import_states(states)
+        self.expectThat(
+            sorted(
+                (sid, store.get(sid))
+                for sid in store.list_identifiers()
+            ),
+            Equals(states),
+        )
+
+
+
+class DirectoryStoreTests(SubscriptionStoreTestMixin, TestCase):
+    """
+    Tests for ``DirectoryStore``.
+    """
+    def get_store(self):
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        return DirectoryStore(path)
+
+
+    def reopen(self, store):
+        return DirectoryStore(store.path)
+
+
+    def test_ignores_other_files(self):
+        """
+        ``DirectoryStore`` ignores files in its directory which are not
+        subscription states, such as an SQLite database alongside them.
+        """
+        store = self.get_store()
+        store.path.child(SQLITE_DATABASE).setContent(b"not json")
+        self.expectThat(store.list_identifiers(), Equals([]))
+        self.expectThat(store.list_states(), Equals([]))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_search_index_maintained(self, sid, email, cid):
+        """
+        Subscriptions created after the first search are found by later
+        searches.
+        """
+        store = self.get_store()
+        self.expectThat(store.search(email=email), Equals([]))
+        store.create(sid, subscription_state(sid, email, cid))
+        self.expectThat(store.search(email=email), Equals([sid]))
+        store.update(sid, deactivate)
+        self.expectThat(store.search(email=email), Equals([]))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_list_active_pages_read_once(self, sid, email, cid):
+        """
+        Listing active subscriptions a page at a time reads each subscription
+        file once, not once per page.
+        """
+        store = self.get_store()
+        sids = list(sid + suffix for suffix in (u"a", u"b", u"c"))
+        for each in sids:
+            store.create(each, subscription_state(each, email, cid))
+
+        reads = []
+        read = DirectoryStore._read
+        def counting_read(self, path):
+            reads.append(path)
+            return read(self, path)
+        self.patch(DirectoryStore, "_read", counting_read)
+
+        listed = []
+        after = None
+        while True:
+            page = store.list_identifiers(active_only=True, after=after, limit=1)
+            if not page:
+                break
+            listed.extend(page)
+            after = page[-1]
+        self.expectThat(listed, Equals(sids))
+        self.expectThat(reads, HasLength(len(sids)))
+
+
+    @given(subscription_id(), subscription_id(), emails(), customer_id())
+    def test_changes_reads_changed_only(self, sid_a, sid_b, email, cid):
+        """
+        Once ``changes`` has indexed the directory, it reads only the files of
+        the subscriptions written after the given revision.
+        """
+        assume(sid_a != sid_b)
+        store = self.get_store()
+        store.create(sid_a, subscription_state(sid_a, email, cid))
+        state_b = subscription_state(sid_b, email, cid)
+        store.create(sid_b, state_b)
+        store.changes(0)
+        since = store.revision()
+        store.path.child(b32encode(sid_a) + u".json").setContent(b"not json")
+        store.update(sid_b, deactivate)
+        self.expectThat(
+            store.changes(since),
+            Equals((store.revision(), [(sid_b, deactivate(state_b))])),
+        )
+
+
+
+class SQLiteStoreTests(SubscriptionStoreTestMixin, TestCase):
+    """
+    Tests for ``SQLiteStore``.
+    """
+    def get_store(self):
+        return SQLiteStore.from_path(FilePath(self.mktemp().decode("utf-8")))
+
+
+    def reopen(self, store):
+        return SQLiteStore.from_path(store.path)
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_persistent(self, sid, email, cid):
+        """
+        Subscriptions are still there when the database is opened again.
+        """
+        store = self.get_store()
+        store.create(sid, subscription_state(sid, email, cid))
+        store.update(sid, deactivate)
+        reopened = SQLiteStore.from_path(store.path)
+        self.assertThat(
+            reopened.get(sid),
+            Equals(deactivate(subscription_state(sid, email, cid))),
+        )
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_add_columns(self, sid, email, cid):
+        """
+        Opening a database created before some of the search fields and the
+        revision existed adds columns for them, populated from the existing
+        states.
+        """
+        path = FilePath(self.mktemp().decode("utf-8"))
+        connection = connect(path.path)
+        connection.execute(
+            u"CREATE TABLE [subscriptions] ("
+            u"[id] TEXT PRIMARY KEY, [active] INTEGER NOT NULL, "
+            u"[email] TEXT, [customer_id] TEXT, [state] TEXT NOT NULL)"
+        )
+        state = subscription_state(sid, email, cid)
+        state["details"]["stripe_subscription_id"] = sid + u"-stripe"
+        connection.execute(
+            u"INSERT INTO [subscriptions] VALUES (?, ?, ?, ?, ?)",
+            (sid, True, email, cid, dumps(state).decode("ascii")),
+        )
+        connection.commit()
+        connection.close()
+
+        store = SQLiteStore.from_path(path)
+        self.expectThat(
+            store.search(stripe_subscription_id=sid + u"-stripe"),
+            Equals([sid]),
+        )
+        self.expectThat(store.search(email=email, customer_id=cid), Equals([sid]))
+        self.expectThat(store.changes(0), Equals((0, [])))
+        store.update(sid, deactivate)
+        self.expectThat(
+            store.changes(0), Equals((1, [(sid, deactivate(state))])),
+        )
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_failed_update(self, sid, email, cid):
+        """
+        If the function given to ``update`` raises an exception, the state is
+        not changed.
+        """
+        store = self.get_store()
+        state = subscription_state(sid, email, cid)
+        store.create(sid, state)
+        def broken(state):
+            raise ZeroDivisionError()
+        self.assertRaises(ZeroDivisionError, store.update, sid, broken)
+        self.assertThat(store.get(sid), Equals(state))
+
+
+
+class MigrateTests(TestCase):
+    """
+    Tests for ``migrate``.
+    """
+    def stores(self):
+        """
+        :return: An empty ``DirectoryStore`` and an empty ``SQLiteStore`` in the
+            same directory.
+        """
+        path = FilePath(self.mktemp().decode("utf-8"))
+        path.makedirs()
+        return DirectoryStore(path), SQLiteStore.from_path(path.child(SQLITE_DATABASE))
+
+
+    @given(subscription_id(), emails(), customer_id())
+    def test_copied(self, sid, email, cid):
+        """
+        Every subscription in the source store, active or not, is copied to the
+        destination store with its state (including its version) unchanged.
+        """
+        source, destination = self.stores()
+        source.create(sid + u"1", subscription_state(sid + u"1", email, cid, 1))
+        source.create(sid + u"2", subscription_state(sid + u"2", email, cid, 2))
+        source.create(sid + u"3", subscription_state(sid + u"3", email, cid))
+        source.update(sid + u"2", deactivate)
+
+        self.expectThat(migrate(source, destination), Equals(3))
+        for copied in source.list_identifiers():
+            self.expectThat(destination.get(copied), Equals(source.get(copied)))
+        self.expectThat(
+            destination.list_identifiers(active_only=True),
+            Equals([sid + u"1", sid + u"3"]),
+        )
+        self.expectThat(destination.search(email=email), Equals([sid + u"1", sid + u"3"]))
+
+
+    def test_refuses_nonempty_destination(self):
+        """
+        ``migrate`` raises ``ValueError`` rather than add to a store which
+        already has subscriptions.
+        """
+        source, destination = self.stores()
+        destination.create(
+            u"sub_a", subscription_state(u"sub_a", u"a@example.invalid", u"cus_a"),
+        )
+        self.assertRaises(ValueError, migrate, source, destination)
@@ -3,6 +3,8 @@
 
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+
 from twisted.logger import globalLogPublisher
 from twisted.internet.endpoints import serverFromString
 from twisted.application.service import MultiService, Service
@@ -10,7 +12,9 @@ from twisted.application.internet import StreamServerEndpointService
 from twisted.web.resource import Resource
 from twisted.web.server import Site
 
-from prometheus_client import Counter
+from prometheus_client import REGISTRY, CollectorRegistry, Counter
+from prometheus_client.core import Metric
+from prometheus_client.multiprocess import MultiProcessCollector
 from prometheus_client.twisted import MetricsResource
 
 _UNHANDLED_ERRORS = Counter(
@@ -20,8 +24,8 @@ _UNHANDLED_ERRORS = Counter(
 
 
 
-def get_metrics_service(options, reactor):
-    return prometheus_exporter(reactor, options["metrics-port"])
+def get_metrics_service(options, reactor, registry=None):
+    return prometheus_exporter(reactor, options["metrics-port"], registry)
 
 
 
@@ -36,15 +40,21 @@ def opt_metrics_port(cls):
 
 
 
-def prometheus_exporter(reactor, port_string):
+def prometheus_exporter(reactor, port_string, registry=None):
     """
     Create an ``IService`` that exposes Prometheus metrics from this process
     on an HTTP server on the given port.
+
+    :param registry: The ``CollectorRegistry`` from which to collect metrics
+        or ``None`` to use the default registry.
     """
+    if registry is None:
+        registry = REGISTRY
+
     parent = MultiService()
 
     root = Resource()
-    root.putChild(b"metrics", MetricsResource())
+    root.putChild(b"metrics", MetricsResource(registry))
     StreamServerEndpointService(
         serverFromString(reactor, port_string),
         Site(root),
@@ -57,6 +67,74 @@ def prometheus_exporter(reactor, port_string):
 
 
 
+def multiprocess_registry(path):
+    """
+    Create a registry which collects the metrics written to a directory by
+    other processes running in prometheus_client's multi-process mode as
+    well as the metrics of this process.
+
+    :param unicode path: The directory the other processes write to.
+
+    :return CollectorRegistry: The new registry.
+    """
+    registry = CollectorRegistry()
+    registry.register(_CombinedCollector(
+        MultiProcessCollector(None, path),
+        REGISTRY,
+    ))
+    return registry
+
+
+
+class _CombinedCollector(object):
+    """
+    Collect the metrics of several collectors.  Where more than one collector
+    has a counter with the same name, the counts are added together.
+    Otherwise, where more than one collector has a metric with the same name,
+    the first one wins.
+    """
+    def __init__(self, *collectors):
+        self._collectors = collectors
+
+
+    def collect(self):
+        metrics = OrderedDict()
+        for collector in self._collectors:
+            for metric in collector.collect():
+                existing = metrics.get(metric.name)
+                if existing is None:
+                    metrics[metric.name] = metric
+                elif existing.type == metric.type == "counter":
+                    metrics[metric.name] = _add_counters(existing, metric)
+        return list(metrics.values())
+
+
+
+def _add_counters(a, b):
+    """
+    :return Metric: A counter with the sum of the samples of two counters.
+    """
+    totals = OrderedDict()
+    for (name, labels, value) in a.samples + b.samples:
+        key = (name, tuple(sorted(labels.items())))
+        totals[key] = totals.get(key, 0.0) + value
+
+    total = Metric(a.name, a.documentation, a.type)
+    for (name, labels), value in totals.items():
+        total.add_sample(name, dict(labels), value)
+    return total
+
+
+
+def error_metrics_service():
+    """
+    Create an ``IService`` which counts unhandled errors for publication as a
+    metric (for processes which do not publish their own metrics).
+    """
+    return _ExtraMetrics()
+
+
+
 class _ExtraMetrics(Service):
     """
     Collect additional metrics to be published.
@@ -82,13 +82,22 @@ class EventChannel(object):
     def subscribe(self):
         """
         Get a L{Deferred} which will fire with the next event on this channel.
+        Cancelling it (for example, with L{Deferred.addTimeout}) ends the
+        subscription.
 
         @rtype: L{Deferred}
         """
-        d = Deferred(canceller=self._subscriptions.remove)
+        d = Deferred(canceller=self._unsubscribe)
         self._subscriptions.append(d)
         return d
 
+    def _unsubscribe(self, d):
+        """
+        Forget about a subscription, if it is still current.
+        """
+        if d in self._subscriptions:
+            self._subscriptions.remove(d)
+
 
 _dummyRequestCounter = iter(count())
 
@@ -0,0 +1,78 @@
+# Copyright Least Authority Enterprises.
+# See LICENSE for details.
+
+"""
+Tests for ``lae_util._prometheus``.
+"""
+
+from testtools.matchers import Equals
+
+from prometheus_client.core import Metric
+
+from ..testtools import TestCase
+from .._prometheus import _CombinedCollector
+
+
+class _FixedCollector(object):
+    def __init__(self, *metrics):
+        self._metrics = metrics
+
+    def collect(self):
+        return self._metrics
+
+
+
+def _metric(name, type, *samples):
+    metric = Metric(name, u"", type)
+    for (labels, value) in samples:
+        metric.add_sample(name, labels, value)
+    return metric
+
+
+
+def _samples(metrics):
+    return {
+        metric.name: sorted(
+            (tuple(sorted(labels.items())), value)
+            for (_, labels, value) in metric.samples
+        )
+        for metric in metrics
+    }
+
+
+
+class CombinedCollectorTests(TestCase):
+    """
+    Tests for ``_CombinedCollector``.
+    """
+    def test_counters_added(self):
+        """
+        Counters with the same name are added together, label by label.
+        """
+        collector = _CombinedCollector(
+            _FixedCollector(_metric(u"c", u"counter", ({u"a": u"x"}, 1.0), ({u"a": u"y"}, 2.0))),
+            _FixedCollector(_metric(u"c", u"counter", ({u"a": u"x"}, 3.0))),
+        )
+        self.assertThat(
+            _samples(collector.collect()),
+            Equals({u"c": [(((u"a", u"x"),), 4.0), (((u"a", u"y"),), 2.0)]}),
+        )
+
+
+    def test_first_wins(self):
+        """
+        For other metrics with the same name, only the one from the first
+        collector is collected.  Metrics with different names are all
+        collected.
+        """
+        collector = _CombinedCollector(
+            _FixedCollector(_metric(u"g", u"gauge", ({}, 1.0))),
+            _FixedCollector(
+                _metric(u"g", u"gauge", ({}, 5.0)),
+                _metric(u"h", u"gauge", ({}, 7.0)),
+            ),
+        )
+        self.assertThat(
+            _samples(collector.collect()),
+            Equals({u"g": [((), 1.0)], u"h": [((), 7.0)]}),
+        )
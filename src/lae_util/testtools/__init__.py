@@ -78,11 +78,18 @@ class FakeProcessTransport(object):
     Mock process transport to observe signals sent to a process.
 
     @ivar signals: L{list} of signals sent to process.
+    @ivar written: L{list} of L{bytes} written to the process's stdin.
+    @ivar pid: The process id.
     """
 
-    def __init__(self):
+    def __init__(self, pid=None):
         self.signals = []
         self.stdin_open = [True]
+        self.written = []
+        self.pid = pid
+
+    def write(self, data):
+        self.written.append(data)
 
     def signalProcess(self, signal):
         self.signals.append(signal)
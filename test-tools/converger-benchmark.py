@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+#
+# Measure the performance of the S4 subscription converger.
+#
+# This runs ``converge`` (the same function the convergence service runs on
+# every iteration) against txkube's in-memory Kubernetes, txaws's in-memory
+# Route53, and a subscription manager backed by a temporary directory, all
+# populated with a synthetic set of active subscriptions.
+#
+# For each number of subscriptions, it reports:
+#
+#   - cold start: the wall time of the first iteration (which creates
+#     everything) and the API calls it issued
+#   - steady state: the mean wall time and CPU usage of the following
+#     iterations (which should change nothing) and the API calls each issued
+#   - the peak resident set size of the process
+#
+# Usage:
+#
+#     converger-benchmark.py [--subscriptions N ...] [--iterations N]
+#         [--parallelism N] [--kubernetes-latency SECONDS]
+#         [--route53-latency SECONDS] [--subscription-manager-latency SECONDS]
+#         [--storage directory|sqlite]
+#
+# By default, 100, 1000, 10000, and 50000 subscriptions are measured.  Each
+# number of subscriptions is measured in a fresh process so that peak memory
+# usage is reported separately for each.  The latency options delay every
+# request to the corresponding service by a fixed amount to approximate the
+# round trip to a real one.
+#
+# The in-memory Kubernetes cannot list a single namespace so each selection
+# shows up as two requests: the rejected namespaced list and the cluster-wide
+# list which replaces it.
+#
+# All of the synthetic subscriptions share one set of Tahoe-LAFS secrets
+# because generating them is much slower than converging on them.  This only
+# works on Linux (getrusage reports peak memory usage in KiB there).
+#
+
+from __future__ import print_function
+
+from sys import argv, executable
+from os import times
+from subprocess import check_call
+from tempfile import mkdtemp
+from shutil import rmtree
+from collections import Counter
+from resource import RUSAGE_SELF, getrusage
+
+import attr
+
+from zope.interface import implementer
+
+from hyperlink import URL
+
+from twisted.python.usage import Options, UsageError
+from twisted.python.filepath import FilePath
+from twisted.internet.task import react, deferLater
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.web.iweb import IAgent
+
+from txkube import memory_kubernetes
+
+from txaws.testing.service import FakeAWSServiceRegion
+
+from lae_util.memoryagent import MemoryAgent
+from lae_util.uncooperator import Uncooperator
+
+from lae_automation.model import DeploymentConfiguration, SubscriptionDetails
+from lae_automation.subscription_manager import (
+    SubscriptionDatabase, Client, make_resource,
+)
+from lae_automation.subscription_store import STORES
+from lae_automation.subscription_converger import (
+    converge, _ZoneCache, _SubscriptionCache,
+)
+from lae_automation.kubeclient import KubeClient
+
+DOMAIN = u"s4.example.com"
+BUCKET = u"s4"
+
+# The collections the converger works with, for classifying Kubernetes
+# requests.
+COLLECTIONS = {u"configmaps", u"deployments", u"replicasets", u"pods", u"services"}
+
+
+class BenchmarkOptions(Options):
+    optParameters = [
+        ("iterations", None, 5,
+         "The number of steady state iterations to measure.",
+         int,
+        ),
+        ("parallelism", None, 8,
+         "The greatest number of changes to make at once.",
+         int,
+        ),
+        ("kubernetes-latency", None, 0.0,
+         "The number of seconds to delay each Kubernetes request.",
+         float,
+        ),
+        ("route53-latency", None, 0.0,
+         "The number of seconds to delay each Route53 request.",
+         float,
+        ),
+        ("subscription-manager-latency", None, 0.0,
+         "The number of seconds to delay each subscription manager request.",
+         float,
+        ),
+        ("storage", None, u"directory",
+         "The kind of store the subscription manager keeps subscriptions in.",
+        ),
+    ]
+
+    def __init__(self):
+        Options.__init__(self)
+        self["subscriptions"] = []
+
+
+    def opt_subscriptions(self, count):
+        """
+        A number of subscriptions to measure (may be given more than once).
+        """
+        self["subscriptions"].append(int(count))
+
+
+    def postOptions(self):
+        if not self["subscriptions"]:
+            self["subscriptions"] = [100, 1000, 10000, 50000]
+        if self["iterations"] < 1:
+            raise UsageError("--iterations must be positive")
+        if self["parallelism"] < 1:
+            raise UsageError("--parallelism must be positive")
+        self["storage"] = self["storage"].decode("ascii")
+        if self["storage"] not in STORES:
+            raise UsageError("--storage must be one of {}".format(
+                ", ".join(sorted(STORES)),
+            ))
+
+
+
+def delayed(reactor, latency, f, *args, **kwargs):
+    """
+    Call a function after a delay (or right away if there is none).
+    """
+    if latency:
+        return deferLater(reactor, latency, f, *args, **kwargs)
+    return f(*args, **kwargs)
+
+
+
+def kubernetes_request_kind(method, uri):
+    segments = URL.from_text(uri.decode("ascii")).path
+    collection = next(
+        (segment for segment in segments if segment in COLLECTIONS),
+        u"/".join(segments),
+    )
+    return u"{} {}".format(method.decode("ascii"), collection)
+
+
+
+def subscription_manager_request_kind(method, uri):
+    segments = URL.from_text(uri.decode("ascii")).path
+    return u"{} {}".format(method.decode("ascii"), u"/".join(segments[:2]))
+
+
+
+@implementer(IAgent)
+@attr.s
+class InstrumentedAgent(object):
+    """
+    Count and delay the requests made with another agent.
+
+    :ivar unicode service: The name of the service the agent talks to.
+
+    :ivar classify: A two-argument callable which takes a request method and
+        URI and returns a description of the request to count it under.
+
+    :ivar Counter calls: Requests counted by service and description.
+    """
+    reactor = attr.ib()
+    agent = attr.ib()
+    latency = attr.ib()
+    service = attr.ib()
+    classify = attr.ib()
+    calls = attr.ib()
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        self.calls[(self.service, self.classify(method, uri))] += 1
+        return delayed(
+            self.reactor, self.latency,
+            self.agent.request, method, uri, headers, bodyProducer,
+        )
+
+
+
+@attr.s
+class InstrumentedRoute53(object):
+    """
+    Count and delay the requests made with a Route53 client.
+    """
+    reactor = attr.ib()
+    route53 = attr.ib()
+    latency = attr.ib()
+    calls = attr.ib()
+
+    def __getattr__(self, name):
+        method = getattr(self.route53, name)
+        def request(*args, **kwargs):
+            self.calls[(u"route53", name.decode("ascii"))] += 1
+            return delayed(self.reactor, self.latency, method, *args, **kwargs)
+        return request
+
+
+
+@attr.s
+class InstrumentedRegion(object):
+    """
+    Supply ``InstrumentedRoute53`` clients.
+    """
+    reactor = attr.ib()
+    region = attr.ib()
+    latency = attr.ib()
+    calls = attr.ib()
+
+    def get_route53_client(self):
+        return InstrumentedRoute53(
+            self.reactor, self.region.get_route53_client(), self.latency, self.calls,
+        )
+
+
+
+def populate(database, count):
+    """
+    Create some active subscriptions.
+
+    :param SubscriptionDatabase database: The database in which to create
+        them.
+
+    :param int count: The number of subscriptions to create.
+    """
+    template = database.create_subscription(
+        subscription_id=u"sub_template",
+        details=SubscriptionDetails(
+            bucketname=None,
+            oldsecrets={},
+            customer_email=u"benchmark@example.invalid",
+            customer_pgpinfo=None,
+            product_id=u"S4_consumer_iteration_2_beta1_2014-05-27",
+            customer_id=u"cus_benchmark",
+            subscription_id=u"sub_template",
+            stripe_subscription_id=u"sub_template",
+            introducer_port_number=None,
+            storage_port_number=None,
+        ),
+    )
+    database.deactivate_subscription(template.subscription_id)
+    for i in range(count):
+        subscription_id = u"sub_{:08d}".format(i)
+        database.load_subscription(attr.assoc(
+            template,
+            subscription_id=subscription_id,
+            stripe_subscription_id=subscription_id,
+            key_prefix=subscription_id + u"/",
+        ))
+
+
+
+def resources():
+    """
+    :return: A two-tuple of the CPU time (user and system) used by this
+        process so far and its peak resident set size in KiB.
+    """
+    user, system = times()[:2]
+    return user + system, getrusage(RUSAGE_SELF).ru_maxrss
+
+
+
+@inlineCallbacks
+def iteration(reactor, calls, converger):
+    calls.clear()
+    started = reactor.seconds()
+    cpu_started, _ = resources()
+    yield converger()
+    cpu, _ = resources()
+    returnValue((reactor.seconds() - started, cpu - cpu_started, Counter(calls)))
+
+
+
+@inlineCallbacks
+def measure(reactor, options, count):
+    calls = Counter()
+
+    database_path = FilePath(mkdtemp().decode("utf-8"))
+    try:
+        database = SubscriptionDatabase.from_directory(
+            database_path, DOMAIN, BUCKET, options["storage"],
+        )
+        populate(database, count)
+
+        subscriptions = Client(
+            endpoint=b"/",
+            agent=InstrumentedAgent(
+                reactor,
+                MemoryAgent(make_resource(
+                    database_path, DOMAIN, BUCKET, options["storage"],
+                )),
+                options["subscription-manager-latency"],
+                u"subscription-manager",
+                subscription_manager_request_kind,
+                calls,
+            ),
+            cooperator=Uncooperator(),
+        )
+
+        k8s_client = memory_kubernetes().client()
+        k8s = KubeClient(k8s=attr.assoc(
+            k8s_client,
+            agent=InstrumentedAgent(
+                reactor,
+                k8s_client.agent,
+                options["kubernetes-latency"],
+                u"kubernetes",
+                kubernetes_request_kind,
+                calls,
+            ),
+        ))
+
+        config = DeploymentConfiguration(
+            domain=DOMAIN,
+            kubernetes_namespace=u"benchmark",
+            subscription_manager_endpoint=URL.from_text(u"http://localhost:8000"),
+            s3_access_key_id=u"access key id",
+            s3_secret_key=u"secret key",
+            introducer_image=u"introducer:benchmark",
+            storageserver_image=u"storageserver:benchmark",
+        )
+        region = FakeAWSServiceRegion(
+            access_key=config.s3_access_key_id,
+            secret_key=config.s3_secret_key,
+        )
+        yield region.get_route53_client().create_hosted_zone(u"benchmark", DOMAIN)
+        aws = InstrumentedRegion(reactor, region, options["route53-latency"], calls)
+
+        # Remember the zone and the subscriptions between iterations as the
+        # convergence service does.
+        zones = _ZoneCache(reactor, 3600.0)
+        subscription_cache = _SubscriptionCache()
+
+        def converger():
+            return converge(
+                config, subscriptions, k8s, aws,
+                parallelism=options["parallelism"],
+                zones=zones,
+                subscription_cache=subscription_cache,
+            )
+
+        cold = yield iteration(reactor, calls, converger)
+        steady = []
+        for i in range(options["iterations"]):
+            steady.append((yield iteration(reactor, calls, converger)))
+        returnValue((cold, steady))
+    finally:
+        rmtree(database_path.path)
+
+
+
+def report_calls(calls, iterations):
+    for ((service, kind), count) in sorted(calls.items()):
+        print(u"        {:<48} {:.1f}".format(
+            u"{}: {}".format(service, kind), count / float(iterations),
+        ))
+
+
+
+def report(count, cold, steady):
+    (cold_elapsed, cold_cpu, cold_calls) = cold
+    steady_elapsed = sum(elapsed for (elapsed, cpu, calls) in steady)
+    steady_cpu = sum(cpu for (elapsed, cpu, calls) in steady)
+    steady_calls = sum((calls for (elapsed, cpu, calls) in steady), Counter())
+
+    print(u"subscriptions={}".format(count))
+    print(u"    cold start:     {:.2f} s".format(cold_elapsed))
+    print(u"    cold start API calls:")
+    report_calls(cold_calls, 1)
+    print(u"    steady state:   {:.2f} s per iteration".format(
+        steady_elapsed / len(steady),
+    ))
+    print(u"    steady CPU:     {:.2f} s per iteration ({:.0f}%)".format(
+        steady_cpu / len(steady),
+        100 * steady_cpu / steady_elapsed if steady_elapsed else 0,
+    ))
+    print(u"    steady state API calls per iteration:")
+    report_calls(steady_calls, len(steady))
+    print(u"    peak RSS:       {} KiB".format(resources()[1]))
+
+
+
+@inlineCallbacks
+def main(reactor, *args):
+    options = BenchmarkOptions()
+    try:
+        options.parseOptions(args)
+    except UsageError as e:
+        raise SystemExit(u"{}\n{}".format(e, options))
+
+    [count] = options["subscriptions"]
+    cold, steady = yield measure(reactor, options, count)
+    report(count, cold, steady)
+
+
+
+def run(args):
+    options = BenchmarkOptions()
+    try:
+        options.parseOptions(args)
+    except UsageError as e:
+        raise SystemExit(u"{}\n{}".format(e, options))
+
+    counts = options["subscriptions"]
+    if len(counts) == 1:
+        react(main, args)
+
+    # Measure each number of subscriptions in its own process.
+    others = []
+    args = iter(args)
+    for arg in args:
+        if arg == b"--subscriptions":
+            next(args)
+        elif not arg.startswith(b"--subscriptions="):
+            others.append(arg)
+    for count in counts:
+        check_call(
+            [executable, __file__, b"--subscriptions={}".format(count)] + others,
+        )
+
+
+
+if __name__ == '__main__':
+    run(argv[1:])
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+#
+# Measure the performance of the S4 grid router.
+#
+# This starts a grid router worker process (the same proxy code which runs in
+# production, see ``s4-grid-router --workers``) with a synthetic route table
+# pointing at echo servers on loopback.  Then it makes many connections
+# through the router.  Each connection sends a Foolscap negotiation header,
+# waits for it to come back from the echo server via the router, relays some
+# more data, and closes.
+#
+# For each combination of route table size and concurrency level, it reports:
+#
+#   - connections completed per second
+#   - p50/p99 setup latency (connect, header through the router and back)
+#   - relay throughput (median per connection and aggregate)
+#   - the router process's resident set size (current and peak)
+#
+# Usage:
+#
+#     grid-router-benchmark.py [--routes N ...] [--concurrency N ...]
+#         [--connections N] [--payload-size BYTES] [--backends N]
+#
+# By default, 1000 and 10000 routes are each measured at 100 and 1000
+# concurrent connections.
+#
+# The router listens on port 10000 (as it does in production) so nothing
+# else may be listening there.  High concurrency levels need many file
+# descriptors.  The soft limit is raised to the hard limit but you may need
+# to raise the hard limit (ulimit -Hn) as well.  This only works on Linux
+# (router memory usage comes from /proc).
+#
+
+from __future__ import print_function
+
+from sys import argv, executable
+from os import environ
+from resource import RLIMIT_NOFILE, getrlimit, setrlimit
+
+import attr
+
+from pyrsistent import pmap
+
+from twisted.python.usage import Options, UsageError
+from twisted.python.filepath import FilePath
+from twisted.internet.task import react, cooperate, deferLater
+from twisted.internet.defer import Deferred, gatherResults, inlineCallbacks, returnValue
+from twisted.internet.protocol import Factory, Protocol, ProcessProtocol
+from twisted.internet.endpoints import TCP4ClientEndpoint, TCP4ServerEndpoint
+
+from grid_router._router import _Route, _routes_to_json
+
+ROUTER_PORT = 10000
+
+
+class BenchmarkOptions(Options):
+    optParameters = [
+        ("connections", None, 5000,
+         "The number of connections to make for each measurement.",
+         int,
+        ),
+        ("payload-size", None, 2 ** 16,
+         "The number of bytes to relay in each direction over each connection.",
+         int,
+        ),
+        ("backends", None, 16,
+         "The number of echo servers to spread the routes over.",
+         int,
+        ),
+    ]
+
+    def __init__(self):
+        Options.__init__(self)
+        self["routes"] = []
+        self["concurrency"] = []
+
+
+    def opt_routes(self, count):
+        """
+        A route table size to measure (may be given more than once).
+        """
+        self["routes"].append(int(count))
+
+
+    def opt_concurrency(self, count):
+        """
+        A number of concurrent connections to measure (may be given more than
+        once).
+        """
+        self["concurrency"].append(int(count))
+
+
+    def postOptions(self):
+        if not self["routes"]:
+            self["routes"] = [1000, 10000]
+        if not self["concurrency"]:
+            self["concurrency"] = [100, 1000]
+        if self["connections"] < 1:
+            raise UsageError("--connections must be positive")
+
+
+
+class Echo(Protocol):
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+
+
+@attr.s
+class Result(object):
+    setup = attr.ib()
+    relay = attr.ib()
+
+
+
+class Client(Protocol):
+    """
+    Negotiate through the router to an echo server and then relay a payload.
+
+    :ivar Deferred done: Fires with a ``Result`` when the payload has been
+        relayed in both directions or fails if the connection is lost first.
+    """
+    def __init__(self, clock, started, header, payload_size):
+        self.clock = clock
+        self.started = started
+        self.header = header
+        self.payload_size = payload_size
+        self.done = Deferred()
+        self.result = None
+
+
+    def connectionMade(self):
+        self.remaining = len(self.header)
+        self.transport.write(self.header)
+
+
+    def dataReceived(self, data):
+        self.remaining -= len(data)
+        if self.remaining > 0:
+            return
+        now = self.clock.seconds()
+        if not hasattr(self, "setup"):
+            self.setup = now - self.started
+            self.relay_started = now
+            self.remaining = self.payload_size
+            self.transport.write(b"\0" * self.payload_size)
+        else:
+            self.result = Result(setup=self.setup, relay=now - self.relay_started)
+            self.transport.loseConnection()
+
+
+    def connectionLost(self, reason):
+        if self.result is None:
+            self.done.errback(reason)
+        else:
+            self.done.callback(self.result)
+
+
+
+def negotiation_header(tub_id):
+    return (
+        u"GET /id/{} HTTP/1.1\r\n"
+        u"Host: example.invalid\r\n"
+        u"Upgrade: TLS/1.0\r\n"
+        u"Connection: Upgrade\r\n"
+        u"\r\n"
+    ).format(tub_id).encode("ascii")
+
+
+
+def one_connection(reactor, tub_id, payload_size):
+    started = reactor.seconds()
+    client = Client(reactor, started, negotiation_header(tub_id), payload_size)
+    endpoint = TCP4ClientEndpoint(reactor, b"127.0.0.1", ROUTER_PORT)
+    d = endpoint.connect(Factory.forProtocol(lambda: client))
+    d.addCallback(lambda ignored: client.done)
+    return d
+
+
+
+class RouterProcess(ProcessProtocol):
+    """
+    Run a grid router worker process.
+    """
+    def __init__(self):
+        self.ended = Deferred()
+
+    def outReceived(self, data):
+        pass
+
+    errReceived = outReceived
+
+    def processEnded(self, reason):
+        self.ended.callback(None)
+
+
+    def rss(self):
+        """
+        :return: A two-tuple of the current and peak resident set size of the
+            router process in KiB.
+        """
+        status = FilePath(b"/proc").child(b"%d" % (self.transport.pid,)).child(b"status")
+        fields = dict(
+            line.split(b":", 1)
+            for line in status.getContent().splitlines()
+            if b":" in line
+        )
+        def kib(name):
+            return int(fields[name].split()[0])
+        return kib(b"VmRSS"), kib(b"VmHWM")
+
+
+
+@inlineCallbacks
+def start_router(reactor, routes):
+    process = RouterProcess()
+    reactor.spawnProcess(
+        process,
+        executable,
+        [executable, b"-m", b"twisted", b"s4-grid-router", b"--worker-index", b"0"],
+        env=environ,
+        childFDs={0: "w", 1: "r", 2: "r"},
+    )
+    process.transport.write(_routes_to_json(routes) + b"\n")
+
+    # Wait until the router is listening and has the routes.
+    tub_id = next(iter(routes))
+    while True:
+        try:
+            yield one_connection(reactor, tub_id, 1)
+        except Exception:
+            yield deferLater(reactor, 0.1, lambda: None)
+        else:
+            break
+    returnValue(process)
+
+
+
+@inlineCallbacks
+def stop_router(process):
+    process.transport.closeStdin()
+    yield process.ended
+
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+
+@inlineCallbacks
+def measure(reactor, routes, concurrency, connections, payload_size):
+    tub_ids = list(routes)
+    results = []
+    failures = []
+
+    def work():
+        for i in range(connections):
+            d = one_connection(reactor, tub_ids[i % len(tub_ids)], payload_size)
+            d.addCallbacks(results.append, failures.append)
+            yield d
+
+    started = reactor.seconds()
+    work = work()
+    yield gatherResults([
+        cooperate(work).whenDone()
+        for i in range(concurrency)
+    ])
+    elapsed = reactor.seconds() - started
+    returnValue((elapsed, results, failures))
+
+
+
+def report(route_count, concurrency, payload_size, elapsed, results, failures, rss):
+    print(u"routes={} concurrency={}".format(route_count, concurrency))
+    print(u"    completed:      {} ({} failed)".format(len(results), len(failures)))
+    print(u"    connections/s:  {:.1f}".format(len(results) / elapsed))
+    if results:
+        setup = [r.setup * 1000 for r in results]
+        rates = [payload_size * 2 / r.relay / 2 ** 20 for r in results if r.relay > 0]
+        print(u"    setup p50/p99:  {:.2f} ms / {:.2f} ms".format(
+            percentile(setup, 0.50), percentile(setup, 0.99),
+        ))
+        if rates:
+            print(u"    relay median:   {:.1f} MiB/s per connection".format(
+                percentile(rates, 0.50),
+            ))
+        print(u"    relay total:    {:.1f} MiB/s".format(
+            len(results) * payload_size * 2 / elapsed / 2 ** 20,
+        ))
+    print(u"    router RSS:     {} KiB (peak {} KiB)".format(*rss))
+
+
+
+@inlineCallbacks
+def main(reactor, *args):
+    options = BenchmarkOptions()
+    try:
+        options.parseOptions(args)
+    except UsageError as e:
+        raise SystemExit(u"{}\n{}".format(e, options))
+
+    soft, hard = getrlimit(RLIMIT_NOFILE)
+    setrlimit(RLIMIT_NOFILE, (hard, hard))
+
+    backends = yield gatherResults([
+        TCP4ServerEndpoint(reactor, 0, interface=b"127.0.0.1").listen(
+            Factory.forProtocol(Echo),
+        )
+        for i in range(options["backends"])
+    ])
+    ports = [b.getHost().port for b in backends]
+
+    for route_count in options["routes"]:
+        routes = pmap({
+            u"{:032x}".format(i): _Route(
+                u"127.0.0.1", ports[i % len(ports)], u"pod-{}".format(i), u"storage",
+            )
+            for i in range(route_count)
+        })
+        for concurrency in options["concurrency"]:
+            router = yield start_router(reactor, routes)
+            try:
+                elapsed, results, failures = yield measure(
+                    reactor, routes, concurrency,
+                    options["connections"], options["payload-size"],
+                )
+                report(
+                    route_count, concurrency, options["payload-size"],
+                    elapsed, results, failures, router.rss(),
+                )
+            finally:
+                yield stop_router(router)
+
+    yield gatherResults([b.stopListening() for b in backends])
+
+
+
+if __name__ == '__main__':
+    react(main, argv[1:])